@@ -31,13 +31,17 @@ setup(
     setup_requires=['pytest-runner'],
     install_requires=get_requirements(),
     tests_require=['pytest'],
-    scripts=['bin/xbsort', 'bin/xbsplit', 'bin/xbcp2bin'],
+    scripts=['bin/xbcp2bin'],
     entry_points={
         'console_scripts': ['xbdef = xtrabufr._scripts_:_xbdef_',
                             'xbcopy = xtrabufr._scripts_:_xbcopy_',
                             'xbprint = xtrabufr._scripts_:_xbprint_',
                             'xbfilter = xtrabufr._scripts_:_xbfilter_',
-                            'xbsynop = xtrabufr._scripts_:_xbsynop_'],
+                            'xbsynop = xtrabufr._scripts_:_xbsynop_',
+                            'xbindex = xtrabufr._scripts_:_xbindex_',
+                            'xbsort = xtrabufr._scripts_:_xbsort_',
+                            'xbsplit = xtrabufr._scripts_:_xbsplit_',
+                            'xbdedup = xtrabufr._scripts_:_xbdedup_'],
     },
     author=get('author'),
     author_email=get('email'),
@@ -0,0 +1,90 @@
+"""
+Fixtures of BUFR messages built from ecCodes samples
+"""
+
+import pytest
+import eccodes as _ec
+import xtrabufr.definitions as _definitions
+
+
+def make_message(sample='BUFR4', stations=(130,), compressed=0,
+                 temperature=None, descriptors=(1001, 1002, 12101),
+                 replication=None):
+    """Binary content of a synoptic like message
+
+    :param sample: Name of ecCodes sample (i.e. BUFR3_local)
+    :param stations: Station numbers of subsets (block number is 17)
+    :param compressed: 1 for a compressed message
+    :param temperature: Air temperatures of subsets
+    :param descriptors: unexpandedDescriptors
+    :param replication: Delayed replication factors of subsets
+    :returns: bytes
+    """
+    n = len(stations)
+    if temperature is None:
+        temperature = [280.0 + i for i in range(n)]
+    h = _ec.codes_bufr_new_from_samples(sample)
+    try:
+        _ec.codes_set(h, 'numberOfSubsets', n)
+        _ec.codes_set(h, 'compressedData', compressed)
+        if replication is not None:
+            _ec.codes_set_array(h, 'inputDelayedDescriptorReplicationFactor',
+                                list(replication))
+        _ec.codes_set_array(h, 'unexpandedDescriptors', list(descriptors))
+        _ec.codes_set_array(h, 'blockNumber', [17] * n)
+        _ec.codes_set_array(h, 'stationNumber', list(stations))
+        _ec.codes_set_array(h, 'airTemperature', list(temperature))
+        _ec.codes_set(h, 'pack', 1)
+        return(_ec.codes_get_message(h))
+    finally:
+        _ec.codes_release(h)
+
+
+def write_file(path, messages):
+    with open(str(path), 'wb') as f:
+        for m in messages:
+            f.write(m)
+    return(str(path))
+
+
+ELEMENT_TABLE = (
+    '#code|abbreviation|type|name|unit|scale|reference|width\n'
+    '001001|blockNumber|long|WMO BLOCK NUMBER|Numeric|0|0|7\n'
+    '001002|stationNumber|long|WMO STATION NUMBER|Numeric|0|0|10\n'
+    '002001|stationType|table|TYPE OF STATION|CODE TABLE|0|0|2\n')
+SEQUENCE_DEF = ('"301004" = [  301001, 002001 ]\n'
+                '"301001" = [  001001, 001002 ]\n')
+BUFR_TEMPLATE = 'stationId = {unexpandedDescriptors = [301004];}\n'
+
+
+@pytest.fixture
+def defs(tmpdir, monkeypatch):
+    """Definitions on file system with an empty cache"""
+    root = tmpdir.mkdir('definitions')
+    wmo = root.mkdir('bufr').mkdir('tables').mkdir('0').mkdir('wmo')
+    latest = wmo.mkdir('latest')
+    latest.join('element.table').write(ELEMENT_TABLE)
+    latest.join('sequence.def').write(SEQUENCE_DEF)
+    root.join('bufr').mkdir('templates').join('BufrTemplate.def').write(
+        BUFR_TEMPLATE)
+    monkeypatch.setattr(_definitions, '_codes_definition_path_', str(root))
+    monkeypatch.setattr(_definitions, '_cache_dir_', str(tmpdir.join('c')))
+    monkeypatch.setattr(_definitions, '_def_catch_', {})
+    return(latest)
+
+
+@pytest.fixture
+def bufr_file(tmpdir):
+    """A file of 3 messages of 1, 2 and 3 subsets"""
+    return(write_file(tmpdir.join('a.bufr'),
+                      [make_message(stations=range(130, 130 + i))
+                       for i in (1, 2, 3)]))
+
+
+@pytest.fixture
+def local_file(tmpdir):
+    """Messages with ECMWF local section (uncompressed and compressed)"""
+    return(write_file(tmpdir.join('local.bufr'),
+                      [make_message('BUFR3_local', (130, 131)),
+                       make_message('BUFR4_local', (130, 131)),
+                       make_message('BUFR4_local', (130, 131, 132), 1)]))
@@ -0,0 +1,87 @@
+import os
+import array
+import numpy as np
+import xtrabufr as xb
+import xtrabufr._extra_ as _extra_
+from conftest import make_message, write_file
+
+
+def _stations_(source):
+    ret = []
+    for bh in xb.new_msg_from(source):
+        _extra_.unpack(bh)
+        ret.append(_extra_.get_val(bh, 'stationNumber'))
+    return(ret)
+
+
+def _no_copy_(monkeypatch):
+    """Record messages passed to codes_new_from_message"""
+    passed = []
+    new = _extra_._ec.codes_new_from_message
+
+    def record(message):
+        passed.append(type(message))
+        return(new(message))
+    monkeypatch.setattr(_extra_._ec, 'codes_new_from_message', record)
+    return(passed)
+
+
+def test_buffers(monkeypatch):
+    m = b'xx' + make_message(stations=(130,)) + b'BUFR' + \
+        make_message(stations=(131,)) + b'7777'
+    passed = _no_copy_(monkeypatch)
+    for source in [m, bytearray(m), memoryview(m)]:
+        assert _stations_(source) == [130, 131]
+    assert passed == [memoryview] * 6
+
+
+def test_memoryview_slice(monkeypatch):
+    a, b = make_message(stations=(130,)), make_message(stations=(131,))
+    m = memoryview(a + b + a)
+    passed = _no_copy_(monkeypatch)
+    assert _stations_(m[len(a):]) == [131, 130]
+    assert _stations_(m[len(a):-1]) == [131]  # last one is truncated
+    assert _stations_(m[1:len(a)]) == []
+    assert passed == [memoryview] * 3
+
+
+def test_arrays():
+    m = make_message(stations=(130,)) + make_message(stations=(131,))
+    m += b'\0' * (-len(m) % 8)
+    for source in [np.frombuffer(m, dtype='u1'),
+                   np.frombuffer(m, dtype='<f8'),
+                   np.frombuffer(m, dtype='u2').reshape(2, -1),
+                   memoryview(np.frombuffer(m, dtype='u4')),
+                   array.array('d', m[:len(m) // 8 * 8])]:
+        assert _stations_(source) == [130, 131]
+
+
+def test_buffer_released():
+    m = bytearray(make_message())
+    for _ in xb.new_msg_from(m):
+        pass
+    m.extend(b'7777')  # resizing fails if a view is not released
+
+
+def test_file_path(bufr_file):
+    assert [xb.nsub(bh) for bh in xb.new_msg_from(bufr_file)] == [1, 2, 3]
+
+
+def test_dump_batches(tmpdir, monkeypatch):
+    messages = [make_message(stations=(130 + i,)) for i in range(5)]
+    src = write_file(tmpdir.join('a.bufr'), messages)
+    calls = []
+    writev = os.writev
+
+    def partial(fd, buffers):
+        calls.append(len(buffers))
+        if len(calls) == 1:  # first call writes a part of a message
+            return(os.write(fd, bytes(buffers[0][:10])))
+        return(writev(fd, buffers))
+    monkeypatch.setattr(os, 'writev', partial)
+    monkeypatch.setattr(_extra_, '_iov_max_', 2)
+    out = str(tmpdir.join('b.bufr'))
+    assert xb.dump(xb.iter_messages(src), out) == 5
+    assert calls == [2, 2, 2, 1]
+    with open(out, 'rb') as f:
+        assert f.read() == b''.join(messages)
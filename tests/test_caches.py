@@ -0,0 +1,121 @@
+import pytest
+import xtrabufr as xb
+import xtrabufr._extra_ as _extra_
+from xtrabufr._helper_ import LRUCache
+from conftest import make_message
+
+
+@pytest.fixture
+def caches(monkeypatch):
+    """Empty caches of attributes and keys"""
+    for k in ('_attr_cache_', '_keys_cache_', '_factor_names_'):
+        monkeypatch.setattr(_extra_, k, LRUCache(maxsize=256))
+
+
+def _message_(**kw):
+    bh = next(xb.new_msg_from(make_message(**kw)))
+    _extra_.unpack(bh)
+    return(bh)
+
+
+def _record_(monkeypatch, name):
+    """Record calls of a function of _extra_"""
+    calls = []
+    f = getattr(_extra_, name)
+
+    def record(bufr_handle, *args):
+        calls.append(args)
+        return(f(bufr_handle, *args))
+    monkeypatch.setattr(_extra_, name, record)
+    return(calls)
+
+
+def test_attributes_as_read(caches, local_file):
+    for bh in xb.new_msg_from(local_file):
+        _extra_.unpack(bh)
+        for x in [bh] + list(xb.iter_subsets(bh)):
+            for k in _extra_.get_keys(x):
+                assert _extra_.get_attr(x, k) == _extra_._read_attr_(x, k), k
+
+
+def test_attributes_are_read_once(caches, monkeypatch):
+    _extra_.get_attr(_message_(stations=(130,)), 'airTemperature')
+    calls = _record_(monkeypatch, '_read_attr_')
+    bh = _message_(stations=(131, 132))
+    for _ in range(2):
+        _extra_.get_attr(bh, 'airTemperature')
+    _extra_.get_attributes(bh, ['airTemperature', 'stationNumber'])
+    assert calls == [('stationNumber',)]
+
+
+def test_attributes_per_template(caches):
+    a = _message_()
+    b = _message_(descriptors=(1001, 1002, 12001))
+    assert _extra_.get_attr(a, 'airTemperature')['code'] == '012101'
+    assert _extra_.get_attr(b, 'airTemperature')['code'] == '012001'
+    assert _extra_.get_attr(a, 'airTemperature')['code'] == '012101'
+
+
+def test_attributes_after_template_changed(caches):
+    bh = _message_()
+    assert _extra_.get_attr(bh, 'airTemperature')['code'] == '012101'
+    _extra_.set_val(bh, 'unexpandedDescriptors', [1001, 1002, 12001])
+    _extra_.unpack(bh)
+    assert _extra_.get_attr(bh, 'airTemperature')['code'] == '012001'
+    _extra_.pack(bh)
+    _extra_.unpack(bh)
+    assert _extra_.get_attr(bh, 'airTemperature')['code'] == '012001'
+
+
+def test_code_table_columns(caches):
+    keys = ['stationNumber', 'stationType', 'airTemperature']
+    a = _message_()
+    b = _message_(descriptors=(1001, 1002, 2001, 12101))
+    pa, pb = _extra_._attr_plan_(a), _extra_._attr_plan_(b)
+    assert pa is not pb
+    assert _extra_._code_table_columns_(pa, a, keys) == []
+    assert _extra_._code_table_columns_(pb, b, keys) == [(1, '002001')]
+    assert _extra_._code_table_columns_(pb, b, keys) == [(1, '002001')]
+
+
+def _replicated_(replication):
+    n = sum(replication)
+    return(_message_(stations=range(130, 130 + len(replication)),
+                     temperature=[280.0 + i for i in range(n)],
+                     descriptors=(1001, 1002, 101000, 31001, 12101),
+                     replication=replication))
+
+
+def test_keys_as_read(caches):
+    for r in ([1, 1, 1], [2, 0, 1], [1, 1, 1], [0, 0, 3], [2, 0, 1]):
+        bh = _replicated_(r)
+        assert _extra_.get_keys(bh) == _extra_._read_keys_(bh), r
+
+
+def test_keys_are_read_once(caches, monkeypatch):
+    _extra_.get_keys(_replicated_([2, 0, 1]))
+    calls = _record_(monkeypatch, '_read_keys_')
+    for _ in range(2):
+        bh = _replicated_([2, 0, 1])
+        _extra_.get_keys(bh)
+        _extra_.get_keys(bh)
+    assert len(calls) == 0
+    _extra_.get_keys(_replicated_([1, 2, 0]))
+    assert len(calls) == 1
+
+
+def test_keys_after_modification(caches):
+    bh = _replicated_([2, 0, 1])
+    keys = _extra_.get_keys(bh)
+    x = xb.extract_subset(bh, 1)
+    _extra_.unpack(x)
+    assert _extra_.get_keys(x) == _extra_._read_keys_(x) != keys
+    bh = _message_()
+    _extra_.get_keys(bh)
+    sig = _extra_._keys_signature_(bh)
+    # keys iterator of ecCodes fails on a handle whose template is set,
+    # so just check keys are not reused
+    _extra_.set_val(bh, 'unexpandedDescriptors', [1001, 1002])
+    _extra_.unpack(bh)
+    assert 'keys' not in bh._cache
+    assert _extra_._keys_signature_(bh) != sig
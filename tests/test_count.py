@@ -0,0 +1,35 @@
+import os
+import xtrabufr as xb
+from conftest import make_message, write_file
+
+
+def test_msg_count(bufr_file):
+    assert xb.msg_count(bufr_file) == 3
+    assert xb.msg_count(bufr_file, details=True) == (3, 0, 0)
+
+
+def test_msg_count_truncated(tmpdir):
+    m = make_message(stations=(130, 131))
+    path = write_file(tmpdir.join('t.bufr'), [b'xx', m, m, m[:-20]])
+    assert xb.msg_count(path, details=True) == (2, 2 + len(m) - 20,
+                                                len(m) - 20)
+    empty = write_file(tmpdir.join('e.bufr'), [])
+    assert xb.msg_count(empty, details=True) == (0, 0, 0)
+
+
+def test_msg_count_directory(tmpdir):
+    m = make_message()
+    d = tmpdir.mkdir('d')
+    a = write_file(d.join('a.bufr'), [m])
+    b = write_file(d.mkdir('sub').join('b.bufr'), [m, m])
+    write_file(d.join('.hidden'), [m])
+    write_file(d.join('a.bufr.xbi'), [m])
+    write_file(d.join('a.bufr.xbd'), [m])
+    c = xb.msg_count(str(d))
+    assert list(c.items()) == [(a, 1), (b, 2)]
+    assert dict(xb.msg_count(str(d), workers=1)) == dict(c)
+    assert list(xb.msg_count([str(d)], name='b*').items()) == [(b, 2)]
+    missing = os.path.join(str(d), 'missing.bufr')
+    assert xb.msg_count([a, missing], details=True) == \
+        xb.msg_count([a, missing], workers=1, details=True)
+    assert xb.msg_count([a, missing])[missing] is None
@@ -0,0 +1,110 @@
+import pytest
+import numpy as np
+import eccodes as _ec
+import xtrabufr as xb
+import xtrabufr._extra_ as _extra_
+from conftest import make_message
+
+_keys_ = ['blockNumber', 'stationNumber', 'airTemperature', 'pressure']
+
+
+def _compressed_():
+    m = make_message(stations=(130, 131, 132), compressed=1,
+                     temperature=[280.0, _ec.CODES_MISSING_DOUBLE, 282.5])
+    return(next(_extra_.new_msg_from(m)))
+
+
+def _extracted_(bh, keys):
+    """Values of keys of each subset by extracting subsets"""
+    _extra_.unpack(bh)
+    d = []
+    for i in range(1, xb.nsub(bh) + 1):
+        x = xb.extract_subset(xb.clone(bh), i)
+        _extra_.unpack(x)
+        d.append(dict((k, _extra_.get_val(x, k)) for k in keys))
+    return(d)
+
+
+def test_decode_compressed():
+    bh = _compressed_()
+    d = xb.decode(bh, _keys_)
+    assert [dict(i) for i in d] == _extracted_(bh, _keys_)
+    assert [i['airTemperature'] for i in d] == [280.0, None, 282.5]
+    assert [i['pressure'] for i in d] == ['KeyNotFound'] * 3
+
+
+def test_decode_compressed_merge():
+    d = xb.decode(_compressed_(), _keys_, merge=True)
+    assert d['stationNumber'] == [130, 131, 132]
+    assert d['airTemperature'] == [280.0, None, 282.5]
+
+
+def test_decode_columnar():
+    d = xb.decode(_compressed_(), _keys_, columnar=True)
+    t = d['airTemperature']
+    assert isinstance(t, np.ma.MaskedArray)
+    assert t.mask.tolist() == [False, True, False]
+    assert t.compressed().tolist() == [280.0, 282.5]
+    assert d['pressure'].mask.all() and len(d['pressure']) == 3
+
+
+def test_decode_columnar_messages(bufr_file):
+    d = xb.decode(list(xb.iter_messages(bufr_file)), ['stationNumber'],
+                  columnar=True)
+    assert d['stationNumber'].tolist() == [130, 130, 131, 130, 131, 132]
+
+
+def _replicated_(replication, temperature, compressed=0):
+    m = make_message(stations=range(130, 130 + len(replication)),
+                     compressed=compressed, temperature=temperature,
+                     descriptors=(1001, 1002, 101000, 31001, 12101),
+                     replication=replication)
+    return(next(_extra_.new_msg_from(m)))
+
+
+def test_decode_columnar_uncompressed():
+    m = make_message(stations=(130, 131, 132),
+                     temperature=[280.0, _ec.CODES_MISSING_DOUBLE, 282.5])
+    d = xb.decode(next(_extra_.new_msg_from(m)), _keys_, columnar=True)
+    c = xb.decode(_compressed_(), _keys_, columnar=True)
+    for k in _keys_:
+        assert d[k].shape == c[k].shape == (3,)
+        assert np.ma.getmaskarray(d[k]).tolist() == \
+            np.ma.getmaskarray(c[k]).tolist()
+        assert d[k].compressed().tolist() == c[k].compressed().tolist()
+    assert d['pressure'].mask.all()
+
+
+def test_decode_columnar_subset():
+    bh = _compressed_()
+    _extra_.unpack(bh)
+    d = xb.decode(xb.BufrSubset(bh, 3), _keys_, columnar=True)
+    assert d['stationNumber'].tolist() == [132]
+    assert d['pressure'].shape == (1,) and d['pressure'].mask.all()
+
+
+def test_decode_columnar_replicated():
+    # airTemperature: [280, 281], [], [282]
+    bh = _replicated_([2, 0, 1], [280.0, 281.0, 282.0])
+    with pytest.raises(ValueError):
+        xb.decode(bh, ['airTemperature'], columnar=True)
+    d = xb.decode(bh, ['#1#airTemperature', '#2#airTemperature'],
+                  columnar=True)
+    assert d['#1#airTemperature'].tolist() == [280.0, None, 282.0]
+    assert d['#2#airTemperature'].tolist() == [281.0, None, None]
+    # compressed, airTemperature: [280, 290], [281, 291], [282, 292]
+    h = _ec.codes_bufr_new_from_samples('BUFR4')
+    _ec.codes_set(h, 'numberOfSubsets', 3)
+    _ec.codes_set(h, 'compressedData', 1)
+    _ec.codes_set_array(h, 'inputDelayedDescriptorReplicationFactor', [2])
+    _ec.codes_set_array(h, 'unexpandedDescriptors',
+                        [1001, 1002, 101000, 31001, 12101])
+    _ec.codes_set_array(h, '#1#airTemperature', [280.0, 281.0, 282.0])
+    _ec.codes_set_array(h, '#2#airTemperature', [290.0, 291.0, 292.0])
+    _ec.codes_set(h, 'pack', 1)
+    bh = next(_extra_.new_msg_from(_ec.codes_get_message(h)))
+    _ec.codes_release(h)
+    with pytest.raises(ValueError):
+        xb.decode(bh, ['airTemperature'], columnar=True)
+    d = xb.decode(bh, ['#2#airTemperature'], columnar=True)
+    assert d['#2#airTemperature'].tolist() == [290.0, 291.0, 292.0]
@@ -0,0 +1,133 @@
+import os
+import eccodes as _ec
+import xtrabufr as xb
+import xtrabufr._dedup_ as _dedup_
+from conftest import make_message, write_file
+
+
+def _retransmitted_(m):
+    """Same message with another updateSequenceNumber"""
+    h = _ec.codes_new_from_message(m)
+    try:
+        _ec.codes_set(h, 'updateSequenceNumber', 1)
+        return(_ec.codes_get_message(h))
+    finally:
+        _ec.codes_release(h)
+
+
+def _starts_(monkeypatch):
+    """Record offsets hashing starts from"""
+    starts = []
+    iter_digests = _dedup_._iter_digests_
+
+    def record(buf, start=0, key='message'):
+        starts.append(start)
+        return(iter_digests(buf, start, key))
+    monkeypatch.setattr(_dedup_, '_iter_digests_', record)
+    return(starts)
+
+
+def test_digest():
+    a, b = make_message(stations=(130,)), make_message(stations=(131,))
+    r = _retransmitted_(a)
+    assert xb.digest(a) != xb.digest(r)
+    assert xb.digest(a, 'station') == xb.digest(r, 'station')
+    assert xb.digest(a, 'station') != xb.digest(b, 'station')
+    assert list(xb.unique([a, b, a, r])) == [a, b, r]
+    assert list(xb.unique([a, b, a, r], 'station')) == [a, b]
+
+
+def test_index_sync_after_append(tmpdir, monkeypatch):
+    a, b = make_message(stations=(130,)), make_message(stations=(131,))
+    path = write_file(tmpdir.join('a.bufr'), [a])
+    idx = xb.DedupIndex(path)
+    idx.save()
+    assert os.path.exists(path + '.xbd')
+    with open(path, 'ab') as f:
+        f.write(b)
+    starts = _starts_(monkeypatch)
+    idx = xb.DedupIndex(path)
+    assert starts == [len(a)]
+    assert len(idx) == 2 and xb.digest(b) in idx
+    assert idx.size == len(a) + len(b)
+
+
+def test_index_sync_after_truncate(tmpdir, monkeypatch):
+    a, b = make_message(stations=(130,)), make_message(stations=(131,))
+    path = write_file(tmpdir.join('a.bufr'), [a, b])
+    xb.DedupIndex(path).save()
+    write_file(path, [b])
+    starts = _starts_(monkeypatch)
+    idx = xb.DedupIndex(path)
+    assert starts == [0]
+    assert len(idx) == 1 and xb.digest(a) not in idx
+
+
+def test_index_key_mismatch(tmpdir):
+    path = write_file(tmpdir.join('a.bufr'), [make_message()])
+    xb.DedupIndex(path).save()
+    idx = xb.DedupIndex(path, 'station', sync=False)
+    assert len(idx) == 0  # digests of another key are not loaded
+
+
+def test_dedup_file(tmpdir):
+    a, b = make_message(stations=(130,)), make_message(stations=(131,))
+    r = _retransmitted_(a)
+    path = write_file(tmpdir.join('a.bufr'), [a, b, a, b'xx', r])
+    assert xb.dedup_file(path, dry_run=True) == (3, 1)
+    out = str(tmpdir.join('b.bufr'))
+    assert xb.dedup_file(path, out, 'station') == (2, 2)
+    with open(out, 'rb') as f:
+        assert f.read() == a + b
+    assert len(xb.DedupIndex(out, 'station', sync=False)) == 2
+    assert xb.dedup_file(path) == (3, 1)
+    with open(path, 'rb') as f:
+        assert f.read() == a + b + r
+    assert xb.DedupIndex(path).size == len(a + b + r)
+
+
+def test_dump_dedup(tmpdir):
+    a, b = make_message(stations=(130,)), make_message(stations=(131,))
+    src = write_file(tmpdir.join('src.bufr'), [a, b, a, _retransmitted_(b)])
+    out = str(tmpdir.join('out.bufr'))
+    assert xb.dump(xb.iter_messages(src), out, dedup='station') == 2
+    with open(out, 'rb') as f:
+        assert f.read() == a + b
+    assert xb.dump(list(xb.iter_messages(src)), dedup='message') == \
+        a + b + _retransmitted_(b)
+
+
+def test_index_sync_after_same_size_rewrite(tmpdir, monkeypatch):
+    a, b = make_message(stations=(130,)), make_message(stations=(131,))
+    assert len(a) == len(b)
+    path = write_file(tmpdir.join('a.bufr'), [a])
+    xb.DedupIndex(path).save()
+    starts = _starts_(monkeypatch)
+    xb.DedupIndex(path)
+    assert starts == []  # fresh, nothing is hashed
+    write_file(path, [b])
+    os.utime(path, (1, 1))
+    idx = xb.DedupIndex(path)
+    assert starts == [0]
+    assert list(idx._digests) == [xb.digest(b)]
+
+
+def test_index_sync_after_larger_rewrite(tmpdir, monkeypatch):
+    a, b = make_message(stations=(130,)), make_message(stations=(131,))
+    path = write_file(tmpdir.join('a.bufr'), [a])
+    xb.DedupIndex(path).save()
+    write_file(path, [b, a])  # grew, but not by appending
+    starts = _starts_(monkeypatch)
+    idx = xb.DedupIndex(path)
+    assert starts == [0]
+    assert len(idx) == 2 and xb.digest(b) in idx
+
+
+def test_router_index_is_fresh(tmpdir, monkeypatch):
+    a, b = make_message(stations=(130,)), make_message(stations=(131,))
+    src = write_file(tmpdir.join('src.bufr'), [a, b, a])
+    out = str(tmpdir.join('out.bufr'))
+    assert xb.split(src, out, dedup='message') == {out: 2}
+    starts = _starts_(monkeypatch)
+    idx = xb.DedupIndex(out)
+    assert starts == [] and len(idx) == 2
@@ -0,0 +1,129 @@
+import os
+import random
+from collections import OrderedDict
+import xtrabufr.definitions as definitions
+from conftest import ELEMENT_TABLE
+
+
+def _touch_(path, dt=10):
+    t = os.stat(str(path)).st_mtime + dt
+    os.utime(str(path), (t, t))
+
+
+def test_tables_without_codetables(defs):
+    assert definitions.get_element_table()[1001][0] == 'blockNumber'
+    assert list(definitions.get_sequence_def().keys()) == [301004, 301001]
+    assert definitions.expand_descriptors(301004) == [1001, 1002, 2001]
+    assert definitions.shrink_descriptors([1001, 1002, 2001]) == [301004]
+
+
+def test_code_tables_are_cached(defs, monkeypatch):
+    ct = defs.mkdir('codetables')
+    ct.join('2001.table').write('0 0 AUTOMATIC STATION\n1 1 MANNED\n')
+    assert definitions.get_value_from_code_table(1, 2001) == 'MANNED'
+
+    def parse(content):
+        raise AssertionError('code table is parsed again')
+    monkeypatch.setattr(definitions, '_parse_code_table_', parse)
+    definitions._def_catch_.clear()  # as if in a new process
+    assert definitions.get_code_table(2001)[0] == 'AUTOMATIC STATION'
+
+
+def test_code_table_edited_in_place(defs):
+    ct = defs.mkdir('codetables')
+    ct.join('2001.table').write('0 0 AUTOMATIC STATION\n1 1 MANNED\n')
+    assert definitions.get_code_table(2001)[1] == 'MANNED'
+    definitions._def_catch_.clear()
+    ct.join('2001.table').write('0 0 AUTOMATIC STATION\n1 1 MANNED STATION\n')
+    _touch_(ct.join('2001.table'))
+    assert definitions.get_code_table(2001)[1] == 'MANNED STATION'
+
+
+def test_tables_edited(defs):
+    assert definitions.get_element_table()[1001][0] == 'blockNumber'
+    definitions._def_catch_.clear()
+    defs.join('element.table').write(ELEMENT_TABLE.replace('blockNumber',
+                                                       'block'))
+    _touch_(defs.join('element.table'))
+    assert definitions.get_element_table()[1001][0] == 'block'
+
+
+def test_lib_path_is_remembered(tmpdir, monkeypatch):
+    lib = tmpdir.join('libeccodes_memfs.so')
+    lib.write('')
+    found = []
+
+    def find(lib_name):
+        found.append(lib_name)
+        return(str(lib))
+    monkeypatch.setattr(definitions, '_find_lib_path_', find)
+    monkeypatch.setattr(definitions, '_cache_dir_', str(tmpdir.join('c')))
+    for _ in range(2):
+        # as if in a new process
+        monkeypatch.setattr(definitions, '_lib_paths_', {})
+        assert definitions._get_lib_path_('libeccodes_memfs') == str(lib)
+    assert found == ['libeccodes_memfs']
+    lib.remove()
+    monkeypatch.setattr(definitions, '_lib_paths_', {})
+    definitions._get_lib_path_('libeccodes_memfs')
+    assert len(found) == 2
+
+
+def _naive_find_(seq, code):
+    """Reference of _find_sequences_ by comparing every position"""
+    found = {}
+    for k, v in seq.items():
+        for i in range(len(code) - len(v) + 1):
+            if code[i:i + len(v)] == v:
+                found[i] = [k, len(v)]
+    return(found)
+
+
+def test_find_sequences():
+    # sorted by length as sequence.def; suffixes and overlaps included
+    seq = OrderedDict([(301001, [1, 2]), (301002, [2, 3]), (301003, [3]),
+                       (301004, [1, 2, 3]), (301005, [2, 1, 2]),
+                       (301006, [1, 2, 1, 2, 3])])
+    automaton = definitions._build_automaton_(seq)
+    rnd = random.Random(1)
+    for _ in range(500):
+        code = [rnd.choice([1, 2, 3, 4]) for _ in range(rnd.randint(0, 12))]
+        assert definitions._find_sequences_(automaton, code) == \
+            _naive_find_(seq, code), code
+
+
+def test_shrink_descriptors(defs):
+    assert definitions.shrink_descriptors([1001, 1002]) == [301001]
+    assert definitions.shrink_descriptors([2001, 1001, 1002, 2001]) == \
+        [2001, 301004]
+    assert definitions.shrink_descriptors([1001, 1002, 2001], depth=1) == \
+        [301001, 2001]
+    assert definitions.shrink_descriptors(1001) == [1001]
+
+
+def test_build_closure():
+    seq = OrderedDict([(301001, [1001, 1002]), (301002, [301001, 2001]),
+                       (301003, [301002, 301001, 4001])])
+    expanded, level, containers = definitions._build_closure_(seq)
+    assert expanded[301003] == [1001, 1002, 2001, 1001, 1002, 4001]
+    assert level == {301001: 1, 301002: 2, 301003: 3}
+    assert containers[1001] == set([301001, 301002, 301003])
+    assert containers[301001] == set([301002, 301003])
+    assert containers[4001] == set([301003])
+
+
+def test_expand_descriptors(defs):
+    assert definitions.expand_descriptors(301004) == [1001, 1002, 2001]
+    assert definitions.expand_descriptors([301004], depth=1) == \
+        [301001, 2001]
+    assert definitions.expand_descriptors([301004, 1001], depth=0) == \
+        [301004, 1001]
+    assert definitions.expand_descriptors([2001, 301001]) == \
+        [2001, 1001, 1002]
+
+
+def test_desc_is_in(defs):
+    assert definitions.desc_is_in(1001, 301004) == [True]
+    assert definitions.desc_is_in([301001, 2001, 1002], [301001]) == \
+        [True, False, True]
+    assert definitions.desc_is_in(301004, 301001) == [False]
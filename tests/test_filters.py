@@ -0,0 +1,68 @@
+import numpy as np
+from xtrabufr._filters_ import MessageFilter, SubsetFilter
+
+
+def _ids_(mf, n=20):
+    return([i for i in range(1, n + 1) if mf.wants(i)])
+
+
+def test_values():
+    mf = MessageFilter({'dataCategory': 0, 'typicalHour': '0..6',
+                        'typicalDate': '20180324..20180331'})
+    h = {'dataCategory': 0, 'typicalHour': 6, 'typicalDate': '20180324'}
+    assert mf.match(h)
+    assert not mf.match(dict(h, typicalHour=7))
+    assert not mf.match(dict(h, dataCategory='1'))
+    assert not mf.match(dict(h, typicalDate='20180401'))
+    assert mf.match({})  # only keys in values are evaluated
+
+
+def test_open_ranges_and_negation():
+    mf = MessageFilter({'blockNumber': ['17', '!17..17'],
+                        'stationNumber': ['..130', '!100']})
+    assert not mf.match({'blockNumber': 17})
+    mf = MessageFilter({'stationNumber': ['..130', '!100', '!50..60']})
+    assert [i for i in range(40, 140, 10)
+            if mf.match({'stationNumber': i})] == [40, 70, 80, 90, 110, 120,
+                                                   130]
+    mf = MessageFilter({'stationNumber': '!120..'})
+    assert mf.match({'stationNumber': 119})
+    assert not mf.match({'stationNumber': 121})
+    assert mf.match({'stationNumber': None})
+
+
+def test_list_values():
+    mf = MessageFilter({'stationNumber': 130})
+    assert mf.match({'stationNumber': [None, 130]})
+    assert not mf.match({'stationNumber': [131, 132]})
+    mf = MessageFilter({'unexpandedDescriptors': [[1001, 1002]]})
+    assert mf.match({'unexpandedDescriptors': [1001, 1002]})
+    assert not mf.match({'unexpandedDescriptors': [1001, 1002, 1003]})
+
+
+def test_msg():
+    mf = MessageFilter({'msg': [3, '5..7']})
+    assert mf.msg == [3, 5, 6, 7] and mf.last == 7
+    assert _ids_(mf) == [3, 5, 6, 7]
+    mf = MessageFilter({'msg': '18..'})
+    assert mf.msg is None and mf.last is None
+    assert _ids_(mf) == [18, 19, 20]
+    mf = MessageFilter({'msg': ['1..10', '!2..9']})
+    assert mf.last == 10 and _ids_(mf) == [1, 10]
+    mf = MessageFilter({'msg': '!2'})
+    assert mf.last is None and 2 not in _ids_(mf) and 20 in _ids_(mf)
+
+
+def test_subset_filter():
+    m = np.ma.masked_array
+    columns = {'stationNumber': m([130, 131, 132, 133]),
+               'latitude': m([40.0, 41.0, 0.0, 39.0],
+                             mask=[False, False, True, False]),
+               'longitude': m([179.5, -179.5, 0.0, 10.0])}
+    sf = SubsetFilter({'stationNumber': ['130..132', '!131']})
+    assert sf.mask(columns).tolist() == [True, False, True, False]
+    sf = SubsetFilter(bbox=(35, 45, 170, -170))  # crosses 180th meridian
+    assert sf.keys == ['latitude', 'longitude']
+    assert sf.mask(columns).tolist() == [True, True, False, False]
+    sf = SubsetFilter(require='latitude')
+    assert sf.mask(columns).tolist() == [True, True, False, True]
@@ -0,0 +1,143 @@
+import xtrabufr as xb
+import xtrabufr._extra_ as _extra_
+from conftest import make_message
+
+
+def _unpacks_(monkeypatch):
+    """Record unpack calls to ecCodes"""
+    calls = []
+    codes_set = _extra_._ec.codes_set
+
+    def record(h, key, value):
+        if key == 'unpack':
+            calls.append(h)
+        return(codes_set(h, key, value))
+    monkeypatch.setattr(_extra_._ec, 'codes_set', record)
+    return(calls)
+
+
+def _message_(n=3, **kw):
+    return(next(xb.new_msg_from(make_message(stations=range(130, 130 + n),
+                                             **kw))))
+
+
+def test_unpack_once(monkeypatch):
+    bh = _message_()
+    calls = _unpacks_(monkeypatch)
+    assert not bh.unpacked
+    xb.decode(bh)
+    xb.decode(bh, ['stationNumber'])
+    list(xb.iter_subsets(bh, stationNumber='131..'))
+    xb.select_subsets(bh, airTemperature='281..')
+    assert bh.unpacked and len(calls) == 1
+
+
+def test_unpacked_after_pack(monkeypatch):
+    bh = _message_()
+    calls = _unpacks_(monkeypatch)
+    _extra_.unpack(bh)
+    _extra_.pack(bh)
+    assert not bh.unpacked
+    _extra_.unpack(bh)
+    assert len(calls) == 2
+
+
+def test_unpacked_after_extract(monkeypatch):
+    bh = _message_()
+    _extra_.unpack(bh)
+    x = xb.extract_subset(bh, 2)
+    assert not bh.unpacked and not x.unpacked
+    assert _extra_.get_val(x, 'numberOfSubsets') == 1
+    _extra_.unpack(x)
+    assert _extra_.get_val(x, 'stationNumber') == 131
+    c = xb.clone(x)
+    assert x.unpacked and not c.unpacked
+
+
+def test_set_data_key_keeps_values():
+    bh = _message_()
+    _extra_.unpack(bh)
+    _extra_.set_val(bh, 'airTemperature', [270.0, 271.0, 272.0])
+    assert bh.unpacked
+    _extra_.unpack(bh)  # no-op, set values are not decoded again
+    assert _extra_.get_val(bh, 'airTemperature') == [270.0, 271.0, 272.0]
+    _extra_.pack(bh)
+    _extra_.unpack(bh)
+    assert _extra_.get_val(bh, 'airTemperature') == [270.0, 271.0, 272.0]
+    x = next(xb.new_msg_from(xb.dump(bh)))
+    _extra_.unpack(x)
+    assert _extra_.get_val(x, 'airTemperature') == [270.0, 271.0, 272.0]
+
+
+def test_set_header_key_needs_unpack(monkeypatch):
+    bh = _message_()
+    _extra_.unpack(bh)
+    _extra_.set_val(bh, 'unexpandedDescriptors', [1001, 1002, 12001])
+    assert not bh.unpacked
+    calls = _unpacks_(monkeypatch)
+    _extra_.unpack(bh)
+    assert len(calls) == 1
+
+
+def _codes_get_(monkeypatch):
+    """Record keys read by codes_get"""
+    calls = []
+    codes_get = _extra_._ec.codes_get
+
+    def record(h, key, *args):
+        calls.append(key)
+        return(codes_get(h, key, *args))
+    monkeypatch.setattr(_extra_._ec, 'codes_get', record)
+    return(calls)
+
+
+def test_header_values(local_file, bufr_file):
+    for f in (local_file, bufr_file):
+        for bh in xb.new_msg_from(f):
+            for k in _extra_._header_set_:
+                assert _extra_.get_val(bh, k) == \
+                    _extra_._read_val_(bh, k), (f, k)
+
+
+def test_header_is_cached(monkeypatch):
+    bh = _message_()
+    assert _extra_.get_val(bh, 'numberOfSubsets') == 3
+    calls = _codes_get_(monkeypatch)
+    for _ in range(2):
+        for k in _extra_._header_set_:
+            _extra_.get_val(bh, k)
+    assert calls == []
+
+
+def test_header_after_set():
+    bh = _message_()
+    assert _extra_.get_val(bh, 'typicalYear') == 2012
+    _extra_.set_val(bh, 'typicalYear', 2020)
+    assert _extra_.get_val(bh, 'typicalYear') == 2020
+    assert _extra_.get_val(bh, 'typicalDate') == \
+        _extra_._read_val_(bh, 'typicalDate')
+    _extra_.set_val(bh, 'unexpandedDescriptors', [1001, 1002, 12001])
+    assert _extra_.get_val(bh, 'unexpandedDescriptors') == \
+        [1001, 1002, 12001]
+
+
+def test_header_after_pack_and_extract():
+    bh = _message_()
+    assert _extra_.get_val(bh, 'typicalYear') == 2012
+    _extra_.unpack(bh)
+    _extra_._ec.codes_set(bh.handle, 'typicalYear', 2020)
+    _extra_.pack(bh)
+    assert _extra_.get_val(bh, 'typicalYear') == 2020
+    x = xb.extract_subset(bh, 2)
+    assert _extra_.get_val(x, 'numberOfSubsets') == 1
+    assert _extra_.get_val(bh, 'numberOfSubsets') == 1
+
+
+def test_header_after_convert(tmpdir):
+    from xtrabufr._router_ import Router
+    bh = next(xb.new_msg_from(make_message('BUFR3', (130, 131))))
+    assert _extra_.get_val(bh, 'edition') == 3
+    r = Router(str(tmpdir.join('{edition}.bufr')), edition=4)
+    assert r._convert(bh) is not None
+    assert _extra_.get_val(bh, 'edition') == 4
+    r.close()
@@ -0,0 +1,68 @@
+import os
+import xtrabufr as xb
+import xtrabufr._index_ as _index_
+from xtrabufr._scanner_ import iter_frames, decode_header
+from conftest import make_message, write_file
+
+
+def _append_(path, messages):
+    with open(path, 'ab') as f:
+        for m in messages:
+            f.write(m)
+
+
+def _starts_(monkeypatch):
+    """Record offsets scanning starts from"""
+    starts = []
+    iter_frames = _index_._iter_frames_
+
+    def record(buf, start=0):
+        starts.append(start)
+        return(iter_frames(buf, start))
+    monkeypatch.setattr(_index_, '_iter_frames_', record)
+    return(starts)
+
+
+def test_build_index(bufr_file):
+    idx = xb.build_index(bufr_file)
+    with open(bufr_file, 'rb') as f:
+        buf = f.read()
+    assert len(idx) == 3 and idx.is_fresh()
+    assert [f[1:] for f in idx] == list(iter_frames(buf))
+    for i, offset, length in idx:
+        assert idx.header(i) == decode_header(buf, offset)
+    assert xb.load_index(bufr_file).scanned == len(buf)
+
+
+def test_update_index_after_append(bufr_file, monkeypatch):
+    idx = xb.build_index(bufr_file)
+    scanned = idx.scanned
+    _append_(bufr_file, [make_message(stations=(140,))])
+    assert xb.load_index(bufr_file) is None  # out of date
+    starts = _starts_(monkeypatch)
+    idx = xb.update_index(bufr_file)
+    assert starts == [scanned]
+    assert len(idx) == 4 and idx.is_fresh()
+    assert idx.header(4)['numberOfSubsets'] == 1
+    assert [bh.id for bh in xb.iter_messages(bufr_file, msg='2..4')] == \
+        [2, 3, 4]
+    starts = _starts_(monkeypatch)
+    xb.update_index(bufr_file)  # fresh, nothing is scanned
+    assert starts == []
+
+
+def test_update_index_after_rewrite(bufr_file, monkeypatch):
+    xb.build_index(bufr_file)
+    write_file(bufr_file, [make_message(stations=(150, 151))])
+    os.utime(bufr_file, (1, 1))
+    starts = _starts_(monkeypatch)
+    idx = xb.update_index(bufr_file)
+    assert starts == [0]
+    assert len(idx) == 1 and idx.header(1)['numberOfSubsets'] == 2
+
+
+def test_stale_index_is_not_used(bufr_file):
+    xb.build_index(bufr_file)
+    write_file(bufr_file, [make_message(stations=(150, 151, 152, 153))])
+    n = [xb.nsub(bh) for bh in xb.iter_messages(bufr_file)]
+    assert n == [4]
@@ -0,0 +1,73 @@
+import pytest
+import xtrabufr as xb
+import xtrabufr._extra_ as _extra_
+
+
+def _subsets_(d):
+    s = d['subset']
+    return(list(s.values()) if isinstance(s, dict) else s)
+
+
+def test_lazy_as_decode(local_file):
+    for bh in xb.iter_messages(local_file):
+        lazy, eager = _subsets_(xb.decode(bh, lazy=True)), \
+            _subsets_(xb.decode(bh))
+        assert all(isinstance(s, xb.LazyValues) for s in lazy)
+        assert [s.materialize() for s in lazy] == eager
+        assert [dict(s) for s in lazy] == [dict(s) for s in eager]
+
+
+def test_lazy_is_a_mapping(bufr_file):
+    bh = list(xb.iter_messages(bufr_file))[1]
+    lv = _subsets_(xb.decode(bh, lazy=True))[0]
+    # header keys are not listed, so they cannot be read
+    assert 'edition' not in lv and 'edition' not in list(lv)
+    with pytest.raises(KeyError):
+        lv['edition']
+    assert lv.get('edition') is None
+    # keys are ranked as in decode, unranked names are not listed
+    assert lv['#1#stationNumber'] == 130 and '#1#stationNumber' in lv
+    assert 'stationNumber' not in lv
+    assert dict(lv) == lv.materialize()
+    assert len(lv) == len(list(lv))
+
+
+def test_values_are_read_once_on_access(bufr_file):
+    bh = next(xb.iter_messages(bufr_file))
+    _extra_.unpack(bh)
+    read, listed = [], []
+
+    def fun(h, k):
+        read.append(k)
+        return(_extra_.get_val(h, k))
+
+    def keys():
+        listed.append(1)
+        return(['stationNumber', 'airTemperature'])
+    lv = xb.LazyValues(bh, keys, fun)
+    assert listed == [] and read == []
+    assert lv['airTemperature'] == 280.0
+    assert lv['airTemperature'] == 280.0
+    assert listed == [1] and read == ['airTemperature']
+    with pytest.raises(KeyError):
+        lv['blockNumber']
+    assert read == ['airTemperature']
+    assert list(lv.items()) == [('stationNumber', 130),
+                                ('airTemperature', 280.0)]
+    assert read == ['airTemperature', 'stationNumber'] and listed == [1]
+
+
+def test_lazy_of_messages(bufr_file):
+    d = xb.decode(xb.iter_messages(bufr_file), lazy=True)
+    assert [len(_subsets_(i)) for i in d] == [1, 2, 3]
+    assert [s['#1#stationNumber'] for s in _subsets_(d[2])] == \
+        [130, 131, 132]
+    assert all(isinstance(s, xb.LazyValues) for s in _subsets_(d[2]))
+
+
+def test_lazy_is_not_ignored(bufr_file):
+    bh = next(xb.iter_messages(bufr_file))
+    with pytest.raises(ValueError):
+        xb.decode(bh, ['stationNumber'], lazy=True)
+    with pytest.raises(ValueError):
+        xb.decode(xb.iter_messages(bufr_file), lazy=True, workers=2)
@@ -0,0 +1,72 @@
+import os
+import json
+import xtrabufr as xb
+import xtrabufr._extra_ as _extra_
+
+KEYS = ['stationNumber', 'airTemperature']
+
+
+def _lines_(path):
+    with open(path) as f:
+        return([json.loads(i) for i in f])
+
+
+def _as_json_(d):
+    return(json.loads(json.dumps(d)))
+
+
+def test_ndjson_messages(bufr_file, tmpdir):
+    out = str(tmpdir.join('a.ndjson'))
+    assert xb.ndjson(xb.iter_messages(bufr_file), out) == 3
+    assert _lines_(out) == [_as_json_(xb.decode(bh))
+                            for bh in xb.iter_messages(bufr_file)]
+
+
+def test_ndjson_subsets(bufr_file, tmpdir):
+    out = str(tmpdir.join('a.ndjson'))
+    assert xb.ndjson(xb.iter_messages(bufr_file), out, KEYS,
+                     buffer_size=2) == 6
+    lines = _lines_(out)
+    assert lines == _as_json_(xb.decode(xb.iter_messages(bufr_file), KEYS))
+    assert [i['stationNumber'] for i in lines] == \
+        [130, 130, 131, 130, 131, 132]
+    assert list(lines[0].keys()) == KEYS  # order of keys is kept
+
+
+def test_ndjson_single_message(bufr_file, tmpdir):
+    out = str(tmpdir.join('a.ndjson'))
+    bh = list(xb.iter_messages(bufr_file))[2]
+    assert xb.ndjson(bh, out, KEYS) == 3
+    assert xb.ndjson(bh, out) == 1
+
+
+def test_ndjson_workers(bufr_file, tmpdir):
+    out = [str(tmpdir.join('{}.ndjson'.format(i))) for i in range(2)]
+    for f, workers in zip(out, [None, 2]):
+        xb.ndjson(xb.iter_messages(bufr_file), f, KEYS, workers=workers)
+    assert _lines_(out[0]) == _lines_(out[1])
+
+
+def test_ndjson_streams(bufr_file, tmpdir, monkeypatch):
+    events = []
+    dumps = _extra_._json.dumps
+
+    def record(*args, **kwargs):
+        events.append('line')
+        return(dumps(*args, **kwargs))
+    monkeypatch.setattr(_extra_._json, 'dumps', record)
+
+    def messages():
+        for bh in xb.iter_messages(bufr_file):
+            events.append('msg')
+            yield(bh)
+    xb.ndjson(messages(), str(tmpdir.join('a.ndjson')), KEYS)
+    # a message is decoded and written before the next one is read
+    assert events == ['msg', 'line', 'msg', 'line', 'line', 'msg', 'line',
+                      'line', 'line']
+
+
+def test_ndjson_empty(tmpdir):
+    out = str(tmpdir.join('a.ndjson'))
+    assert xb.ndjson([], out) == 0
+    assert not os.path.exists(out)
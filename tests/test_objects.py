@@ -0,0 +1,58 @@
+import pytest
+try:
+    from collections.abc import MutableSequence
+except ImportError:
+    from collections import MutableSequence
+from xtrabufr.objects import Descriptors
+
+
+def test_nodes_have_no_dict(defs):
+    d = Descriptors(301004)
+    assert not hasattr(d, '__dict__')
+    assert all(not hasattr(i, '__dict__') for i in d)
+    assert isinstance(d, MutableSequence)
+
+
+def test_tree(defs):
+    d = Descriptors(301004)
+    assert d.key == 'stationId'
+    assert [i.code for i in d] == [301001, 2001]
+    assert [i.key for i in d[0]] == ['blockNumber', 'stationNumber']
+    assert d[0] is Descriptors([301001])[0]  # children are shared
+
+
+def test_shared_child_can_not_be_modified(defs):
+    d = Descriptors(301004)
+    for f in [lambda c: c.append_code(2001), lambda c: c.pop(),
+              lambda c: c.reverse(), lambda c: c.extend_code([2001]),
+              lambda c: c.append(Descriptors(2001))]:
+        with pytest.raises(TypeError):
+            f(d[0])
+    assert [i.code for i in d[0]] == [1001, 1002]
+
+
+def test_mutable_root(defs):
+    d = Descriptors([1001, 1002])
+    d.append_code(2001)
+    d += [Descriptors(301001)]
+    assert [i.code for i in d] == [1001, 1002, 2001, 301001]
+    assert d.pop().code == 301001
+    d.reverse()
+    assert [i.code for i in d] == [2001, 1002, 1001]
+    assert d.index(d[1]) == 1 and d.count(d[0]) == 1 and d[2] in d
+    d.remove(d[0])
+    assert [i.code for i in reversed(d)] == [1001, 1002]
+    with pytest.raises(TypeError):
+        d.append(1001)
+
+
+def test_shared_nodes_are_released(defs):
+    import gc
+    from xtrabufr import objects
+    d = Descriptors(301004)
+    list(d[0])
+    assert len(objects._flyweights_) > 0
+    assert objects._shared_(Descriptors, 301001, 'latest') is d[0]
+    del d
+    gc.collect()
+    assert len(objects._flyweights_) == 0
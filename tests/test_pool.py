@@ -0,0 +1,76 @@
+import itertools
+import xtrabufr as xb
+import xtrabufr._extra_ as _extra_
+from conftest import make_message, write_file
+
+KEYS = ['stationNumber', 'airTemperature', 'typicalDate']
+
+
+def _decode_(x, workers, **kw):
+    return(list(xb.iter_decode(x, workers=workers, **kw)))
+
+
+def test_iterables_are_decoded(bufr_file):
+    serial = _decode_(list(xb.iter_messages(bufr_file)), None)
+    assert len(serial) == 3
+    assert _decode_(tuple(xb.iter_messages(bufr_file)), None) == serial
+    assert _decode_(itertools.chain(xb.iter_messages(bufr_file)), None) == \
+        serial
+    subsets = list(xb.iter_subsets(xb.iter_messages(bufr_file)))
+    assert len(_decode_(subsets[0], None)) == 1
+    assert len(_decode_(iter(subsets), None, keys=KEYS)) == 6
+
+
+def test_pool_as_serial(bufr_file):
+    for kw in [{}, {'keys': KEYS}, {'keys': KEYS, 'merge': False}]:
+        assert _decode_(xb.iter_messages(bufr_file), 2, **kw) == \
+            _decode_(xb.iter_messages(bufr_file), None, **kw)
+        subsets = xb.iter_subsets(xb.iter_messages(bufr_file))
+        assert _decode_(subsets, 2, **kw) == \
+            _decode_(xb.iter_subsets(xb.iter_messages(bufr_file)), None,
+                     **kw)
+
+
+def test_subsets_of_a_message_in_pool(monkeypatch):
+    monkeypatch.setattr(_extra_, '_job_subsets_', 3)
+    m = make_message(stations=range(130, 140))
+    bh = next(xb.new_msg_from(m))
+    for kw in [{}, {'keys': KEYS}, {'keys': KEYS, 'merge': False}]:
+        serial = xb.decode(bh, **kw)
+        assert xb.decode(bh, workers=2, **kw) == serial
+    d = xb.decode(bh, KEYS, merge=True, workers=2)
+    assert d['stationNumber'] == list(range(130, 140))
+    c = xb.decode(bh, KEYS, columnar=True, workers=2)
+    assert c['airTemperature'].tolist() == [280.0 + i for i in range(10)]
+
+
+def test_jobs_group_subsets(bufr_file, monkeypatch):
+    monkeypatch.setattr(_extra_, '_job_subsets_', 2)
+    msgs = list(xb.iter_messages(bufr_file))
+    x = [msgs[0]] + list(xb.iter_subsets(msgs[1:])) + [msgs[0]]
+    jobs = [(j[0][1], j[1]) for j in _extra_._iter_jobs_(x)]
+    assert jobs == [(1, None), (2, [1, 2]), (3, [1, 2]), (3, [3]),
+                    (1, None)]
+
+
+def test_to_csv_in_pool(bufr_file, tmpdir):
+    out = [str(tmpdir.join('{}.csv'.format(i))) for i in range(2)]
+    for f, workers in zip(out, [None, 2]):
+        xb.to_csv(KEYS, xb.iter_subsets(xb.iter_messages(bufr_file)), f,
+                  workers=workers)
+    with open(out[0]) as a, open(out[1]) as b:
+        rows = a.read()
+        assert rows == b.read()
+    assert len(rows.splitlines()) == 7
+
+
+def test_pool_keeps_order(tmpdir):
+    # messages of several batches (workers * 16) and of varying sizes
+    n = [1 + (7 * i) % 9 for i in range(80)]
+    f = write_file(tmpdir.join('a.bufr'),
+                   [make_message(stations=range(i, i + j))
+                    for i, j in enumerate(n)])
+    d = _decode_(xb.iter_messages(f), 2, keys=['stationNumber'])
+    assert [i['stationNumber'] for i in d] == \
+        [list(range(i, i + j)) for i, j in enumerate(n)]
+    assert d == _decode_(xb.iter_messages(f), None, keys=['stationNumber'])
@@ -0,0 +1,199 @@
+import os
+import sys
+import xtrabufr as xb
+import xtrabufr._router_ as _router_
+import xtrabufr._scripts_ as _scripts_
+from conftest import make_message, write_file
+
+
+def _spool_(tmpdir, n=3):
+    spool = tmpdir.mkdir('spool')
+    for i in range(n):
+        write_file(spool.join('mw_mss{}'.format(i)),
+                   [make_message(stations=(130 + i,))])
+    return(str(spool))
+
+
+def _fail_on_(monkeypatch, name):
+    route_file = _router_.Router.route_file
+
+    def fail(self, bufr_file):
+        if os.path.basename(bufr_file) == name:
+            raise IOError('No space left on device')
+        return(route_file(self, bufr_file))
+    monkeypatch.setattr(_router_.Router, 'route_file', fail)
+
+
+def test_ingest(tmpdir):
+    spool = _spool_(tmpdir)
+    mesbank = str(tmpdir.join('mesbank'))
+    files = sorted(os.path.join(spool, f) for f in os.listdir(spool))
+    counts = xb.ingest(files, mesbank, remove=True,
+                       log=str(tmpdir.join('log')))
+    assert sum(counts.values()) == 3
+    assert os.listdir(spool) == []
+
+
+def test_ingest_failed(tmpdir, monkeypatch):
+    _fail_on_(monkeypatch, 'mw_mss1')
+    spool = _spool_(tmpdir)
+    files = sorted(os.path.join(spool, f) for f in os.listdir(spool))
+    failed = []
+    counts = xb.ingest(files, str(tmpdir.join('mesbank')), remove=True,
+                       log=str(tmpdir.join('log')), failed=failed)
+    assert sum(counts.values()) == 2
+    assert failed == [os.path.join(spool, 'mw_mss1')]
+    assert os.listdir(spool) == ['mw_mss1']
+
+
+def test_xbsort_skips_failed(tmpdir, monkeypatch):
+    _fail_on_(monkeypatch, 'mw_mss1')
+    spool = _spool_(tmpdir)
+    log = str(tmpdir.join('log'))
+    monkeypatch.setattr(sys, 'argv', ['xbsort', '-s', spool, '-m',
+                                      str(tmpdir.join('mesbank')),
+                                      '-l', log])
+    assert _scripts_._xbsort_() == 0
+    assert os.listdir(spool) == ['mw_mss1']
+    with open(log) as f:
+        lines = f.readlines()
+    assert sum('ERROR' in i for i in lines) == 1
+    assert 'left in spool' in lines[-2]
+
+
+def _mesbank_(mesbank):
+    """Contents of files in mesbank"""
+    ret = {}
+    for root, _, files in os.walk(mesbank):
+        for f in files:
+            if f.endswith('.bufr4'):
+                with open(os.path.join(root, f), 'rb') as fp:
+                    ret[f] = fp.read()
+    return(ret)
+
+
+def test_ingest_write_failure_rolls_back(tmpdir, monkeypatch):
+    m = [make_message(stations=(130 + i,)) for i in range(4)]
+    spool = tmpdir.mkdir('spool')
+    files = [write_file(spool.join('mw_mss0'), m[0:1]),
+             write_file(spool.join('mw_mss1'), m[1:3]),
+             write_file(spool.join('mw_mss2'), m[3:4])]
+    write = _router_.FilePool.write
+    n = []
+
+    def fail(self, path, message):
+        n.append(path)
+        if len(n) == 3:  # 2nd message of mw_mss1
+            raise IOError('No space left on device')
+        return(write(self, path, message))
+    monkeypatch.setattr(_router_.FilePool, 'write', fail)
+    mesbank = str(tmpdir.join('mesbank'))
+    failed = []
+    counts = xb.ingest(files, mesbank, remove=True, failed=failed,
+                       log=str(tmpdir.join('log')), dedup='message')
+    assert failed == [files[1]]
+    assert os.listdir(str(spool)) == ['mw_mss1']
+    assert list(counts.values()) == [2]
+    assert list(_mesbank_(mesbank).values()) == [m[0] + m[3]]
+    monkeypatch.setattr(_router_.FilePool, 'write', write)
+    xb.ingest(files[1], mesbank, remove=True, log=str(tmpdir.join('log')),
+              dedup='message')
+    assert list(_mesbank_(mesbank).values()) == [m[0] + m[3] + m[1] + m[2]]
+
+
+def test_ingest_sync_failure_keeps_spool(tmpdir, monkeypatch):
+    spool = _spool_(tmpdir)
+    files = sorted(os.path.join(spool, f) for f in os.listdir(spool))
+
+    def fsync(fd):
+        raise OSError('Input/output error')
+    monkeypatch.setattr(os, 'fsync', fsync)
+    mesbank = str(tmpdir.join('mesbank'))
+    failed = []
+    counts = xb.ingest(files, mesbank, remove=True, failed=failed,
+                       log=str(tmpdir.join('log')))
+    assert failed == files and counts == {}
+    assert sorted(os.listdir(spool)) == ['mw_mss0', 'mw_mss1', 'mw_mss2']
+    assert list(_mesbank_(mesbank).values()) == [b'']
+
+
+def _read_(path):
+    with open(str(path), 'rb') as f:
+        return(f.read())
+
+
+def test_split_by_header(tmpdir, bufr_file, monkeypatch):
+    def new_handle(*args):
+        raise AssertionError('a handle is created')
+    monkeypatch.setattr(_router_, '_new_handle_', new_handle)
+    pattern = str(tmpdir.join('out_[numberOfSubsets]_[typicalDate].bufr'))
+    counts = xb.split(bufr_file, pattern)
+    assert sorted(counts.values()) == [1, 1, 1]
+    m = [make_message(stations=range(130, 130 + i)) for i in (1, 2, 3)]
+    for i in (1, 2, 3):
+        assert _read_(tmpdir.join('out_{}_20121031.bufr'.format(i))) == \
+            m[i - 1]
+
+
+def test_split_by_data_keys(tmpdir, monkeypatch):
+    m = [make_message(stations=(130,)), make_message(stations=(131,)),
+         make_message(stations=(130,), temperature=[270.0]),
+         make_message(stations=(130, 131))]
+    f = write_file(tmpdir.join('in.bufr'), m)
+    pattern = str(tmpdir.join('out_[blockNumber]_[stationNumber:05d].bufr'))
+    counts = xb.split(f, pattern)
+    assert sorted(os.path.basename(p) for p in counts) == \
+        ['out_17_00130.bufr', 'out_17_00131.bufr', 'out_17_17_130_131.bufr']
+    assert _read_(tmpdir.join('out_17_00130.bufr')) == m[0] + m[2]
+    assert _read_(tmpdir.join('out_17_00131.bufr')) == m[1]
+    assert _read_(tmpdir.join('out_17_17_130_131.bufr')) == m[3]
+
+
+def test_xbsplit(tmpdir, bufr_file, monkeypatch):
+    monkeypatch.chdir(str(tmpdir))
+    monkeypatch.setattr(sys, 'argv', ['xbsplit', '-k', 'dc,sn', bufr_file])
+    assert _scripts_._xbsplit_() == 0
+    names = sorted(f for f in os.listdir(str(tmpdir))
+                   if f.startswith('mss_'))
+    assert names == ['mss_dc1_sn130.bufr4', 'mss_dc1_sn130_131.bufr4',
+                     'mss_dc1_sn130_131_132.bufr4']
+    with open(bufr_file, 'rb') as f:
+        assert b''.join(_read_(tmpdir.join(i)) for i in names) == f.read()
+
+
+def test_xbsplit_unknown_key(bufr_file, monkeypatch):
+    monkeypatch.setattr(sys, 'argv', ['xbsplit', '-k', 'dc,xx', bufr_file])
+    try:
+        _scripts_._xbsplit_()
+    except SystemExit as e:
+        assert e.code == 2
+    else:
+        raise AssertionError('unknown key is accepted')
+
+
+def test_file_pool_evicts(tmpdir):
+    paths = [str(tmpdir.join('d', '{}.bufr'.format(i))) for i in range(3)]
+    expected = dict((p, b'') for p in paths)
+    with _router_.FilePool(maxsize=1) as pool:
+        for i in range(12):
+            p = paths[i * 7 % 3]
+            m = make_message(stations=(130 + i,))
+            pool.write(p, m)
+            expected[p] += m
+            assert len(pool) <= 1
+        assert pool.counts == dict((p, 4) for p in paths)
+    assert pool.check() == []
+    for p in paths:
+        assert _read_(p) == expected[p]
+
+
+def test_file_pool_check(tmpdir):
+    path = write_file(tmpdir.join('a.bufr'), [make_message()])
+    with _router_.FilePool() as pool:
+        pool.write(path, make_message(stations=(131,)))
+    assert pool.sizes[path] == len(make_message())
+    assert pool.check() == []
+    with open(path, 'ab') as f:
+        f.write(b'7777')
+    assert pool.check() == [(path, 2 * len(make_message()),
+                             2 * len(make_message()) + 4)]
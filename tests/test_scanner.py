@@ -0,0 +1,66 @@
+import eccodes as _ec
+from xtrabufr._scanner_ import iter_frames, count_frames, decode_header
+from xtrabufr._scanner_ import _header_keys_
+from conftest import make_message
+
+
+def _messages_():
+    return([make_message('BUFR3_local', (130, 131)),
+            make_message('BUFR4', (130,)),
+            make_message('BUFR4_local', (130, 131, 132), 1)])
+
+
+def _ecc_header_(message):
+    h = _ec.codes_new_from_message(message)
+    try:
+        values = {}
+        for k in _header_keys_:
+            try:
+                if _ec.codes_get_size(h, k) > 1:
+                    values[k] = _ec.codes_get_array(h, k).tolist()
+                else:
+                    values[k] = _ec.codes_get(h, k)
+            except _ec.KeyValueNotFoundError:
+                values[k] = 'KeyNotFound'
+        return(values)
+    finally:
+        _ec.codes_release(h)
+
+
+def test_iter_frames():
+    m = _messages_()
+    buf = b'garbage' + m[0] + b'BUFR\x00' + m[1] + b'\n\n' + m[2]
+    frames = list(iter_frames(buf))
+    assert [buf[o:o + n] for o, n in frames] == m
+    assert list(iter_frames(buf, frames[1][0])) == frames[1:]
+
+
+def test_iter_frames_truncated():
+    m = _messages_()
+    buf = m[0] + m[1][:-10] + m[2]
+    assert [buf[o:o + n] for o, n in iter_frames(buf)] == [m[0], m[2]]
+    assert list(iter_frames(b'')) == []
+    assert list(iter_frames(b'BUFR')) == []
+
+
+def test_count_frames():
+    m = _messages_()
+    assert count_frames(b''.join(m)) == (3, 0, 0)
+    assert count_frames(b'xx' + b''.join(m) + m[0][:20]) == (3, 22, 20)
+
+
+def test_decode_header():
+    for m in _messages_():
+        h = decode_header(m)
+        e = _ecc_header_(m)
+        for k in _header_keys_:
+            assert h[k] == e[k], k
+        assert h['typicalDate'] == '{:04d}{:02d}{:02d}'.format(
+            e['typicalYear'], e['typicalMonth'], e['typicalDay'])
+
+
+def test_decode_header_offset():
+    m = _messages_()
+    buf = b''.join(m)
+    for (o, n), i in zip(iter_frames(buf), m):
+        assert decode_header(buf, o) == decode_header(i)
@@ -0,0 +1,74 @@
+import xtrabufr as xb
+import xtrabufr._extra_ as _extra_
+from conftest import make_message
+
+
+def _views_(bufr_file):
+    for bh in xb.iter_messages(bufr_file):
+        _extra_.unpack(bh)
+        for i in range(1, xb.nsub(bh) + 1):
+            x = xb.extract_subset(xb.clone(bh), i)
+            _extra_.unpack(x)
+            yield(bh, xb.BufrSubset(bh, i), x)
+
+
+def test_view_as_extracted_subset(local_file):
+    # local section of ECMWF changes by number of subsets, so only keys
+    # of both are compared
+    for bh, view, x in _views_(local_file):
+        keys = _extra_.get_keys(x)
+        common = [k for k in _extra_.get_keys(view) if k in keys]
+        assert 'localYear' in common and 'rdbType' in common
+        for k in common:
+            assert _extra_.get_val(view, k) == _extra_.get_val(x, k), k
+
+
+def test_view_reads_local_section(local_file):
+    keys = ['localYear', 'rdbType', 'typicalYearOfCentury', 'stationNumber']
+    for bh in xb.iter_messages(local_file):
+        for i, d in enumerate(xb.decode(bh, keys), 130):
+            assert d['localYear'] == 2012
+            assert d['rdbType'] == 1
+            assert d['stationNumber'] == i
+            if _extra_.get_val(bh, 'edition') == 3:
+                assert d['typicalYearOfCentury'] == 12
+
+
+def test_view_data_key_not_found(bufr_file):
+    for bh, view, x in _views_(bufr_file):
+        assert _extra_.get_val(view, 'pressure') == 'KeyNotFound'
+        assert _extra_.get_val(view, '#2#stationNumber') == 'KeyNotFound'
+
+
+def _replicated_(replication, temperature, compressed=0):
+    m = make_message(stations=range(130, 130 + len(replication)),
+                     compressed=compressed, temperature=temperature,
+                     descriptors=(1001, 1002, 101000, 31001, 12101),
+                     replication=replication)
+    bh = next(_extra_.new_msg_from(m))
+    _extra_.unpack(bh)
+    return(bh)
+
+
+def test_select_subsets_by_replication():
+    # airTemperature: [280, 281], [], [282]
+    bh = _replicated_([2, 0, 1], [280.0, 281.0, 282.0])
+    assert xb.select_subsets(bh, require='airTemperature') == [1, 3]
+    assert xb.select_subsets(bh, airTemperature=280) == [1]
+    assert xb.select_subsets(bh, airTemperature=281) == []
+    assert xb.select_subsets(bh, airTemperature='282') == [3]
+
+
+def test_select_subsets_key_of_a_subset():
+    bh = _replicated_([0, 1, 0], [285.0])
+    assert xb.select_subsets(bh, require='airTemperature') == [2]
+    assert xb.select_subsets(bh, airTemperature='280..290') == [2]
+    assert xb.select_subsets(bh, stationNumber='!131') == [1, 3]
+
+
+def test_select_subsets_compressed():
+    bh = next(_extra_.new_msg_from(make_message(stations=(130, 131, 132),
+                                                compressed=1)))
+    _extra_.unpack(bh)
+    assert xb.select_subsets(bh, airTemperature='281..') == [2, 3]
+    assert xb.select_subsets(bh, stationNumber=[130, 132]) == [1, 3]
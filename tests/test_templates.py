@@ -0,0 +1,58 @@
+import pytest
+from xtrabufr._templates_ import Templates
+from xtrabufr._filters_ import MessageFilter
+from conftest import ELEMENT_TABLE
+
+_v20_ = '"301001" = [  001001, 001002, 001003 ]\n'
+
+
+@pytest.fixture
+def versions(defs):
+    """Master table version 20 has another 301001, 21 is broken"""
+    wmo = defs.dirpath()
+    for v, seq in [('20', _v20_), ('21', 'x\n')]:
+        d = wmo.mkdir(v)
+        d.join('element.table').write(ELEMENT_TABLE)
+        d.join('sequence.def').write(seq)
+    return(wmo)
+
+
+def test_forms(versions):
+    t = Templates()
+    t.add('a', [[301001, 2001]])
+    assert t.match([301001, 2001]) == 'a'
+    assert t.match([1001, 1002, 2001]) == 'a'
+    assert t.match([1001, 1002, 2001], 20) is None
+    assert t.match([1001, 1002, 1003, 2001], 20) == 'a'
+    assert t.match([1001, 1002, 1003, 2001]) is None
+
+
+def test_missing_version_uses_latest(versions):
+    t = Templates()
+    t.add('a', [[301001, 2001]])
+    assert t.match([1001, 1002, 2001], 99) == 'a'
+
+
+def test_broken_definitions_raise(versions):
+    t = Templates()
+    t.add('a', [[301001, 2001]])
+    with pytest.raises(ValueError):
+        t.match([1001, 1002, 2001], 21)
+
+
+def test_remove(versions):
+    t = Templates()
+    t.add('a', [[301001, 2001]])
+    assert t.match([1001, 1002, 2001]) == 'a'
+    t.remove('a')
+    assert t.match([1001, 1002, 2001]) is None
+    assert t.names() == []
+
+
+def test_message_filter_version(versions):
+    mf = MessageFilter({'unexpandedDescriptors': [[301001, 2001]]})
+    assert 'masterTablesVersionNumber' in mf.keys
+    v = {'unexpandedDescriptors': [1001, 1002, 1003, 2001]}
+    assert not mf.match(v)
+    v['masterTablesVersionNumber'] = 20
+    assert mf.match(v)
@@ -0,0 +1,58 @@
+import numpy as np
+import eccodes as _ec
+import xtrabufr._extra_ as _extra_
+from conftest import make_message
+
+_MD_, _ML_ = _ec.CODES_MISSING_DOUBLE, _ec.CODES_MISSING_LONG
+
+
+def _reference_(v):
+    """Values of an array as get_val returned them by Python loops"""
+    v = v.tolist()
+    if isinstance(v[0], int):
+        v = [None if i == _ML_ else i for i in v]
+    if isinstance(v[0], float):
+        v = [None if i == _MD_ else round(i, 6) for i in v]
+    return(v)
+
+
+def test_masked():
+    rnd = np.random.RandomState(1)
+    f = rnd.uniform(-1000, 1000, 100)
+    f[rnd.randint(0, 100, 20)] = _MD_
+    i = rnd.randint(-1000, 1000, 100)
+    i[rnd.randint(0, 100, 20)] = _ML_
+    for v in [f, i, np.array([273.149999999, 0.1 + 0.2, -0.0000004])]:
+        m = _extra_._masked_(v)
+        assert isinstance(m, np.ma.MaskedArray)
+        assert m.tolist() == _reference_(v)
+    assert _extra_._masked_(f).mask.sum() == (f == _MD_).sum()
+
+
+def test_get_val_missing_values():
+    m = make_message(stations=(130, _ML_, 132), compressed=1,
+                     temperature=[280.0, _MD_, 273.149999999])
+    bh = next(_extra_.new_msg_from(m))
+    _extra_.unpack(bh)
+    assert _extra_.get_val(bh, 'stationNumber') == [130, None, 132]
+    assert _extra_.get_val(bh, 'airTemperature') == [280.0, None, 273.15]
+    v = _extra_.get_val(bh, 'airTemperature', as_array=True)
+    assert v.mask.tolist() == [False, True, False]
+    assert _extra_.get_val(bh, 'pressure', as_array=True) == 'KeyNotFound'
+    # a constant of a compressed message is a single value
+    assert _extra_.get_val(bh, 'blockNumber', as_array=True).tolist() == \
+        [17]
+
+
+def test_get_val_scalar():
+    m = make_message(stations=(_ML_,), temperature=[_MD_])
+    bh = next(_extra_.new_msg_from(m))
+    _extra_.unpack(bh)
+    assert _extra_.get_val(bh, 'stationNumber') is None
+    assert _extra_.get_val(bh, 'airTemperature') is None
+    v = _extra_.get_val(bh, 'airTemperature', as_array=True)
+    assert v.shape == (1,) and v.mask.all()
+    s = _extra_.BufrSubset(bh, 1)
+    assert _extra_.get_val(s, 'airTemperature') is None
+    assert _extra_.get_val(s, 'numberOfSubsets', as_array=True).tolist() \
+        == [1]
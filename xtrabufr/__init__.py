@@ -12,6 +12,11 @@ This package contains extra functions and tools to work with
 """
 from __future__ import absolute_import
 from ._extra_ import *
+from ._index_ import *
+from ._templates_ import *
+from ._filters_ import *
+from ._router_ import *
+from ._dedup_ import *
 from . import definitions
 from . import objects
 
@@ -0,0 +1,331 @@
+"""
+xtrabufr._dedup_
+~~~~~~~~~~~~~~~~~~
+Deduplication of BUFR messages
+
+A message is identified by a SHA-1 digest of
+    'message'   its bytes, or
+    'station'   its normalised header and station/time keys of subsets,
+                so a retransmission with a new header (i.e. another
+                edition or sequence number) is a duplicate too.
+
+Digests of messages in a BUFR file are stored next to the file
+(<bufr_file>.xbd), so appending to a file needs neither reading nor
+hashing the messages already in the file.
+
+Layout of the digest file:
+    b'XBD2'        magic
+    >B             key (0: message, 1: station)
+    >Q             size of BUFR file covered by digests
+    >d             mtime of BUFR file (0 if unknown)
+    >QI            offset and length of last message
+    count x 20s    digests of messages in file order
+"""
+
+import os as _os
+import json as _json
+import struct as _struct
+import hashlib as _hashlib
+import eccodes as _ec
+from ._scanner_ import open_buffer as _open_buffer_
+from ._scanner_ import iter_frames as _iter_frames_
+from ._extra_ import BufrHandle as _BufrHandle_
+from ._extra_ import BufrSubset as _BufrSubset_
+from ._extra_ import _new_handle_
+from ._extra_ import get_val as _get_val_
+from ._extra_ import unpack as _unpack_
+from ._extra_ import dump as _dump_
+
+__all__ = ['DedupIndex', 'digest', 'unique', 'dedup_file']
+
+_MAGIC_ = b'XBD2'
+_EXT_ = '.xbd'
+_HEAD_ = _struct.Struct('>BQdQI')
+_SIZE_ = 20  # size of a SHA-1 digest
+
+_keys_ = ['message', 'station']
+
+# header keys which do not change by retransmission or edition
+_header_ = ['dataCategory', 'dataSubCategory', 'typicalDate', 'typicalTime',
+            'numberOfSubsets', 'unexpandedDescriptors']
+
+_station_keys_ = ['blockNumber', 'stationNumber', 'year', 'month', 'day',
+                  'hour', 'minute', 'latitude', 'longitude']
+
+
+def digest_path(bufr_file):
+    """Path to digest file of a BUFR file"""
+    return(bufr_file + _EXT_)
+
+
+def _check_key_(key):
+    if key not in _keys_:
+        raise ValueError('key must be one of {}'.format(_keys_))
+
+
+def digest(x, key='message'):
+    """SHA-1 digest of a message
+
+    'station' digests fall back to 'message' digests for messages which
+    cannot be unpacked.
+
+    :param x: Binary content of a message or BufrHandle object
+    :param key: 'message' or 'station'
+    :returns: Digest (20 bytes)
+    """
+    _check_key_(key)
+    if isinstance(x, _BufrSubset_):
+        x = x.extract()
+    if key == 'station':
+        bh = x if isinstance(x, _BufrHandle_) else _new_handle_(x)
+        values = [_get_val_(bh, k) for k in _header_]
+        if _unpack_(bh):
+            values += [_get_val_(bh, k) for k in _station_keys_]
+            s = _json.dumps(values, default=str)
+            return(_hashlib.sha1(s.encode('utf-8')).digest())
+    if isinstance(x, _BufrHandle_):
+        x = _dump_(x)
+    return(_hashlib.sha1(x).digest())
+
+
+def _frame_digest_(message, key='message'):
+    """digest of a message in a file ('message' if it cannot be decoded)"""
+    try:
+        return(digest(message, key))
+    except _ec.CodesInternalError:
+        return(digest(message))
+
+
+def _iter_digests_(buf, start=0, key='message'):
+    """Iterate over (offset, length, digest) of messages in a buffer"""
+    for offset, length in _iter_frames_(buf, start):
+        yield((offset, length,
+               _frame_digest_(buf[offset:offset + length], key)))
+
+
+def unique(messages, key='message', seen=None):
+    """Skip duplicate messages
+
+    This is a generator function
+
+    :param messages: Iterable of binary contents of messages
+    :param key: 'message' or 'station'
+    :param seen: A set of digests of messages seen before (updated)
+    :returns: yields binary content of first occurrences of messages
+    """
+    seen = set() if seen is None else seen
+    for m in messages:
+        try:
+            d = digest(m, key)
+        except _ec.CodesInternalError:
+            d = digest(m)
+        if d not in seen:
+            seen.add(d)
+            yield(m)
+
+
+class DedupIndex(object):
+    """Digests of messages in a BUFR file
+
+    Digest file is brought up to date with the BUFR file when it is
+    loaded. If BUFR file grew and the last message is still in place,
+    just the appended part is hashed. Otherwise, if size or mtime of the
+    file changed, all messages are hashed again.
+
+    :param bufr_file: Path to BUFR file (need not exist)
+    :param key: 'message' or 'station'
+    :param sync: If False, digest file is loaded as it is
+    """
+
+    def __init__(self, bufr_file, key='message', sync=True):
+        _check_key_(key)
+        self._bufr_file = bufr_file
+        self._key = key
+        self._digests = []
+        self._set = set()
+        self._size = 0
+        self._mtime = None
+        self._last = None
+        self._changed = False
+        self._load()
+        if sync:
+            self.sync()
+
+    def __repr__(self):
+        s = 'DedupIndex {{file: {} key: {} messages: {}}}'
+        return(s.format(self._bufr_file, self._key, len(self)))
+
+    def __len__(self):
+        return(len(self._digests))
+
+    def __contains__(self, d):
+        return(d in self._set)
+
+    @property
+    def bufr_file(self):
+        return(self._bufr_file)
+
+    @property
+    def key(self):
+        return(self._key)
+
+    @property
+    def size(self):
+        """Size of BUFR file covered by digests"""
+        return(self._size)
+
+    def _load(self):
+        try:
+            with open(digest_path(self._bufr_file), 'rb') as f:
+                data = f.read()
+        except (IOError, OSError):
+            return
+        if data[0:4] != _MAGIC_ or len(data) < 4 + _HEAD_.size:
+            return
+        k, size, mtime, offset, length = _HEAD_.unpack_from(data, 4)
+        if k != _keys_.index(self._key):
+            return
+        start = 4 + _HEAD_.size
+        self._digests = [data[i:i + _SIZE_]
+                         for i in range(start, len(data), _SIZE_)]
+        self._set = set(self._digests)
+        self._size = size
+        self._mtime = mtime
+        self._last = (offset, length) if length > 0 else None
+
+    def _reset(self):
+        self._digests = []
+        self._set = set()
+        self._size = 0
+        self._mtime = None
+        self._last = None
+        self._changed = True
+
+    def _appended(self, buf):
+        """Check BUFR file is the covered part plus appended messages"""
+        if len(buf) < self._size:
+            return(False)
+        if self._last is None:
+            return(self._size == 0)
+        offset, length = self._last
+        end = offset + length
+        if end > self._size or buf[offset:offset + 4] != b'BUFR' or \
+                buf[end - 4:end] != b'7777':
+            return(False)
+        return(_frame_digest_(buf[offset:end], self._key) ==
+               self._digests[-1])
+
+    def sync(self):
+        """Bring digests up to date with BUFR file (see DedupIndex)"""
+        try:
+            st = _os.stat(self._bufr_file)
+            size, mtime = st.st_size, st.st_mtime
+        except OSError:
+            size, mtime = 0, None
+        if size == self._size and mtime == self._mtime:
+            return
+        if mtime is None:  # no BUFR file
+            if self._size > 0:
+                self._reset()
+            return
+        with _open_buffer_(self._bufr_file) as buf:
+            if size == 0 or not self._appended(buf):
+                self._reset()
+            for offset, length, d in _iter_digests_(buf, self._size,
+                                                    self._key):
+                self._digests.append(d)
+                self._set.add(d)
+                self._last = (offset, length)
+        self._size = size
+        self._mtime = mtime
+        self._changed = True
+
+    def add(self, d, length):
+        """Add digest of a message appended to BUFR file
+
+        :param d: Digest of message
+        :param length: Length of message
+        """
+        self._digests.append(d)
+        self._set.add(d)
+        self._last = (self._size, length)
+        self._size += length
+        self._mtime = None
+        self._changed = True
+
+    def mark(self):
+        """State of digests to be restored by rollback()"""
+        return((len(self._digests), self._size, self._mtime, self._last))
+
+    def rollback(self, mark):
+        """Remove digests added after mark() (i.e. BUFR file truncated)
+
+        :param mark: Return value of mark()
+        """
+        n, self._size, self._mtime, self._last = mark
+        if n < len(self._digests):
+            del self._digests[n:]
+            self._set = set(self._digests)
+            self._changed = True
+
+    def save(self):
+        """Write digest file if digests changed"""
+        if not self._changed:
+            return
+        try:
+            st = _os.stat(self._bufr_file)
+            mtime = st.st_mtime if st.st_size == self._size else 0
+        except OSError:
+            mtime = 0
+        offset, length = self._last or (0, 0)
+        path = digest_path(self._bufr_file)
+        tmp = '{}.{}.tmp'.format(path, _os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(_MAGIC_)
+            f.write(_HEAD_.pack(_keys_.index(self._key), self._size, mtime,
+                                offset, length))
+            f.write(b''.join(self._digests))
+        _os.rename(tmp, path)
+        self._changed = False
+
+
+def dedup_file(bufr_file, bufr_out=None, key='message', dry_run=False):
+    """Remove duplicate messages from a BUFR file
+
+    First occurrences of messages are kept in their order. Anything but
+    complete messages is dropped as well.
+
+    :param bufr_file: Path to BUFR file
+    :param bufr_out: Path to output file (default is to rewrite bufr_file)
+    :param key: 'message' or 'station'
+    :param dry_run: If True, only duplicates are counted
+    :returns: (number of kept messages, number of duplicates) tuple
+    """
+    _check_key_(key)
+    out = bufr_file if bufr_out is None else bufr_out
+    seen = set()
+    digests = []
+    frames = []
+    n = 0
+    with _open_buffer_(bufr_file) as buf:
+        for offset, length, d in _iter_digests_(buf, 0, key):
+            n += 1
+            if d not in seen:
+                seen.add(d)
+                digests.append(d)
+                frames.append((offset, length))
+        dup = n - len(frames)
+        if dry_run or (dup == 0 and out == bufr_file and
+                       sum(f[1] for f in frames) == len(buf)):
+            return((len(frames), dup))
+        tmp = '{}.{}.tmp'.format(out, _os.getpid())
+        with open(tmp, 'wb') as f:
+            for offset, length in frames:
+                f.write(buf[offset:offset + length])
+    _os.rename(tmp, out)
+    idx = DedupIndex(out, key, sync=False)
+    idx._reset()
+    for d, (_, length) in zip(digests, frames):
+        idx.add(d, length)
+    idx.save()
+    return((len(frames), dup))
@@ -8,31 +8,62 @@ from __future__ import print_function
 # from __future__ import absolute_import
 
 import os as _os
+import re as _re
 import sys as _sys
 import csv as _csv
+import mmap as _mmap
+import array as _array
 import eccodes as _ec
 import json as _json
+import numpy as _np
 from numpy import ndarray as _nd
 from copy import deepcopy as _deepcopy
 from collections import OrderedDict as _od
+try:
+    from collections.abc import Mapping as _Mapping
+except ImportError:
+    from collections import Mapping as _Mapping
 from types import GeneratorType as _GeneratorType
 from contextlib import contextmanager as _contextmanager
 from definitions import get_value_from_code_table as _get_value_from_code_table
-
+from ._helper_ import LRUCache as _LRUCache_
+from ._scanner_ import _header_keys_
+from ._scanner_ import _derived_keys_
+from ._scanner_ import open_buffer as _open_buffer_
+from ._scanner_ import iter_frames as _iter_frames_
+from ._scanner_ import count_frames as _count_frames_
+from ._scanner_ import decode_header as _decode_header_
+from ._index_ import load_index as _load_index_
+from ._index_ import _EXT_ as _index_ext_
+from ._filters_ import MessageFilter as _MessageFilter_
+from ._filters_ import SubsetFilter as _SubsetFilter_
+
+
+# header keys are cached per handle (see _header_of_)
+_header_set_ = frozenset(_header_keys_ + _derived_keys_)
+_header_key_set_ = frozenset(_header_keys_)
+
+# keys of delayed replication factors (see get_keys)
+_factor_keys_ = frozenset([
+    'delayedDescriptorReplicationFactor',
+    'shortDelayedDescriptorReplicationFactor',
+    'extendedDelayedDescriptorReplicationFactor',
+    'delayedDescriptorAndDataRepetitionFactor',
+    'extendedDelayedDescriptorAndDataRepetitionFactor'])
+
+# keys which change keys of header and local section (see get_keys)
+_layout_keys_ = ['edition', 'bufrHeaderCentre', 'bufrHeaderSubCentre',
+                 'masterTablesVersionNumber', 'localTablesVersionNumber',
+                 'numberOfSubsets', 'compressedData']
+_section2_keys_ = ['section2Present', 'isSatellite']
 
 __all__ = [
-    'msg_count', 'extract_subset', 'get_msg', 'decode', 'copy_msg', 'header',
+    'msg_count', 'extract_subset', 'extract_subset_list', 'select_subsets',
+    'filter_subsets', 'get_msg', 'decode', 'copy_msg', 'header',
     'iter_subsets', 'iter_messages', 'iter_synop', 'dump', 'BufrHandle',
-    'new_msg_from', 'nsub', 'to_csv', 'clone', 'synop_to_csv',
-    'synop_to_json', 'json', 'iter_decode']
-
-_header_keys_ = [
-    'edition', 'masterTableNumber', 'bufrHeaderCentre', 'bufrHeaderSubCentre',
-    'updateSequenceNumber', 'dataCategory', 'internationalDataSubCategory',
-    'dataSubCategory', 'masterTablesVersionNumber', 'localTablesVersionNumber',
-    'typicalYear', 'typicalMonth', 'typicalDay', 'typicalHour',
-    'typicalMinute', 'typicalSecond', 'numberOfSubsets', 'observedData',
-    'compressedData', 'unexpandedDescriptors']
+    'BufrSubset', 'LazyValues',
+    'new_msg_from', 'iter_dump', 'nsub', 'to_csv', 'clone', 'synop_to_csv',
+    'synop_to_json', 'json', 'ndjson', 'iter_decode']
 
 _synop_keys_ = [
     'masterTablesVersionNumber', 'bufrHeaderCentre',
@@ -54,12 +85,19 @@ class BufrHandle(object):
 
     Hence, you don't have to release bufr handles. They are released
     automatically if you don't have any reference to a it.
+
+    Handle keeps track of whether the message was unpacked, so unpack()
+    decodes data section once until the message is modified. Header keys
+    are read at once and cached until the message is modified.
     """
 
     def __init__(self, handle, id=None, file_name=None):
         self._handle = handle
         self._id = id
         self._file_name = file_name
+        self._cache = {}
+        self._unpacked = False
+        self._header = None
 
     def __repr__(self):
         s = 'BufrHandle {{file: {} id: {} handle: {}}}'
@@ -84,6 +122,10 @@ class BufrHandle(object):
         for k, v in self.__dict__.items():
             if k == '_handle':
                 setattr(new, k, _ec.codes_clone(v))
+            elif k == '_cache':
+                setattr(new, k, {})
+            elif k == '_unpacked':
+                setattr(new, k, False)  # a clone is not unpacked
             else:
                 setattr(new, k, _deepcopy(v, memo))
         return(new)
@@ -112,6 +154,193 @@ class BufrHandle(object):
     def compressed(self):
         return(get_val(self, 'compressedData') == 1)
 
+    @property
+    def unpacked(self):
+        """True if data section is unpacked"""
+        return(self._unpacked)
+
+    def _invalidate(self):
+        """Forget state of the message after it was modified"""
+        self._unpacked = False
+        self._header = None
+        self._cache.clear()
+
+
+class BufrSubset(object):
+    """A view to a subset of an unpacked BufrHandle object
+
+    Values are read from the parent message by subset qualified keys
+    (/subsetNumber=i/key), so the parent message is not cloned or
+    re-encoded to access a subset. Use extract() to get a standalone
+    message of the subset.
+    """
+
+    def __init__(self, parent, subset):
+        self._parent = parent
+        self._subset = subset
+
+    def __repr__(self):
+        s = 'BufrSubset {{file: {} id: {} subset: {}}}'
+        return(s.format(self.file_name, self.id, self.subset))
+
+    def __deepcopy__(self, memo):
+        parent = clone(self._parent)
+        unpack(parent)
+        return(self.__class__(parent, self._subset))
+
+    @property
+    def handle(self):
+        return(self._parent.handle)
+
+    @property
+    def id(self):
+        return(self._parent.id)
+
+    @property
+    def file_name(self):
+        return(self._parent.file_name)
+
+    @property
+    def parent(self):
+        return(self._parent)
+
+    @property
+    def subset(self):
+        return(self._subset)
+
+    @property
+    def compressed(self):
+        return(self._parent.compressed)
+
+    def extract(self):
+        """Extract subset into a new BufrHandle object"""
+        return(extract_subset(clone(self._parent), self._subset))
+
+    def _get_(self, key):
+        """Values of a key in this subset
+
+        :returns: list/array of values or None if key is not found
+        """
+        p = self._parent
+        i = self._subset
+        try:
+            if p.compressed:
+                v = _ec.codes_get_array(p.handle, key)
+                n = nsub(p)
+                if len(v) == n:
+                    return(v[i - 1:i])
+                if len(v) % n == 0:
+                    return(v[i - 1::n])
+                return(v)
+            rank, name = _split_rank_(key)
+            v = _ec.codes_get_array(p.handle,
+                                    '/subsetNumber={}/{}'.format(i, name))
+        except _ec.KeyValueNotFoundError:
+            return(None)
+        if rank is not None:
+            return(v[rank - 1:rank] if rank <= len(v) else None)
+        return(v)
+
+
+class LazyValues(_Mapping):
+    """Values of keys of a message or subset read on first access
+
+    Keys are listed when they are needed for the first time and each value
+    is read once and cached, so a caller pays only for the keys it touches.
+    Only listed keys can be read, as in a dict. Use materialize() to get
+    an OrderedDict (i.e. to serialize as JSON).
+
+    :param bufr_handle: BufrHandle or BufrSubset object
+    :param keys: List of keys or a function returns list of keys
+    :param fun: Function of (bufr_handle, key) returns value of key
+    """
+
+    def __init__(self, bufr_handle, keys, fun=None):
+        self._bufr_handle = bufr_handle
+        self._keys = keys
+        self._fun = get_val if fun is None else fun
+        self._values = {}
+        self._key_set = None
+
+    def __repr__(self):
+        s = 'LazyValues {{file: {} id: {} read: {}}}'
+        return(s.format(self._bufr_handle.file_name, self._bufr_handle.id,
+                        len(self._values)))
+
+    def _key_list(self):
+        if callable(self._keys):
+            self._keys = self._keys()
+        if self._key_set is None:
+            self._key_set = frozenset(self._keys)
+        return(self._keys)
+
+    def __contains__(self, key):
+        self._key_list()
+        return(key in self._key_set)
+
+    def __getitem__(self, key):
+        if key not in self._values:
+            if key not in self:
+                raise KeyError(key)
+            self._values[key] = self._fun(self._bufr_handle, key)
+        return(self._values[key])
+
+    def __iter__(self):
+        return(iter(self._key_list()))
+
+    def __len__(self):
+        return(len(self._key_list()))
+
+    def materialize(self):
+        """Read all values into an OrderedDict"""
+        return(_od([(k, self[k]) for k in self]))
+
+
+_rank_pattern_ = _re.compile(r'^#(\d+)#(.*)$')
+
+
+def _split_rank_(key):
+    """Split '#n#key' into rank and key name (rank is None if missing)"""
+    m = _rank_pattern_.match(key)
+    if m is None:
+        return(None, key)
+    return(int(m.group(1)), m.group(2))
+
+
+def _subset_keys_(bufr_handle):
+    """Keys of each subset of an uncompressed message
+
+    Keys iterator of an uncompressed message separates subsets by
+    'subsetNumber' and ranks keys through the whole message. Ranks are
+    renumbered per subset, as if the subset was extracted. Names of data
+    keys of subsets are cached as 'data_names' (see _data_names_).
+    """
+    c = bufr_handle._cache
+    if 'subset_keys' not in c:
+        head, subsets, counts = [], [], {}
+        for k in get_keys(bufr_handle):
+            if k == 'subsetNumber':
+                subsets.append([k])
+                counts = {}
+            elif len(subsets) == 0:
+                head.append(k)
+            else:
+                rank, name = _split_rank_(k)
+                if rank is not None:
+                    counts[name] = counts.get(name, 0) + 1
+                    k = '#{}#{}'.format(counts[name], name)
+                subsets[-1].append(k)
+        c['subset_keys'] = [head + i for i in subsets]
+        c['data_names'] = frozenset(_split_rank_(k)[1]
+                                    for i in subsets for k in i)
+    return(c['subset_keys'])
+
+
+def _data_names_(bufr_handle):
+    """Names of data keys of subsets of an uncompressed message"""
+    _subset_keys_(bufr_handle)
+    return(bufr_handle._cache['data_names'])
+
 
 def _eprint_(*args, **kwargs):
     print('ERROR:', *args, file=_sys.stderr, **kwargs)
@@ -129,17 +358,47 @@ def _open_(filename, mode='Ur'):
             f.close()
 
 
-def get_attr(bufr_handle, key):
-    """Get attributes of a key from BufrHandle object
+# attributes of keys per template (see _attr_plan_)
+_attr_cache_ = _LRUCache_(maxsize=256)
 
-    :param bufr_handle: BufrHandle Object
-    :param key: A string key name
-    :returns: (OrderedDict) attributes
+
+def _template_(bufr_handle):
+    """A hashable identifier of the template of a message"""
+    d = get_val(bufr_handle, 'unexpandedDescriptors')
+    return((tuple(d) if isinstance(d, list) else (d,),
+            get_val(bufr_handle, 'masterTablesVersionNumber'),
+            get_val(bufr_handle, 'localTablesVersionNumber'),
+            get_val(bufr_handle, 'bufrHeaderCentre'),
+            isinstance(bufr_handle, BufrSubset)))
+
+
+def _attr_plan_(bufr_handle):
+    """Attributes of keys for the template of a message
+
+    Attributes of a key never change for a template, so they are read
+    once and reused by all messages sharing the template.
+
+    :returns: dict of key names and attributes
     """
+    t = _template_(bufr_handle)
+    plan = _attr_cache_.get(t)
+    if plan is None:
+        plan = {}
+        _attr_cache_[t] = plan
+    return(plan)
+
+
+def _read_attr_(bufr_handle, key):
+    """Read attributes of a key from message"""
     attrs = ['code', 'units', 'scale', 'reference', 'width']
     attributes = _od.fromkeys(attrs)
     for a in attrs:
         k = key + '->' + a
+        if isinstance(bufr_handle, BufrSubset):
+            v = bufr_handle._get_(k)
+            if v is not None and len(v) > 0:
+                attributes[a] = _masked_(v[0:1]).tolist()[0]
+            continue
         try:
             attributes[a] = _ec.codes_get(bufr_handle.handle, k)
         except _ec.CodesInternalError:
@@ -147,6 +406,37 @@ def get_attr(bufr_handle, key):
     return(attributes)
 
 
+def _plan_attr_(plan, bufr_handle, key):
+    """Get attributes of a key through a plan (see _attr_plan_)"""
+    a = plan.get(key)
+    if a is None:
+        a = _read_attr_(bufr_handle, key)
+        plan[key] = a
+    return(a)
+
+
+def _code_table_columns_(plan, bufr_handle, keys):
+    """Index and code of keys whose units is CODE TABLE"""
+    t = (None, tuple(keys))
+    if t not in plan:
+        attrs = [_plan_attr_(plan, bufr_handle, k) for k in keys]
+        plan[t] = [(i, a['code']) for i, a in enumerate(attrs)
+                   if a['units'] == 'CODE TABLE']
+    return(plan[t])
+
+
+def get_attr(bufr_handle, key):
+    """Get attributes of a key from BufrHandle object
+
+    Attributes are cached per template of the message.
+
+    :param bufr_handle: BufrHandle Object
+    :param key: A string key name
+    :returns: (OrderedDict) attributes
+    """
+    return(_od(_plan_attr_(_attr_plan_(bufr_handle), bufr_handle, key)))
+
+
 def get_attributes(bufr_handle, keys):
     """Get attributes of keys
 
@@ -154,7 +444,8 @@ def get_attributes(bufr_handle, keys):
     :param key: A list of key names
     :returns: (OrderedDict) key names and attributes
     """
-    return(_od([(k, get_attr(bufr_handle, k)) for k in keys]))
+    plan = _attr_plan_(bufr_handle)
+    return(_od([(k, _od(_plan_attr_(plan, bufr_handle, k))) for k in keys]))
 
 
 def get_size(bufr_handle):
@@ -162,12 +453,14 @@ def get_size(bufr_handle):
     return(_ec.codes_get_message_size(bufr_handle.handle))
 
 
-def get_keys(bufr_handle):
-    """Get keys from  BufrHandle object
+# keys of messages per template and replication factors (see get_keys)
+_keys_cache_ = _LRUCache_(maxsize=256)
+# names of replication factor keys seen in messages of each template
+_factor_names_ = _LRUCache_(maxsize=256)
 
-    :param bufr_handle: BufrHandle Object
-    :returns: List of keys
-    """
+
+def _read_keys_(bufr_handle):
+    """Read keys of a message by keys iterator"""
     keys = []
     iterid = _ec.codes_bufr_keys_iterator_new(bufr_handle.handle)
     while _ec.codes_bufr_keys_iterator_next(iterid):
@@ -176,20 +469,107 @@ def get_keys(bufr_handle):
     return(keys)
 
 
-def get_val(bufr_handle, key):
+def _values_(bufr_handle, key):
+    """Values of a key as tuple or None if not found"""
+    try:
+        return(tuple(_np.asarray(
+            _ec.codes_get_array(bufr_handle.handle, key)).tolist()))
+    except _ec.KeyValueNotFoundError:
+        return(None)
+
+
+def _keys_signature_(bufr_handle):
+    """A hashable identifier of keys of a message
+
+    Messages of a template have the same keys unless they differ in
+    header (edition, centre, tables, number of subsets, compression),
+    local section or delayed replication factors.
+    """
+    t = (_template_(bufr_handle),
+         tuple(get_val(bufr_handle, k) for k in _layout_keys_),
+         tuple(_values_(bufr_handle, k) for k in _section2_keys_))
+    names = _factor_names_.get(t, ())
+    return((t, names, tuple(_values_(bufr_handle, k) for k in names)))
+
+
+def get_keys(bufr_handle):
+    """Get keys from  BufrHandle object
+
+    Keys of unpacked messages are cached per template and replication
+    factors, so keys iterator runs once for messages of the same form.
+
+    :param bufr_handle: BufrHandle Object
+    :returns: List of keys
+    """
+    if isinstance(bufr_handle, BufrSubset):
+        p = bufr_handle.parent
+        if p.compressed:
+            return(get_keys(p))
+        return(list(_subset_keys_(p)[bufr_handle.subset - 1]))
+    if not bufr_handle.unpacked:
+        return(_read_keys_(bufr_handle))
+    c = bufr_handle._cache
+    if 'keys' not in c:
+        sig = _keys_signature_(bufr_handle)
+        keys = _keys_cache_.get(sig)
+        if keys is None:
+            keys = _read_keys_(bufr_handle)
+            t, names = sig[0], set(sig[1])
+            names.update(n for n in (_split_rank_(k)[1] for k in keys)
+                         if n in _factor_keys_)
+            if len(names) > len(sig[1]):
+                # a factor key is seen first time, signature changes
+                _factor_names_[t] = tuple(sorted(names))
+                sig = _keys_signature_(bufr_handle)
+            _keys_cache_[sig] = keys
+        c['keys'] = keys
+    return(list(c['keys']))
+
+
+def get_val(bufr_handle, key, as_array=False):
     """Read value of a key from BufrHandle object
 
-    If value is missing returns None
+    If value is missing returns None. If as_array is True, values are
+    returned as a numpy masked array where missing values are masked.
 
     :param bufr_handle: BufrHandle object
     :param key: Key value
+    :param as_array: If True, a masked array is returned
     :returns: Value of the key
     """
+    if isinstance(bufr_handle, BufrSubset):
+        # as if the subset was extracted
+        if key in ('numberOfSubsets', 'subsetNumber'):
+            v = _np.array([1])
+        elif key in _header_set_:
+            return(get_val(bufr_handle.parent, key, as_array))
+        else:
+            v = bufr_handle._get_(key)
+            if v is None and not bufr_handle.compressed and \
+                    _split_rank_(key)[1] not in _data_names_(
+                        bufr_handle.parent):
+                # local section and other keys out of data section
+                return(get_val(bufr_handle.parent, key, as_array))
+            if v is None or len(v) == 0:
+                return('KeyNotFound')
+        v = _masked_(v)
+        if as_array:
+            return(v)
+        v = v.tolist()
+        return(v[0] if len(v) == 1 else v)
+    if not as_array and key in _header_set_:
+        v = _header_of_(bufr_handle)[key]
+        return(list(v) if isinstance(v, list) else v)
+    return(_read_val_(bufr_handle, key, as_array))
+
+
+def _read_val_(bufr_handle, key, as_array=False):
+    """Read value of a key from ecCodes handle (see get_val)"""
     v = None
     h = bufr_handle.handle
     try:
         size = _ec.codes_get_size(h, key)
-        if size == 1:
+        if size == 1 and not as_array:
             v = _ec.codes_get(h, key)
             # if isinstance(v, str):
             #     if '\xff' in v:
@@ -203,37 +583,170 @@ def get_val(bufr_handle, key):
                 if v == _ec.CODES_MISSING_LONG:
                     v = None
         else:
-            v = _ec.codes_get_array(h, key)
-            if isinstance(v, _nd):
+            v = _masked_(_ec.codes_get_array(h, key))
+            if not as_array:
                 v = v.tolist()
-                if isinstance(v[0], int):
-                    for i, j in enumerate(v):
-                        if j == _ec.CODES_MISSING_LONG:
-                            v[i] = None
-                if isinstance(v[0], float):
-                    for i, j in enumerate(v):
-                        if j == _ec.CODES_MISSING_DOUBLE:
-                            v[i] = None
-                        else:
-                            v[i] = round(v[i], 6)
-
-            return(v)
     except _ec.KeyValueNotFoundError:
         return('KeyNotFound')
     return(v)
 
 
+def _header_of_(bufr_handle):
+    """Cached header keys and values of a BufrHandle object
+
+    Header is decoded from the bytes of the message by a single ecCodes
+    call. Keys are read one by one only if the scanner does not support
+    the edition of message.
+    """
+    if bufr_handle._header is None:
+        h = _decode_header_(_ec.codes_get_message(bufr_handle.handle))
+        if h is None:
+            h = dict((k, _read_val_(bufr_handle, k)) for k in _header_set_)
+        bufr_handle._header = h
+    return(bufr_handle._header)
+
+
+def _masked_(v):
+    """Convert values read by codes_get_array to a masked array
+
+    Missing values are masked and floats are rounded to 6 digits.
+    """
+    if not isinstance(v, _nd):
+        return(_np.ma.masked_array(_np.array(v, dtype=object)))
+    if v.dtype.kind == 'f':
+        return(_np.ma.masked_equal(v, _ec.CODES_MISSING_DOUBLE).round(6))
+    if v.dtype.kind in 'iu':
+        return(_np.ma.masked_equal(v, _ec.CODES_MISSING_LONG))
+    return(_np.ma.masked_array(v))
+
+
+def _masked_list_(v):
+    """Convert a list of values (None is missing) to a masked array"""
+    mask = [i is None for i in v]
+    if any(isinstance(i, (str, type(u''))) for i in v):
+        return(_np.ma.masked_array(_np.array(v, dtype=object), mask=mask))
+    return(_np.ma.masked_array([0 if i is None else i for i in v],
+                               mask=mask))
+
+
+def _column_(bufr_handle, key, n):
+    """Values of a key for all subsets of a compressed message
+
+    Key must be unpacked before.
+
+    :param bufr_handle: BufrHandle object
+    :param key: Key name
+    :param n: Number of subsets
+    :returns: Masked array of length n or None if key is not found.
+              ValueError is raised if key has not a value per subset.
+    """
+    v = get_val(bufr_handle, key, as_array=True)
+    if isinstance(v, str):
+        return(None)
+    if len(v) == n:
+        return(v)
+    if len(v) == 1:
+        return(v[_np.zeros(n, dtype=int)])
+    raise ValueError('{} has {} values for {} subsets'.format(key, len(v), n))
+
+
+def _columns_(d):
+    """Convert values of subsets to masked arrays (see decode)
+
+    :param d: (OrderedDict) key names and lists of a value per subset
+    :returns: (OrderedDict) key names and masked arrays. Keys not found
+              and missing values are masked. ValueError is raised if a
+              key has more than one value in a subset.
+    """
+    ret = _od()
+    for k, v in d.items():
+        c = []
+        for i, x in enumerate(v, 1):
+            if isinstance(x, list):
+                if len(x) > 1:
+                    raise ValueError('{} has {} values in subset #{}'.format(
+                        k, len(x), i))
+                x = x[0] if len(x) == 1 else None
+            c.append(None if x == 'KeyNotFound' else x)
+        if all(x is None for x in c):
+            ret[k] = _np.ma.masked_all(len(c))
+        else:
+            ret[k] = _masked_list_(c)
+    return(ret)
+
+
+def _decode_columns_(bufr_handle, keys, decode_code_table=False,
+                     strict=False):
+    """Decode keys of a compressed message into masked arrays
+
+    :param strict: If True, ValueError of _column_ is raised
+    :returns: (OrderedDict) key names and masked arrays. Keys not found
+              are None. None is returned if a key has not a value per
+              subset.
+    """
+    n = nsub(bufr_handle)
+    try:
+        d = _od([(k, _column_(bufr_handle, k, n)) for k in keys])
+    except ValueError:
+        if strict:
+            raise
+        return(None)
+    if decode_code_table:
+        mtvn = get_val(bufr_handle, 'masterTablesVersionNumber')
+        plan = _attr_plan_(bufr_handle)
+        for i, code in _code_table_columns_(plan, bufr_handle, keys):
+            k = keys[i]
+            if d[k] is not None:
+                d[k] = _masked_list_(_get_value_from_code_table(
+                    d[k].tolist(), code, mtvn))
+    return(d)
+
+
 def pack(bufr_handle):
     """Pack BufrHandle object"""
     _ec.codes_set(bufr_handle.handle, 'pack', 1)
+    bufr_handle._invalidate()
+
+
+def set_val(bufr_handle, key, value):
+    """Set value of a key of BufrHandle object
+
+    Cached header, keys and attributes of the message are dropped. If a
+    data key is set, message stays unpacked, so the value is kept until
+    pack() encodes it. Setting a header key (i.e. unexpandedDescriptors)
+    needs the message to be unpacked again.
+
+    :param bufr_handle: BufrHandle object
+    :param key: Key name
+    :param value: Value or a list of values
+    """
+    if isinstance(bufr_handle, BufrSubset):
+        raise TypeError('A subset can not be modified, extract it first')
+    h = bufr_handle.handle
+    if isinstance(value, (list, tuple, _nd)):
+        _ec.codes_set_array(h, key, list(value))
+    else:
+        _ec.codes_set(h, key, value)
+    unpacked = bufr_handle.unpacked and key not in _header_set_
+    bufr_handle._invalidate()
+    bufr_handle._unpacked = unpacked
 
 
 def unpack(bufr_handle):
     """Unpack BufrHandle object
+
+    Nothing is done if message is already unpacked and not modified.
+
     :returns: True if operation is succeed else False
     """
+    if isinstance(bufr_handle, BufrSubset):
+        # parent of a subset is always unpacked
+        return(True)
+    if bufr_handle._unpacked:
+        return(True)
     try:
         _ec.codes_set(bufr_handle.handle, 'unpack', 1)
+        bufr_handle._unpacked = True
         return(True)
     except _ec.DecodingError as e:
         s = '(UNPACK) FILE: {} MSG #{} - {}'
@@ -268,6 +781,11 @@ def extract_subset(bufr_handle, subset):
         if len(subset) == 1:
             subset = subset[0]
 
+    if isinstance(bufr_handle, BufrSubset):
+        bufr_handle = bufr_handle.extract()
+        if bufr_handle is None:
+            return(None)
+
     if not unpack(bufr_handle):
         return(None)
 
@@ -281,6 +799,7 @@ def extract_subset(bufr_handle, subset):
         else:
             _ec.codes_set(h, 'extractSubset', subset)
         _ec.codes_set(h, 'doExtractSubsets', 1)
+        bufr_handle._invalidate()
     except _ec.CodesInternalError as e:
         s = 'FILE: {} - MSG #{} - Subset #{} "{}"'
         _eprint_(s.format(bufr_handle.file_name, bufr_handle.id,
@@ -289,48 +808,370 @@ def extract_subset(bufr_handle, subset):
     return(clone(bufr_handle))
 
 
+def extract_subset_list(bufr_handle, subsets):
+    """Extract subsets from a BufrHandle Object in a single operation
+
+    WARNING: This function modifies original message. Consider clone
+             the original message before.
+
+    :param bufr_handle: BufrHandle Object
+    :param subsets: List of subset ids
+    :returns: Handle to BUFR message contains subsets
+    """
+    if not isinstance(subsets, list):
+        subsets = [subsets]
+    if len(subsets) == 1:
+        return(extract_subset(bufr_handle, subsets[0]))
+
+    if isinstance(bufr_handle, BufrSubset):
+        bufr_handle = bufr_handle.extract()
+        if bufr_handle is None:
+            return(None)
+
+    if not unpack(bufr_handle):
+        return(None)
+
+    h = bufr_handle.handle
+    try:
+        _ec.codes_set_array(h, 'extractSubsetList', subsets)
+        _ec.codes_set(h, 'doExtractSubsets', 1)
+        bufr_handle._invalidate()
+    except _ec.CodesInternalError as e:
+        s = 'FILE: {} - MSG #{} - Subsets #{} "{}"'
+        _eprint_(s.format(bufr_handle.file_name, bufr_handle.id,
+                          subsets, e))
+        return(None)
+    return(clone(bufr_handle))
+
+
+def _subset_filter_(filters):
+    """Create SubsetFilter from keyword arguments"""
+    filters = dict(filters)
+    bbox = filters.pop('bbox', None)
+    require = filters.pop('require', None)
+    return(_SubsetFilter_(filters, bbox, require))
+
+
+def _subset_columns_(bufr_handle, keys):
+    """Values of keys for all subsets of an unpacked message
+
+    :returns: dict of key: masked array of length numberOfSubsets
+    """
+    n = nsub(bufr_handle)
+    columns = {}
+    for k in keys:
+        if bufr_handle.compressed:
+            try:
+                c = _column_(bufr_handle, k, n)
+            except ValueError:
+                # not a single value per subset
+                c = _first_values_(bufr_handle, k, n)
+        else:
+            # subsets can differ in keys and replications
+            c = _first_values_(bufr_handle, k, n)
+        columns[k] = _np.ma.masked_all(n) if c is None else c
+    return(columns)
+
+
+def _first_values_(bufr_handle, key, n):
+    """First value of a key in each subset as a masked array"""
+    c = []
+    for i in range(1, n + 1):
+        v = get_val(BufrSubset(bufr_handle, i), key)
+        c.append(v[0] if isinstance(v, list) else
+                 None if isinstance(v, str) else v)
+    return(_masked_list_(c))
+
+
+def _select_subsets_(bufr_handle, sf):
+    """Ids of subsets passing a SubsetFilter"""
+    if isinstance(bufr_handle, BufrSubset):
+        parent, ids = bufr_handle.parent, [bufr_handle.subset]
+    else:
+        parent = bufr_handle
+        if not unpack(parent):
+            return([])
+        ids = list(range(1, nsub(parent) + 1))
+    if len(sf) == 0:
+        return(ids)
+    m = sf.mask(_subset_columns_(parent, sf.keys))
+    return([i for i in ids if m[i - 1]])
+
+
+def select_subsets(bufr_handle, **filters):
+    """Select subsets of a message by values of data keys
+
+    Filters are evaluated on arrays of all subsets at once, so no subset
+    is extracted. Filter values can be given as in iter_messages.
+
+    :param bufr_handle: BufrHandle object
+    :param **filters: Dictionary of data keys to filter
+        blockNumber, stationNumber or any other data key
+        bbox (south, north, west, east box on latitude/longitude)
+        require (Key(s) must not be missing)
+    :returns: List of subset ids
+    """
+    return(_select_subsets_(bufr_handle, _subset_filter_(filters)))
+
+
+def filter_subsets(x, **filters):
+    """Keep only subsets passing the filters (see select_subsets)
+
+    Matching subsets of a message are extracted in a single operation.
+    Messages without a matching subset are skipped and messages of which
+    all subsets match are yielded as they are.
+
+    This is a generator function
+
+    :param x: BufrHandle/list of BufrHandles/Generator Function
+    :param **filters: Dictionary of data keys to filter
+    :returns: yields BufrHandle objects
+    """
+    sf = _subset_filter_(filters)
+
+    def iter_handles(x):
+        if isinstance(x, (BufrHandle, BufrSubset)):
+            yield(x)
+        elif isinstance(x, _GeneratorType) or isinstance(x, list):
+            for i in x:
+                for j in iter_handles(i):
+                    yield(j)
+        else:
+            raise TypeError('x must be a BufrHandle object, or a \
+                list/generator of BufrHandle objects')
+
+    for bh in iter_handles(x):
+        ids = _select_subsets_(bh, sf)
+        if len(ids) == 0:
+            continue
+        if isinstance(bh, BufrSubset):
+            bh = bh.extract()
+        elif len(ids) < nsub(bh):
+            bh = extract_subset_list(clone(bh), ids)
+        if bh is not None:
+            yield(bh)
+
+
 def header(bufr_handle):
     """Get header values from BufrHandle object
 
     :param bufr_handle: BufrHandle object
     :returns: (OrderedDict) Header key and values
     """
-    return(_od([(k, get_val(bufr_handle, k)) for k in _header_keys_]))
+    if isinstance(bufr_handle, BufrSubset):
+        return(_od([(k, get_val(bufr_handle, k)) for k in _header_keys_]))
+    h = _header_of_(bufr_handle)
+    return(_od([(k, list(h[k]) if isinstance(h[k], list) else h[k])
+                for k in _header_keys_]))
 
 
 def nsub(bufr_handle):
     """Number of subsets"""
+    if isinstance(bufr_handle, BufrSubset):
+        return(1)
     return(_ec.codes_get(bufr_handle.handle, 'numberOfSubsets'))
 
 
-def iter_decode(x, keys=None, merge=True):
-    if isinstance(x, BufrHandle):
-        yield(decode(x, keys, merge))
-    elif isinstance(x, _GeneratorType) or isinstance(x, list):
+def _payload_(bufr_handle):
+    """Binary content, id and file name of a message"""
+    return((_ec.codes_get_message(bufr_handle.handle), bufr_handle.id,
+            bufr_handle.file_name))
+
+
+# max. number of subsets of a message sent to a worker in a single job
+_job_subsets_ = 32
+
+
+def _iter_jobs_(x):
+    """Messages and ids of subsets to be sent to workers
+
+    Consecutive subsets of a message are grouped, so a message is sent
+    and unpacked once for a group and subsets are viewed in the worker
+    instead of being extracted here.
+
+    This is a generator function
+
+    :returns: yields (payload, list of subset ids or None) tuples
+    """
+    parent, ids = None, []
+    for h in x:
+        if isinstance(h, BufrSubset):
+            if h.parent is parent and len(ids) < _job_subsets_:
+                ids.append(h.subset)
+                continue
+            if parent is not None:
+                yield((_payload_(parent), ids))
+            parent, ids = h.parent, [h.subset]
+            continue
+        if parent is not None:
+            yield((_payload_(parent), ids))
+            parent = None
+        yield((_payload_(h), None))
+    if parent is not None:
+        yield((_payload_(parent), ids))
+
+
+def _run_(job):
+    """Run a function on a message or its subsets in a worker process"""
+    fun, ((message, id, file_name), ids), args = job
+    bh = _new_handle_(message, id, file_name)
+    if ids is None:
+        return([fun(bh, *args)])
+    unpack(bh)
+    return([fun(BufrSubset(bh, i), *args) for i in ids])
+
+
+def _pool_imap_(fun, x, workers, *args):
+    """Results of fun(bufr_handle, *args) for messages in a process pool
+
+    Messages are sent to workers as bytes and results are yielded in the
+    order of messages. Messages are read in batches, so the pool never
+    holds more than two batches of messages in memory. BufrSubset objects
+    are viewed in workers (see _iter_jobs_). fun must be a module level
+    function.
+
+    This is a generator function
+
+    :param fun: Function of a BufrHandle or BufrSubset object
+    :param x: BufrHandle/BufrSubset or an iterable of them
+    :param workers: Number of processes
+    :param args: Other arguments of fun
+    :returns: yields results of fun
+    """
+    from itertools import islice
+    from multiprocessing import Pool
+    if isinstance(x, (BufrHandle, BufrSubset)):
+        x = [x]
+    jobs = ((fun, j, args) for j in _iter_jobs_(x))
+    size = workers * 16
+    pool = Pool(workers)
+    try:
+        batch = list(islice(jobs, size))
+        pending = pool.imap(_run_, batch, 4) if len(batch) > 0 else None
+        while pending is not None:
+            batch = list(islice(jobs, size))
+            nxt = pool.imap(_run_, batch, 4) if len(batch) > 0 else None
+            for r in pending:
+                for i in r:
+                    yield(i)
+            pending = nxt
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _pool_decode_(bufr_handle, keys, merge, decode_code_table, columnar,
+                  workers):
+    """Decode subsets of an uncompressed message in a process pool
+
+    :returns: Same as decode(bufr_handle, ...)
+    """
+    r = _pool_imap_(decode, iter_subsets(bufr_handle), workers, keys, True,
+                    decode_code_table)
+    if keys is None:
+        return(_od([('header', header(bufr_handle)),
+                    ('subset', [d['subset'][0] for d in r])]))
+    if not (merge or columnar):
+        return([_od([(k, d[k][0]) for k in keys]) for d in r])
+    s = _od([(k, []) for k in keys])
+    for d in r:
+        for k in keys:
+            s[k].extend(d[k])
+    return(_columns_(s) if columnar else s)
+
+
+def _check_lazy_(keys, workers):
+    if keys is not None:
+        raise ValueError('lazy needs keys to be None, values of given keys '
+                         'are read anyway')
+    if workers is not None and workers > 1:
+        raise ValueError('lazy values cannot be read in other processes')
+
+
+def iter_decode(x, keys=None, merge=True, decode_code_table=False,
+                columnar=False, workers=None, lazy=False):
+    """Decode BufrHandle objects one by one (see decode)
+
+    If workers > 1, messages are decoded in a pool of processes and
+    results are yielded in the order of messages. Subsets of a single
+    uncompressed message are decoded in the pool as well.
+
+    :param x: BufrHandle/BufrSubset or an iterable of them
+    """
+    if lazy:
+        _check_lazy_(keys, workers)
+    parallel = workers is not None and workers > 1
+    if isinstance(x, (BufrHandle, BufrSubset)):
+        if parallel and isinstance(x, BufrHandle) and unpack(x) and \
+                not x.compressed and nsub(x) > 1:
+            yield(_pool_decode_(x, keys, merge, decode_code_table, columnar,
+                                workers))
+        else:
+            yield(decode(x, keys, merge, decode_code_table, columnar,
+                         lazy=lazy))
+    elif parallel:
+        for d in _pool_imap_(decode, x, workers, keys, merge,
+                             decode_code_table, columnar):
+            yield(d)
+    else:
         for h in x:
-            yield(decode(h, keys, merge))
+            yield(decode(h, keys, merge, decode_code_table, columnar,
+                         lazy=lazy))
 
 
-def decode(x, keys=None, merge=False, decode_code_table=False):
+def decode(x, keys=None, merge=False, decode_code_table=False,
+           columnar=False, workers=None, lazy=False):
     """Decode a BufrHandle object
-    :param x: BufrHandle object
+
+    If columnar is True and keys are defined, values of each key are
+    returned as a single numpy masked array of a value per subset (missing
+    values are masked) for both compressed and uncompressed messages.
+    ValueError is raised for a key which has more than one value in a
+    subset (i.e. a replicated key, use a ranked key as '#2#key' instead).
+    Compressed messages are decoded without extracting subsets.
+
+    :param x: BufrHandle/BufrSubset object or an iterable of them
     :param keys: If defined, only values of defined keys are returned
+    :param merge: If True, values of subsets are merged into lists
+    :param decode_code_table: If True, CODE TABLE values are decoded
+    :param columnar: If True, values are returned as masked arrays
+    :param workers: Number of processes to decode messages or subsets of
+                    an uncompressed message (order is kept)
+    :param lazy: If True, values of each subset are a LazyValues object
+                 which reads a value when it is accessed. keys must be None
+                 and workers must not be > 1 (ValueError).
     """
+    if lazy:
+        _check_lazy_(keys, workers)
 
-    if isinstance(x, _GeneratorType) or isinstance(x, list):
+    if not isinstance(x, (BufrHandle, BufrSubset)):
         if keys is None:
-            d = [decode(h, keys, merge) for h in x]
+            d = list(iter_decode(x, keys, merge, decode_code_table,
+                                 workers=workers, lazy=lazy))
         else:
-            if merge:
+            if columnar:
+                s = _od([(k, []) for k in keys])
+                for d in iter_decode(x, keys, merge, decode_code_table,
+                                     columnar, workers):
+                    if d is not None:
+                        for k in keys:
+                            s[k].append(d[k])
+                d = _od([(k, _np.ma.concatenate(v) if len(v) > 0
+                          else _np.ma.masked_array([]))
+                         for k, v in s.items()])
+            elif merge:
                 s = _od([(k, []) for k in keys])
-                for d in iter_decode(x, keys, merge):
+                for d in iter_decode(x, keys, merge, decode_code_table,
+                                     workers=workers):
                     if d is not None:
                         for k in keys:
                             s[k].extend(d[k])
                 d = s
             else:
                 s = []
-                for d in iter_decode(x, keys, merge):
+                for d in iter_decode(x, keys, merge, decode_code_table,
+                                     workers=workers):
                     if d is not None:
                         for i in d:
                             s.append(i)
@@ -338,26 +1179,39 @@ def decode(x, keys=None, merge=False, decode_code_table=False):
 
         return(d)
 
+    if workers is not None and workers > 1 and isinstance(x, BufrHandle):
+        return(next(iter_decode(x, keys, merge, decode_code_table, columnar,
+                                workers)))
+
     if not unpack(x):
         return(None)
 
     mtvn = get_val(x, 'masterTablesVersionNumber')
+    plans = {}
 
     def gv(bh, k):
         v = get_val(bh, k)
         if decode_code_table:
-            a = get_attr(bh, k)
+            t = isinstance(bh, BufrSubset)
+            if t not in plans:
+                plans[t] = _attr_plan_(bh)
+            a = _plan_attr_(plans[t], bh, k)
             if a['units'] == 'CODE TABLE':
                 v = _get_value_from_code_table(v, a['code'], mtvn)
         return(v)
 
+    is_subset = isinstance(x, BufrSubset)
+
     if keys is None:
         h = header(x)
 
         def decode_subset(bufr_handle):
-            keys2 = [k for k in get_keys(bufr_handle)
-                     if k not in _header_keys_]
-            return(_od([(k, gv(x, k)) for k in keys2]))
+            def keys2():
+                return([k for k in get_keys(bufr_handle)
+                        if k not in _header_key_set_])
+            if lazy:
+                return(LazyValues(bufr_handle, keys2, gv))
+            return(_od([(k, gv(bufr_handle, k)) for k in keys2()]))
 
         def decode_comp():
             return({'compressed': decode_subset(x)})
@@ -365,9 +1219,26 @@ def decode(x, keys=None, merge=False, decode_code_table=False):
         def decode_uncomp():
             return([decode_subset(s) for s in iter_subsets(x)])
 
+        if is_subset:
+            return(_od([('header', h), ('subset', [decode_subset(x)])]))
         fun = decode_comp if x.compressed else decode_uncomp
         return(_od([('header', h), ('subset', fun())]))
     else:
+        if x.compressed and not is_subset:
+            d = _decode_columns_(x, keys, decode_code_table, columnar)
+            if d is not None:
+                n = nsub(x)
+                if columnar:
+                    return(_od([(k, _np.ma.masked_all(n) if v is None else v)
+                                for k, v in d.items()]))
+                d = _od([(k, ['KeyNotFound'] * n if v is None else v.tolist())
+                         for k, v in d.items()])
+                if merge:
+                    return(d)
+                return([_od([(k, d[k][i]) for k in keys])
+                        for i in range(n)])
+        if columnar:
+            return(_columns_(decode(x, keys, True, decode_code_table)))
         if nsub(x) == 1:
             if merge:
                 return(_od([(k, [gv(x, k)]) for k in keys]))
@@ -385,68 +1256,253 @@ def decode(x, keys=None, merge=False, decode_code_table=False):
                         for i in iter_subsets(x)])
 
 
-def msg_count(bufr_file):
-    """Return number of messages in a BUFR file
+def _count_file_(bufr_file):
+    """Count messages in a BUFR file from bytes
+
+    :returns: (messages, skipped bytes, trailing bytes) or None on error
+    """
+    try:
+        with _open_buffer_(bufr_file) as buf:
+            return(_count_frames_(buf))
+    except (IOError, OSError, ValueError) as e:
+        _eprint_('FILE: {} - {}'.format(bufr_file, e))
+        return(None)
+
+
+def _list_files_(bufr_files, name='*'):
+    """List BUFR files in paths. Directories are walked recursively.
 
-    :param bufr_file: Path to BUFR file
-    :returns: Number of messages in a BUFR file
+    Hidden files, index and digest files are skipped.
     """
-    ret = None
-    with open(bufr_file, 'rb') as f:
-        ret = _ec.codes_count_in_file(f)
+    from fnmatch import fnmatch
+    from ._dedup_ import _EXT_ as dedup_ext
+    ret = []
+    for path in bufr_files:
+        if not _os.path.isdir(path):
+            ret.append(path)
+            continue
+        for root, dirs, files in _os.walk(path):
+            dirs.sort()
+            ret.extend(_os.path.join(root, f) for f in sorted(files)
+                       if not f.startswith('.') and fnmatch(f, name) and
+                       not f.endswith((_index_ext_, dedup_ext)))
     return(ret)
 
 
-def new_msg_from(bufr_file):
-    """Message generator for BUFR file
-    :param bufr_file: Path to BUFR file
+def msg_count(bufr_files, workers=8, name='*', details=False):
+    """Return number of messages in BUFR file(s)
+
+    Messages are counted by walking total lengths in section 0 of memory
+    mapped files, so ecCodes does not parse them. Files are counted in a
+    pool of threads.
+
+    :param bufr_files: Path to BUFR file/directory or list of paths.
+                       Directories are searched recursively.
+    :param workers: Number of threads
+    :param name: Pattern of file names in directories (i.e. '*.bufr4')
+    :param details: If True, count is a (messages, skipped bytes,
+                    trailing bytes) tuple. Skipped bytes are not part of
+                    any complete message and trailing bytes follow the
+                    last message (usually a truncated message).
+    :returns: Number of messages in a BUFR file or an ordered dict of
+              path: count if bufr_files is a list or directory. Count is
+              None if file cannot be read.
+    """
+    if not isinstance(bufr_files, (list, tuple)):
+        if not _os.path.isdir(bufr_files):
+            with _open_buffer_(bufr_files) as buf:
+                c = _count_frames_(buf)
+            return(c if details else c[0])
+        bufr_files = [bufr_files]
+    files = _list_files_(bufr_files, name)
+    if workers > 1 and len(files) > 1:
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(min(workers, len(files)))
+        try:
+            counts = pool.map(_count_file_, files, chunksize=16)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        counts = [_count_file_(f) for f in files]
+    if not details:
+        counts = [None if c is None else c[0] for c in counts]
+    return(_od(zip(files, counts)))
+
+
+def _new_handle_(message, id=None, file_name=None):
+    """Create a BufrHandle from bytes or a memoryview of a single message
+
+    ecCodes copies the message into the handle, so the view is not kept.
+    """
+    if not isinstance(message, (bytes, memoryview)):
+        message = bytes(message)
+    return(BufrHandle(_ec.codes_new_from_message(message), id, file_name))
+
+
+# in-memory sources of messages
+_buffer_types_ = (bytearray, memoryview, _mmap.mmap, _array.array, _nd)
+if bytes is not str:
+    _buffer_types_ += (bytes,)  # str is a path on Python 2
+
+# max. number of messages written by a single writev call
+_iov_max_ = 64
+
+
+def _buffer_(source):
+    """A flat byte view of an in-memory source
+
+    Nothing is copied, so slices of the view are views as well. mmap
+    objects are used as they are (a view keeps them from being closed).
+    """
+    if isinstance(source, _mmap.mmap):
+        return(source)
+    view = memoryview(source)
+    if not hasattr(view, 'cast'):  # Python 2, views are not searchable
+        return(source if hasattr(source, 'find') else view.tobytes())
+    if view.ndim != 1 or view.format != 'B':
+        view = view.cast('B')  # i.e. numpy arrays, array.array
+    return(view)
+
+
+def new_msg_from(source):
+    """Message generator for BUFR file or a buffer
+
+    Messages in buffers are passed to codes_new_from_message as views of
+    the buffer, so ecCodes makes the only copy of a message and messages
+    received from a socket or queue need not be written to a file first.
+
+    :param source: Path to BUFR file, '-' for stdin or bytes, bytearray,
+                   memoryview, mmap, array.array or numpy array contains
+                   BUFR messages
     :returns: BufrHandle Object
     """
-    with _open_(bufr_file, 'rb') as f:
+    if isinstance(source, _buffer_types_):
+        buf = _buffer_(source)
+        try:
+            i = 0
+            for offset, length in _iter_frames_(buf):
+                i += 1
+                yield(_new_handle_(buf[offset:offset + length], i))
+        finally:
+            if isinstance(buf, memoryview) and hasattr(buf, 'release'):
+                buf.release()
+        return
+    with _open_(source, 'rb') as f:
         i = 0
         while True:
             h = _ec.codes_bufr_new_from_file(f)
             i += 1
             if h is None:
                 break
-            yield(BufrHandle(h, i, bufr_file))
+            yield(BufrHandle(h, i, source))
+
+
+def iter_dump(x):
+    """Iterate over binary content of messages
+
+    Unlike dump(x), messages are not joined into a single bytes object.
+
+    This is a generator function
+
+    :param x: A BufrHandle object or a function generates BufrHandle objects
+    :returns: yields binary content of each message
+    """
+    if isinstance(x, (BufrHandle, BufrSubset)):
+        x = [x]
+    for h in x:
+        if isinstance(h, BufrSubset):
+            h = h.extract()
+        yield(_ec.codes_get_message(h.handle))
+
 
+def _dump_messages_(x, dedup=None):
+    """Binary content of messages without duplicates if dedup is defined"""
+    if dedup is None:
+        return(iter_dump(x))
+    from ._dedup_ import unique
+    return(unique(iter_dump(x), dedup))
 
-def dump(x, bufr_out=None):
+
+def _writev_(f, buffers):
+    """Write buffers to file by a single system call if possible"""
+    try:
+        fd = f.fileno()
+    except (AttributeError, IOError, ValueError):
+        fd = None
+    if fd is None or not hasattr(_os, 'writev'):
+        for b in buffers:
+            f.write(b)
+        return
+    f.flush()
+    while len(buffers) > 0:
+        n = _os.writev(fd, buffers)
+        while len(buffers) > 0 and n >= len(buffers[0]):
+            n -= len(buffers[0])
+            buffers = buffers[1:]
+        if n > 0:  # partially written
+            buffers = [memoryview(buffers[0])[n:]] + buffers[1:]
+
+
+def dump(x, bufr_out=None, dedup=None):
     """Dump a BufrHandle object or results of a generator function
 
     If x is BufrHandle object, bufr_out is ignored
     If bufr_out is None, binary content of the message(s) is returned.
     If bufr_out is '-', binary content sent to stdout.
+    Messages are written to bufr_out in batches by vectored writes (see
+    iter_dump to stream messages somewhere else).
 
     :param x: A BufrHandle object or a function generates BufrHandle objects
     :param bufr_out: Path to output file
+    :param dedup: If 'message' or 'station', duplicate messages are skipped
+                  (see digest)
     :returns: Number of dumped messages or binary content of messages
     """
+    if isinstance(x, BufrSubset):
+        x = x.extract()
     if bufr_out is None:
         if isinstance(x, BufrHandle):
             return(_ec.codes_get_message(x.handle))
-        elif isinstance(x, _GeneratorType) or isinstance(x, list):
-            return(b''.join([dump(h) for h in x]))
-    else:
-        r = 0
-        with _open_(bufr_out, 'wb') as f:
-            if isinstance(x, BufrHandle):
-                r = 1
-                _ec.codes_write(x.handle, f)
-            elif isinstance(x, _GeneratorType) or isinstance(x, list):
-                for h in x:
-                    r += 1
-                    _ec.codes_write(h.handle, f)
-            if r == 0 and bufr_out != '-':
-                _os.remove(bufr_out)
-        return(r)
-    raise TypeError('x must be a BufrHandle object, or a list/generator \
-        of BufrHandle objects')
+        if isinstance(x, _GeneratorType) or isinstance(x, list):
+            return(b''.join(_dump_messages_(x, dedup)))
+        raise TypeError('x must be a BufrHandle object, or a list/generator '
+                        'of BufrHandle objects')
+    if not isinstance(x, (BufrHandle, _GeneratorType, list)):
+        raise TypeError('x must be a BufrHandle object, or a list/generator '
+                        'of BufrHandle objects')
+    r = 0
+    messages = _dump_messages_(x, dedup)
+    with _open_(bufr_out, 'wb') as f:
+        f = getattr(f, 'buffer', f)
+        batch = []
+        for m in messages:
+            r += 1
+            batch.append(m)
+            if len(batch) == _iov_max_:
+                _writev_(f, batch)
+                batch = []
+        _writev_(f, batch)
+        f.flush()
+    if r == 0 and bufr_out != '-':
+        _os.remove(bufr_out)
+    return(r)
+
+
+def _write_json_(d, file_out, r, indent=2):
+    """Write decoded message(s) to a JSON file
+
+    :param r: Number of messages/subsets in d (file is removed if 0)
+    """
+    with _open_(file_out, 'w') as f:
+        _json.dump(d, f, ensure_ascii=False, indent=indent)
+    if r == 0 and file_out != '-':
+        _os.remove(file_out)
+    return(r)
 
 
 def json(x, file_out=None, keys=None, merge=False, decode_code_table=False,
-         indent=2):
+         indent=2, workers=None):
     """Convert a BufrHandle object or results of a generator function to JSON
 
     If x is BufrHandle object, bufr_out is ignored
@@ -455,51 +1511,107 @@ def json(x, file_out=None, keys=None, merge=False, decode_code_table=False,
 
     :param x: A BufrHandle object or a function generates BufrHandle objects
     :param file_out: Path to output file
+    :param workers: Number of processes to decode messages (see decode)
     :returns: Number of processed messages or json format of message(s).
     """
+    d = decode(x, keys, merge, decode_code_table, workers=workers)
     if file_out is None:
-        return(_json.dumps(decode(x, keys, merge, decode_code_table),
-                           ensure_ascii=False, indent=indent))
-    else:
-        r = 0
-        with _open_(file_out, 'w') as f:
-            d = decode(x, keys, merge, decode_code_table)
-            _json.dump(d, f, ensure_ascii=False, indent=indent)
-            r = len(d[keys[0]]) if merge else len(d)
-        if r == 0 and file_out != '-':
-            _os.remove(file_out)
-        return(r)
-    raise TypeError('x must be a BufrHandle object, or a list/generator \
-        of BufrHandle objects')
-
-
-def iter_subsets(x):
+        return(_json.dumps(d, ensure_ascii=False, indent=indent))
+    return(_write_json_(d, file_out, len(d[keys[0]]) if merge else len(d),
+                        indent))
+
+
+def _write_ndjson_(x, file_out='-', buffer_size=1000):
+    """Write dicts to a JSON Lines file
+
+    :param x: Iterable of dicts
+    :returns: Number of written lines
+    """
+    r = 0
+    with _open_(file_out, 'w') as f:
+        lines = []
+        for i in x:
+            lines.append(_json.dumps(i, ensure_ascii=False))
+            lines.append('\n')
+            r += 1
+            if len(lines) >= 2 * buffer_size:
+                f.write(''.join(lines))
+                lines = []
+        f.write(''.join(lines))
+    if r == 0 and file_out != '-':
+        _os.remove(file_out)
+    return(r)
+
+
+def ndjson(x, file_out='-', keys=None, decode_code_table=False,
+           buffer_size=1000, workers=None):
+    """Stream a BufrHandle object or results of a generator function to JSON
+    Lines (one JSON object per line)
+
+    Messages are decoded one by one and written as they are decoded, so
+    memory usage does not depend on the size of input. If keys is None,
+    a line is written per message, otherwise a line per subset.
+
+    :param x: A BufrHandle object or a function generates BufrHandle objects
+    :param file_out: Path to output file (default is stdout)
+    :param keys: If defined, only values of defined keys are written
+    :param decode_code_table: If True, CODE TABLE values are decoded
+    :param buffer_size: Number of lines to buffer before each write
+    :param workers: Number of processes to decode messages (order of
+                    lines is kept)
+    :returns: Number of written lines
+    """
+    def iter_lines():
+        for d in iter_decode(x, keys, False, decode_code_table,
+                             workers=workers):
+            if d is None:
+                continue
+            for i in ([d] if keys is None else d):
+                yield(i)
+    return(_write_ndjson_(iter_lines(), file_out, buffer_size))
+
+
+def iter_subsets(x, **filters):
     """Iterate over subsets in a BufrHandle or list or a Generator function
+
+    Message is unpacked once and subsets are yielded as BufrSubset views
+    to the message. Use BufrSubset.extract() to get a standalone message.
+    Subsets can be filtered by data keys (see select_subsets); filters are
+    evaluated on arrays of the message before any subset is yielded.
+
     :param x: BufrHandle/list of BufrHandles/Generator Function
-    :returns: BufrHandle Object
+    :param **filters: Dictionary of data keys to filter
+    :returns: BufrSubset Object
     """
-    if isinstance(x, BufrHandle):
-        cx = clone(x)
-        for i in range(1, nsub(x) + 1):
-            subset = extract_subset(cx, i)
-            if subset is None:
-                break
-            if unpack(subset):
-                yield(subset)
-    elif isinstance(x, _GeneratorType) or isinstance(x, list):
-        for i in x:
-            for j in iter_subsets(i):
-                yield(j)
-    else:
-        raise TypeError('x must be a BufrHandle object, or a list/generator \
+    sf = _subset_filter_(filters)
+
+    def iter_views(x):
+        if isinstance(x, (BufrSubset, BufrHandle)):
+            for i in _select_subsets_(x, sf):
+                yield(x if isinstance(x, BufrSubset) else BufrSubset(x, i))
+        elif isinstance(x, _GeneratorType) or isinstance(x, list):
+            for i in x:
+                for j in iter_views(i):
+                    yield(j)
+        else:
+            raise TypeError('x must be a BufrHandle object, or a list/generator \
             of BufrHandle objects')
 
+    for s in iter_views(x):
+        yield(s)
+
 
 def iter_messages(bufr_files, **filters):
     """Iterate over messages in BUFR files(s)
 
     Also messages can be filtered by message id and header keys.
-    if msg_id is defined other rules are ignored except subset.
+    Filters are compiled once (see MessageFilter). Besides single values,
+    a filter value can be a range ('A..B', 'A..' or '..B'), a negation
+    ('!V') or a list of them. Messages after the last wanted message id
+    are not read. Header keys are decoded straight from the bytes of the
+    message, so only messages passing the filters are loaded by ecCodes.
+    If BUFR file has an up to date index (see update_index), messages are
+    read directly from their offsets without scanning the file.
 
     This is a generator function
 
@@ -528,56 +1640,63 @@ def iter_messages(bufr_files, **filters):
         unexpandedDescriptor
         typicalTime
         typicalDate
+        template (Name(s) of registered templates, see register_template)
     :return: Yields bufr_handle
     """
 
-    def key_value_found(fl, bufr_handle):
-        if fl[0] is None:
-            return(True)
-        if fl[0] == 'msg':
-            return(bufr_handle.id in fl[1])
+    def iter_frames(buf, bufr_file, mf):
+        """Yields id, offset, length and header of messages"""
+        idx = None if bufr_file == '-' else _load_index_(bufr_file)
+        if idx is not None:
+            if mf.msg is not None:
+                ids = [i for i in mf.msg if 0 < i <= len(idx)]
+            else:
+                n = len(idx) if mf.last is None else min(len(idx), mf.last)
+                ids = range(1, n + 1)
+            for i in ids:
+                if mf.wants(i):
+                    offset, length = idx.frame(i)
+                    yield((i, offset, length, idx.header(i)))
         else:
-            val = get_val(bufr_handle, fl[0])
-            if not isinstance(val, list):
-                val = [val]
-            ret = [v == val if isinstance(v, list) else v in val
-                   for v in fl[1]]
-            return(any(ret))
-
-    def is_in(filters, bh):
-        for fl in filters:
-            if not key_value_found(fl, bh):
-                return(False)
-        return(True)
-
-    def iter_file(bufr_file, filters):
-        if len(filters) == 0:
-            filters = [[None, None]]
-        for bh in new_msg_from(bufr_file):
-            if filters[0] == 'msg':
-                if bh.id > max(filters[1]):
+            i = 0
+            for offset, length in _iter_frames_(buf):
+                i += 1
+                if mf.last is not None and i > mf.last:
                     break
-            if is_in(filters, bh):
+                if mf.wants(i):
+                    yield((i, offset, length, _decode_header_(buf, offset)))
+
+    def iter_file(bufr_file, mf):
+        # header keys are decoded from bytes, others need a handle
+        handle_keys = [k for k in mf.keys if k not in _header_set_]
+        with _open_buffer_(bufr_file) as buf:
+            for i, offset, length, h in iter_frames(buf, bufr_file, mf):
+                if h is not None and not mf.match(h):
+                    continue
+                bh = _new_handle_(buf[offset:offset + length], i, bufr_file)
+                if h is not None:
+                    bh._header = h  # already decoded
+                keys = mf.keys if h is None else handle_keys
+                if len(keys) > 0:
+                    # data keys are only available after unpacking
+                    if len(handle_keys) > 0:
+                        unpack(bh)
+                    values = {k: get_val(bh, k) for k in keys}
+                    if not mf.match(values):
+                        continue
                 yield(bh)
 
     if not isinstance(bufr_files, list):
         bufr_files = [bufr_files]
 
     filters = {k: v for k, v in filters.items() if v is not None}
-    for k in filters.keys():
-        if not isinstance(filters[k], list):
-            filters[k] = [filters[k]]
-
-    subset = None
-    if 'subset' in filters.keys():
-        subset = filters['subset']
-        del filters['subset']
-
-    if 'msg' in filters.keys():
-        filters = {'msg': filters['msg']}
+    subset = filters.pop('subset', None)
+    if subset is not None and not isinstance(subset, list):
+        subset = [subset]
+    mf = _MessageFilter_(filters)
 
     for f in bufr_files:
-        for bh in iter_file(f, [[k, v] for k, v in filters.items()]):
+        for bh in iter_file(f, mf):
             if subset is not None:
                 bh = extract_subset(clone(bh), subset)
             if bh is not None:
@@ -594,23 +1713,7 @@ def iter_synop(bufr_files, **filters):
     """
 
     filters['dataCategory'] = 0
-    filters['unexpandedDescriptors'] = [
-        307080, 307086, 307096,
-        [307086, 1023, 4025, 2177, 101000, 31001, 20003,
-         103000, 31001, 5021, 20001, 5021, 101000, 31000,
-         302056, 103000, 31000, 33041, 20058, 22061, 101000,
-         31000, 302022, 101000, 31001, 302023, 103000, 31001,
-         20054, 20012, 20090, 4025, 13012, 4025, 11042,
-         104000, 31001, 8021, 4025, 11042, 8021, 115000,
-         31001, 8021, 4015, 8021, 4025, 11001, 11002, 8021,
-         4015, 8021, 4025, 11001, 11002, 8021, 4025, 4015,
-         103000, 31001, 4025, 4025, 20003, 111000, 31001,
-         4025, 4025, 5021, 5021, 20054, 20024, 20025, 20026,
-         20027, 20063, 8021],
-        [301090, 302031, 302035, 302036, 302047, 8002, 302048,
-         302037, 302043, 302044, 101002, 302045, 302046],
-        [307096, 22061, 20058, 4024, 13012, 4024],
-        [307079, 4025, 11042]]
+    filters['template'] = 'synop'
     return(iter_messages(bufr_files, **filters))
 
     # for s in iter_subsets(iter_messages(bufr_files, **filters)):
@@ -638,7 +1741,7 @@ def get_msg(bufr_files, msg=1, subset=None):
     return(handles)
 
 
-def copy_msg(bufr_files, bufr_out, msg=1, subset=None):
+def copy_msg(bufr_files, bufr_out, msg=1, subset=None, dedup=None):
     """Copy message and subset from BUFR file(s) into a new file
 
     Whole message is copied if subset was not defined.
@@ -647,74 +1750,127 @@ def copy_msg(bufr_files, bufr_out, msg=1, subset=None):
     :param bufr_out: Path to BUFR file to save
     :param msg: Id's of message(s)
     :param subset: Id's subset(s) (or an interval)
+    :param dedup: If 'message' or 'station', duplicate messages are skipped
     :returns: Number of copied messages
     """
     return(dump(iter_messages(bufr_files, **{'msg': msg, 'subset': subset}),
-                bufr_out))
+                bufr_out, dedup))
 
 
-def to_csv(keys, gen_fun, bufr_out='-', decode_code_table=False):
-    """Save values of keys to a csv file
+def _csv_row_(bufr_handle, keys, decode_code_table=False):
+    """Values of keys of a BufrHandle object as a csv row"""
+    if any(k not in _header_key_set_ for k in keys):
+        unpack(bufr_handle)  # no-op for subsets
+    r = [get_val(bufr_handle, k) for k in keys]
+    if decode_code_table:
+        mtvn = get_val(bufr_handle, 'masterTablesVersionNumber')
+        plan = _attr_plan_(bufr_handle)
+        for i, code in _code_table_columns_(plan, bufr_handle, keys):
+            r[i] = _get_value_from_code_table(r[i], code, mtvn)
+    return(r)
 
-    You must define keys, so each key will be saved as column into the csv.
 
-    :param keys: Keys to save to csv
-    :param gen_fun: A function generates BufrHandle object(s)
-    :param bufr_out: Output file name (default is stdout)
-    :param decode_code_table: If True, CODE TABLE values are saved
-    :returns: None"""
+def _write_csv_(keys, rows, bufr_out='-'):
+    """Write header and rows to a csv file"""
     n = 0
     with _open_(bufr_out, 'w') as f:
         writer = _csv.writer(f, delimiter=';')
         writer.writerow(keys)
-        for s in gen_fun:
-            r = [get_val(s, k) for k in keys]
-            if decode_code_table:
-                mtvn = get_val(s, 'masterTablesVersionNumber')
-                attrib = get_attributes(s, keys)
-                for i, k in enumerate(keys):
-                    if attrib[k]['units'] == 'CODE TABLE':
-                        r[i] = _get_value_from_code_table(
-                            r[i], attrib[k]['code'], mtvn)
+        for r in rows:
             writer.writerow(r)
             n += 1
     return(n)
 
 
+def to_csv(keys, gen_fun, bufr_out='-', decode_code_table=False,
+           workers=None):
+    """Save values of keys to a csv file
+
+    You must define keys, so each key will be saved as column into the csv.
+
+    :param keys: Keys to save to csv
+    :param gen_fun: A function generates BufrHandle object(s)
+    :param bufr_out: Output file name (default is stdout)
+    :param decode_code_table: If True, CODE TABLE values are saved
+    :param workers: Number of processes to read values (order of rows is
+                    kept)
+    :returns: None"""
+    if workers is not None and workers > 1:
+        rows = _pool_imap_(_csv_row_, gen_fun, workers, keys,
+                           decode_code_table)
+    else:
+        rows = (_csv_row_(s, keys, decode_code_table) for s in gen_fun)
+    return(_write_csv_(keys, rows, bufr_out))
+
+
+def _subset_rows_(bufr_handle, keys, decode_code_table, filters):
+    """Decoded values of keys of selected subsets of a message"""
+    return(decode(list(iter_subsets(bufr_handle, **filters)), keys, False,
+                  decode_code_table))
+
+
 def synop_to(bufr_files, bufr_out='-', decode_code_table=False, fmt='bufr',
+             blockNumber=None, stationNumber=None, bbox=None, workers=None,
              **filters):
+    """Save SYNOP messages to a file
+
+    Subsets can be selected by blockNumber, stationNumber and bbox
+    (south, north, west, east). Selection is done on arrays of each
+    message, so only the selected subsets are extracted or decoded.
+    If workers > 1, messages are decoded in a pool of processes (csv,
+    json and ndjson). Order of subsets is kept.
+    """
+    subset_filters = {'blockNumber': blockNumber,
+                      'stationNumber': stationNumber, 'bbox': bbox}
 
     def iter():
-        for s in iter_subsets(iter_synop(bufr_files, **filters)):
-            if get_val(s, 'latitude') is not None:
-                yield(s)
+        return(iter_subsets(iter_synop(bufr_files, **filters),
+                            require='latitude', **subset_filters))
+
+    def iter_rows():
+        sf = dict(subset_filters, require='latitude')
+        for d in _pool_imap_(_subset_rows_, iter_synop(bufr_files, **filters),
+                             workers, _synop_keys_, decode_code_table, sf):
+            for i in d:
+                yield(i)
 
     n = 0
     if fmt == 'bufr':
-        n = dump(iter_synop(bufr_files, **filters), bufr_out)
+        msgs = iter_synop(bufr_files, **filters)
+        if any(v is not None for v in subset_filters.values()):
+            msgs = filter_subsets(msgs, **subset_filters)
+        n = dump(msgs, bufr_out)
+    elif workers is not None and workers > 1:
+        if fmt == 'csv':
+            n = _write_csv_(_synop_keys_, (list(d.values())
+                                           for d in iter_rows()), bufr_out)
+        elif fmt == 'json':
+            d = _od([(k, []) for k in _synop_keys_])
+            for i in iter_rows():
+                for k in _synop_keys_:
+                    d[k].append(i[k])
+            n = _write_json_(d, bufr_out, len(d[_synop_keys_[0]]))
+        elif fmt == 'ndjson':
+            n = _write_ndjson_(iter_rows(), bufr_out)
     elif fmt == 'csv':
         n = to_csv(_synop_keys_, iter(), bufr_out, decode_code_table)
     elif fmt == 'json':
         n = json(iter(), bufr_out, _synop_keys_, True, decode_code_table)
+    elif fmt == 'ndjson':
+        n = ndjson(iter(), bufr_out, _synop_keys_, decode_code_table)
     return(n)
 
 
 def synop_to_csv(bufr_files, bufr_out='-', decode_code_table=False, **filters):
     """Save SYNOP messages to a csv file"""
-    def iter():
-        for s in iter_subsets(iter_synop(bufr_files, **filters)):
-            if get_val(s, 'latitude') is not None:
-                yield(s)
-    return(to_csv(_synop_keys_, iter(), bufr_out, decode_code_table))
+    subsets = iter_subsets(iter_synop(bufr_files, **filters),
+                           require='latitude')
+    return(to_csv(_synop_keys_, subsets, bufr_out, decode_code_table))
 
 
 def synop_to_json(bufr_files, bufr_out='-',
                   decode_code_table=False, **filters):
-
-    def iter():
-        for s in iter_subsets(iter_synop(bufr_files, **filters)):
-            if get_val(s, 'latitude') is not None:
-                yield(s)
-
-    return(json(iter(), bufr_out, _synop_keys_))
+    subsets = iter_subsets(iter_synop(bufr_files, **filters),
+                           require='latitude')
+    return(json(subsets, bufr_out, _synop_keys_))
 
@@ -0,0 +1,287 @@
+"""
+xtrabufr._filters_
+~~~~~~~~~~~~~~~~~~
+Compiled filters for messages
+
+Filters are compiled once into predicates and evaluated on a dict of
+values of a message. Each filter value can be:
+    V             equal to V (i.e. 91 or '91')
+    'A..B'        between A and B (inclusive). A or B can be omitted
+    '!V'          not V (or not between A and B for '!A..B')
+    [V1, V2, ...] any of values. Negations exclude matches of positives.
+
+Strings of numbers are compared as numbers, so '20180324..20180331' works
+for typicalDate and '0..6' for typicalHour.
+
+SubsetFilter evaluates the same kind of filters on arrays of all subsets
+of a message at once.
+"""
+
+import numpy as _np
+from ._templates_ import Templates as _Templates_
+from ._templates_ import template_of as _template_of_
+
+__all__ = ['MessageFilter', 'SubsetFilter']
+
+_string_types_ = (str, type(u''))
+_RANGE_ = '..'
+
+
+def _norm_(v):
+    """Convert string of a number to number"""
+    if isinstance(v, _string_types_):
+        try:
+            return(int(v))
+        except ValueError:
+            try:
+                return(float(v))
+            except ValueError:
+                return(v)
+    return(v)
+
+
+def _split_(values):
+    """Split values into positives and negations"""
+    if not isinstance(values, list):
+        values = [values]
+    pos, neg = [], []
+    for v in values:
+        if isinstance(v, _string_types_) and v.startswith('!'):
+            neg.append(v[1:])
+        else:
+            pos.append(v)
+    return(pos, neg)
+
+
+def _bounds_(v):
+    """Bounds of a range value or None if v is not a range"""
+    if isinstance(v, _string_types_) and _RANGE_ in v:
+        lo, hi = v.split(_RANGE_, 1)
+        return((_norm_(lo) if lo != '' else None,
+                _norm_(hi) if hi != '' else None))
+    return(None)
+
+
+def _in_range_(x, lo, hi):
+    x = _norm_(x)
+    try:
+        return((lo is None or x >= lo) and (hi is None or x <= hi))
+    except TypeError:
+        return(False)
+
+
+def _matcher_(values):
+    """Compile values to a function of list of message values
+
+    A list of values in a message matches a scalar filter value if any of
+    them matches. A list filter value must be equal to the whole list.
+    """
+    eq = set()
+    ranges = []
+    lists = []
+    for v in values:
+        b = _bounds_(v)
+        if b is not None:
+            ranges.append(b)
+        elif isinstance(v, list):
+            lists.append(v)
+        else:
+            eq.add(_norm_(v))
+
+    def match(vals, version=None):
+        for x in vals:
+            if x is None:
+                continue
+            if _norm_(x) in eq:
+                return(True)
+            for lo, hi in ranges:
+                if _in_range_(x, lo, hi):
+                    return(True)
+        return(vals in lists)
+    return(match)
+
+
+def _templates_(values):
+    """Compile unexpandedDescriptors values to a template matcher"""
+    t = _Templates_()
+    t.add(True, [[_norm_(i) for i in v] if isinstance(v, list) else _norm_(v)
+                 for v in values])
+    return(lambda vals, version='latest': t.match(vals, version) is not None)
+
+
+def _predicate_(key, values):
+    """Compile filter values of a key to a predicate
+
+    Predicate is a function of (value, version) where version is master
+    table version of the message (used by template filters).
+    """
+    pos, neg = _split_(values)
+    comp = _templates_ if key == 'unexpandedDescriptors' else _matcher_
+    pos = comp(pos) if len(pos) > 0 else None
+    neg = comp(neg) if len(neg) > 0 else None
+
+    def predicate(val, version='latest'):
+        if key == 'template':
+            val = _template_of_(val, version)
+        if not isinstance(val, list):
+            val = [val]
+        if pos is not None and not pos(val, version):
+            return(False)
+        return(neg is None or not neg(val, version))
+    return(predicate)
+
+
+class MessageFilter(object):
+    """Compiled filters of iter_messages
+
+    msg filter is compiled separately. If it consists of message ids and
+    bounded ranges only, ids after the last wanted id are never read.
+    'template' filter is evaluated on unexpandedDescriptors with tables of
+    masterTablesVersionNumber of the message.
+    """
+
+    def __init__(self, filters):
+        self.msg = None
+        self.last = None
+        self._ids = None
+        self._msg = None
+        self._predicates = []
+        for k, v in filters.items():
+            if v is None:
+                continue
+            if k == 'msg':
+                self._compile_msg(v)
+            else:
+                src = 'unexpandedDescriptors' if k == 'template' else k
+                self._predicates.append((src, _predicate_(k, v)))
+        keys = set(p[0] for p in self._predicates)
+        if 'unexpandedDescriptors' in keys:
+            keys.add('masterTablesVersionNumber')
+        self.keys = sorted(keys)
+
+    def __repr__(self):
+        return('MessageFilter {{msg: {} keys: {}}}'.format(
+            self.msg if self.msg is not None else self._msg is not None,
+            self.keys))
+
+    def _compile_msg(self, values):
+        pos, neg = _split_(values)
+        ids = set()
+        ranges = []
+        for v in pos:
+            b = _bounds_(v)
+            if b is None:
+                ids.add(int(v))
+            else:
+                ranges.append(b)
+        if len(neg) == 0 and all(b[1] is not None for b in ranges):
+            for lo, hi in ranges:
+                ids.update(range(lo if lo is not None else 1, hi + 1))
+            self.msg = sorted(ids)
+            self._ids = ids
+            self.last = self.msg[-1] if len(self.msg) > 0 else 0
+        else:
+            self._msg = _predicate_('msg', values)
+            if len(pos) > 0 and all(b[1] is not None for b in ranges):
+                self.last = max(list(ids) + [b[1] for b in ranges])
+
+    def wants(self, i):
+        """Check message id is wanted"""
+        if self._msg is not None:
+            return(self._msg(i))
+        return(self._ids is None or i in self._ids)
+
+    def match(self, values):
+        """Check values of a message pass the filters
+
+        Only filters of the keys in values are evaluated.
+
+        :param values: dict of key: value
+        :returns: True or False
+        """
+        version = values.get('masterTablesVersionNumber', 'latest')
+        for k, p in self._predicates:
+            if k in values and not p(values[k], version):
+                return(False)
+        return(True)
+
+
+def _vector_(values, a):
+    """Elements of a masked array matching any of values"""
+    data = _np.ma.getdata(a)
+    m = _np.zeros(len(a), dtype=bool)
+    eq = []
+    for v in values:
+        b = _bounds_(v)
+        if b is None:
+            eq.append(_norm_(v))
+            continue
+        r = _np.ones(len(a), dtype=bool)
+        if b[0] is not None:
+            r &= data >= b[0]
+        if b[1] is not None:
+            r &= data <= b[1]
+        m |= r
+    if len(eq) > 0:
+        m |= _np.isin(data, eq)
+    return(m & ~_np.ma.getmaskarray(a))
+
+
+class SubsetFilter(object):
+    """Compiled filters of subsets
+
+    Filters are evaluated on arrays of values of all subsets of a message,
+    so subsets are selected before they are extracted or decoded.
+
+    :param filters: Dictionary of data keys (i.e. blockNumber,
+                    stationNumber) and filter values
+    :param bbox: (south, north, west, east) box on latitude/longitude.
+                 If west > east, box crosses 180th meridian.
+    :param require: Key(s) must not be missing (i.e. latitude)
+    """
+
+    def __init__(self, filters=None, bbox=None, require=None):
+        self._filters = [(k, _split_(v)) for k, v in (filters or {}).items()
+                         if v is not None]
+        self.bbox = None if bbox is None else [float(i) for i in bbox]
+        if require is not None and not isinstance(require, list):
+            require = [require]
+        self.require = require or []
+        keys = set(self.require) | set(k for k, _ in self._filters)
+        if self.bbox is not None:
+            keys |= set(['latitude', 'longitude'])
+        self.keys = sorted(keys)
+
+    def __repr__(self):
+        return('SubsetFilter {{keys: {} bbox: {}}}'.format(self.keys,
+                                                          self.bbox))
+
+    def __len__(self):
+        return(len(self.keys))
+
+    def mask(self, columns):
+        """Check subsets pass the filters
+
+        :param columns: dict of key: masked array of values of subsets
+        :returns: Boolean array
+        """
+        n = len(columns[self.keys[0]]) if len(self.keys) > 0 else 0
+        m = _np.ones(n, dtype=bool)
+        for k in self.require:
+            m &= ~_np.ma.getmaskarray(columns[k])
+        for k, (pos, neg) in self._filters:
+            if len(pos) > 0:
+                m &= _vector_(pos, columns[k])
+            if len(neg) > 0:
+                m &= ~_vector_(neg, columns[k])
+        if self.bbox is not None:
+            south, north, west, east = self.bbox
+            lat, lon = columns['latitude'], columns['longitude']
+            m &= ~(_np.ma.getmaskarray(lat) | _np.ma.getmaskarray(lon))
+            lat, lon = _np.ma.getdata(lat), _np.ma.getdata(lon)
+            m &= (lat >= south) & (lat <= north)
+            if west <= east:
+                m &= (lon >= west) & (lon <= east)
+            else:
+                m &= (lon >= west) | (lon <= east)
+        return(m)
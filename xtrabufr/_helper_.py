@@ -6,9 +6,68 @@ Helper functions
 from __future__ import print_function
 import re as _re
 from pprint import pformat as _pformat
+from collections import OrderedDict as _od
 from numpy import array as _arr
 
 
+class LRUCache(object):
+    """A bounded dictionary discards least recently used items
+
+    :param maxsize: Maximum number of items
+    :param on_discard: A function called with key and value of each
+                       discarded item (e.g. to close a file)
+    """
+
+    def __init__(self, maxsize=128, on_discard=None):
+        self._d = _od()
+        self.maxsize = maxsize
+        self.on_discard = on_discard
+
+    def __repr__(self):
+        return('LRUCache {{size: {} maxsize: {}}}'.format(len(self),
+                                                         self.maxsize))
+
+    def __len__(self):
+        return(len(self._d))
+
+    def __contains__(self, key):
+        return(key in self._d)
+
+    def __iter__(self):
+        return(iter(list(self._d.keys())))
+
+    def __getitem__(self, key):
+        v = self._d.pop(key)
+        self._d[key] = v
+        return(v)
+
+    def __setitem__(self, key, value):
+        if key in self._d:
+            del self._d[key]
+        self._d[key] = value
+        while len(self._d) > self.maxsize:
+            self.discard(next(iter(self._d)))
+
+    def get(self, key, default=None):
+        if key in self._d:
+            return(self[key])
+        return(default)
+
+    def items(self):
+        return(list(self._d.items()))
+
+    def discard(self, key):
+        """Remove an item and call on_discard"""
+        v = self._d.pop(key)
+        if self.on_discard is not None:
+            self.on_discard(key, v)
+
+    def clear(self):
+        """Discard all items"""
+        for k in list(self._d.keys()):
+            self.discard(k)
+
+
 def print_list(x, key=''):
     if isinstance(x, list):
         y = _pformat(_arr(x))
@@ -73,7 +132,9 @@ def print_msg(msg, filename='', ignore_missing=False):
         for k in h.keys():
             print_var(k, h[k], 2, ignore_missing)
         print('')
-        for i, s in subset.items():
+        if isinstance(subset, list):
+            subset = dict(enumerate(subset, 1))
+        for i, s in sorted(subset.items()):
             print('  Subset #{}'.format(i))
             for k in s.keys():
                 print_var(k, s[k], 4, ignore_missing)
@@ -0,0 +1,211 @@
+"""
+xtrabufr._index_
+~~~~~~~~~~~~~~~~~~
+Sidecar message index for BUFR files
+
+An index file (<bufr_file>.xbi) is stored next to the BUFR file. It keeps
+id, byte offset, length and header keys of each message, so a message can
+be read without scanning the file from the start.
+
+Layout of the index file:
+    b'XBI1'        magic
+    >I             length of metadata
+    metadata       JSON object (size, mtime, scanned, count)
+    count x >QII   offset, length and position of header of each message
+    count x line   JSON list of values of header keys (or null)
+"""
+
+import os as _os
+import json as _json
+import struct as _struct
+from collections import OrderedDict as _od
+from ._scanner_ import _header_keys_
+from ._scanner_ import open_buffer as _open_buffer_
+from ._scanner_ import iter_frames as _iter_frames_
+from ._scanner_ import decode_header as _decode_header_
+from ._scanner_ import add_derived as _add_derived_
+
+__all__ = ['MessageIndex', 'build_index', 'update_index', 'load_index']
+
+_MAGIC_ = b'XBI1'
+_EXT_ = '.xbi'
+_LEN_ = _struct.Struct('>I')
+_RECORD_ = _struct.Struct('>QII')
+
+
+def index_path(bufr_file):
+    """Path to index file of a BUFR file"""
+    return(bufr_file + _EXT_)
+
+
+class MessageIndex(object):
+    """Index of messages in a BUFR file
+
+    Message ids start from 1 as in iter_messages. Offsets and headers are
+    unpacked on demand, so loading an index costs a single read.
+    """
+
+    def __init__(self, bufr_file, meta, data=b'', table=0):
+        self._bufr_file = bufr_file
+        self._meta = meta
+        self._data = data
+        self._table = table
+        self._lines = table + meta['count'] * _RECORD_.size
+        self._headers = {}
+
+    def __repr__(self):
+        s = 'MessageIndex {{file: {} messages: {}}}'
+        return(s.format(self._bufr_file, len(self)))
+
+    def __len__(self):
+        return(self._meta['count'])
+
+    def __iter__(self):
+        """Iterate over (id, offset, length) of messages"""
+        for i in range(1, len(self) + 1):
+            offset, length = self.frame(i)
+            yield((i, offset, length))
+
+    def _record_(self, i):
+        if i < 1 or i > len(self):
+            raise IndexError('Message #{} is not in index'.format(i))
+        return(_RECORD_.unpack_from(self._data,
+                                    self._table + (i - 1) * _RECORD_.size))
+
+    def _line_(self, i):
+        """Raw header line of message i"""
+        start = self._lines + self._record_(i)[2]
+        end = (self._lines + self._record_(i + 1)[2] if i < len(self)
+               else len(self._data))
+        return(self._data[start:end])
+
+    @property
+    def bufr_file(self):
+        return(self._bufr_file)
+
+    @property
+    def size(self):
+        return(self._meta['size'])
+
+    @property
+    def mtime(self):
+        return(self._meta['mtime'])
+
+    @property
+    def scanned(self):
+        """Offset where scanning stopped (end of last message)"""
+        return(self._meta['scanned'])
+
+    def frame(self, i):
+        """Offset and length of message i"""
+        return(self._record_(i)[0:2])
+
+    def header(self, i):
+        """Header keys and values of message i
+
+        :returns: (OrderedDict) Header keys and values or None if edition
+                  of message is not supported by the scanner.
+        """
+        if i not in self._headers:
+            v = _json.loads(self._line_(i).decode('utf-8'))
+            if v is not None:
+                v = _add_derived_(_od(zip(_header_keys_, v)))
+            self._headers[i] = v
+        return(self._headers[i])
+
+    def is_fresh(self, st=None):
+        """Check index is up to date with BUFR file"""
+        if st is None:
+            st = _os.stat(self._bufr_file)
+        return(st.st_size == self.size and st.st_mtime == self.mtime)
+
+
+def _write_(bufr_file, st, scanned, frames, lines):
+    meta = _json.dumps({'size': st.st_size, 'mtime': st.st_mtime,
+                        'scanned': scanned, 'count': len(frames)})
+    meta = meta.encode('utf-8')
+    table = []
+    pos = 0
+    for (offset, length), line in zip(frames, lines):
+        table.append(_RECORD_.pack(offset, length, pos))
+        pos += len(line)
+    path = index_path(bufr_file)
+    tmp = '{}.{}.tmp'.format(path, _os.getpid())
+    with open(tmp, 'wb') as f:
+        f.write(_MAGIC_)
+        f.write(_LEN_.pack(len(meta)))
+        f.write(meta)
+        f.write(b''.join(table))
+        f.write(b''.join(lines))
+    _os.rename(tmp, path)
+
+
+def load_index(bufr_file, check=True):
+    """Load index of a BUFR file
+
+    :param bufr_file: Path to BUFR file
+    :param check: If True, None is returned for an out of date index
+    :returns: MessageIndex object or None if there is no (valid) index
+    """
+    try:
+        with open(index_path(bufr_file), 'rb') as f:
+            data = f.read()
+    except (IOError, OSError):
+        return(None)
+    if data[0:4] != _MAGIC_:
+        return(None)
+    n = _LEN_.unpack_from(data, 4)[0]
+    meta = _json.loads(data[8:8 + n].decode('utf-8'))
+    idx = MessageIndex(bufr_file, meta, data, 8 + n)
+    if check and not idx.is_fresh():
+        return(None)
+    return(idx)
+
+
+def update_index(bufr_file, rebuild=False):
+    """Create or bring up to date index of a BUFR file
+
+    BUFR files are expected to grow by appending messages. If the file
+    only grew, just the appended part is scanned. Otherwise, the index
+    is built from scratch.
+
+    :param bufr_file: Path to BUFR file
+    :param rebuild: If True, index is built from scratch
+    :returns: MessageIndex object
+    """
+    idx = None if rebuild else load_index(bufr_file, check=False)
+    st = _os.stat(bufr_file)
+    if idx is not None and idx.is_fresh(st):
+        return(idx)
+    with _open_buffer_(bufr_file) as buf:
+        frames, lines, scanned = [], [], 0
+        if idx is not None and st.st_size >= idx.scanned:
+            # appended? last indexed message must be still in place
+            if len(idx) > 0:
+                offset, length = idx.frame(len(idx))
+                end = offset + length
+                if (buf[offset:offset + 4] == b'BUFR' and
+                        buf[end - 4:end] == b'7777'):
+                    frames = [f[1:] for f in idx]
+                    lines = [idx._line_(i) for i in range(1, len(idx) + 1)]
+                    scanned = idx.scanned
+            else:
+                scanned = idx.scanned
+        for offset, length in _iter_frames_(buf, scanned):
+            h = _decode_header_(buf, offset)
+            if h is not None:
+                h = [h[k] for k in _header_keys_]
+            frames.append((offset, length))
+            lines.append((_json.dumps(h) + '\n').encode('utf-8'))
+            scanned = offset + length
+    _write_(bufr_file, st, scanned, frames, lines)
+    return(load_index(bufr_file, check=False))
+
+
+def build_index(bufr_file):
+    """Build index of a BUFR file from scratch
+
+    :param bufr_file: Path to BUFR file
+    :returns: MessageIndex object
+    """
+    return(update_index(bufr_file, rebuild=True))
@@ -0,0 +1,493 @@
+"""
+xtrabufr._router_
+~~~~~~~~~~~~~~~~~~
+Route BUFR messages into files by header patterns
+
+A pattern is a path contains keys in square brackets as in bufr_copy
+(i.e. 'out_[dataCategory]_[typicalDate].bufr'). A format spec can be
+added to a key (i.e. '[typicalMonth:02d]'). Output files are kept open
+in a pool of append handles, so routing many messages into many files
+costs neither a process nor an open() per message.
+"""
+
+from __future__ import print_function
+import os as _os
+import re as _re
+import sys as _sys
+import time as _time
+import eccodes as _ec
+from collections import OrderedDict as _od
+from ._helper_ import LRUCache as _LRUCache_
+from ._scanner_ import _header_keys_
+from ._scanner_ import _derived_keys_
+from ._scanner_ import open_buffer as _open_buffer_
+from ._scanner_ import iter_frames as _iter_frames_
+from ._scanner_ import decode_header as _decode_header_
+from ._extra_ import BufrHandle as _BufrHandle_
+from ._extra_ import BufrSubset as _BufrSubset_
+from ._extra_ import _new_handle_
+from ._extra_ import get_val as _get_val_
+from ._extra_ import unpack as _unpack_
+from ._extra_ import dump as _dump_
+from ._extra_ import _eprint_
+from ._dedup_ import DedupIndex as _DedupIndex_
+from ._dedup_ import digest as _digest_
+
+__all__ = ['Pattern', 'FilePool', 'Router', 'ingest', 'split']
+
+_KEY_ = _re.compile(r'\[(\w+)(?::([^\]]+))?\]')
+
+# ecCodes aliases of header keys used in patterns
+_aliases_ = {'editionNumber': 'edition'}
+
+# ecCodes type specs (i.e. [blockNumber:i]) are not format specs
+_types_ = ('i', 'l', 'd', 's')
+
+# short names of keys used by xbsplit
+_split_keys_ = _od([('bn', 'blockNumber'), ('hc', 'bufrHeaderCentre'),
+                    ('sn', 'stationNumber'), ('tt', 'typicalTime'),
+                    ('th', 'typicalHour'), ('tm', 'typicalMinute'),
+                    ('dc', 'dataCategory'), ('ds', 'dataSubCategory')])
+
+_mesbank_pattern_ = _os.path.join(
+    '[typicalYear]', '[typicalMonth:02d]', '[typicalDay:02d]',
+    'mss_[dataCategory]_[internationalDataSubCategory]_[typicalDate]_' +
+    '[typicalHour].bufr4')
+
+
+class Pattern(object):
+    """Output file name pattern
+
+    :param pattern: Path with [key] or [key:format_spec] parts
+    """
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.keys = []
+        self._specs = []
+        self._parts = []
+        pos = 0
+        for m in _KEY_.finditer(pattern):
+            self._parts.append(pattern[pos:m.start()])
+            self.keys.append(m.group(1))
+            spec = m.group(2) or ''
+            self._specs.append('' if spec in _types_ else spec)
+            pos = m.end()
+        self._parts.append(pattern[pos:])
+
+    def __repr__(self):
+        return('Pattern {}'.format(self.pattern))
+
+    @classmethod
+    def from_keys(cls, keys, prefix='mss_', suffix='.bufr[editionNumber]'):
+        """Create a pattern from short names of keys (see _split_keys_)
+
+        :param keys: List of short names (i.e. ['dc', 'ds'])
+        :returns: Pattern object (i.e. 'mss_dc[dataCategory]_ds[...]')
+        """
+        parts = ['{}[{}]'.format(k, _split_keys_[k]) for k in keys]
+        return(cls(prefix + '_'.join(parts) + suffix))
+
+    @property
+    def header_only(self):
+        """True if all keys can be decoded from the header"""
+        return(all(_aliases_.get(k, k) in _header_keys_ + _derived_keys_
+                   for k in self.keys))
+
+    def format(self, values):
+        """Create file name from values of keys
+
+        Missing keys are written as 'not_found' as ecCodes tools do.
+
+        :param values: dict of key: value
+        :returns: File name
+        """
+        s = [self._parts[0]]
+        for k, spec, part in zip(self.keys, self._specs, self._parts[1:]):
+            x = values.get(_aliases_.get(k, k))
+            if x is None or x == 'KeyNotFound':
+                x = 'not_found'
+            elif isinstance(x, list):
+                x = '_'.join(str(i) for i in x)
+            try:
+                s.append(format(x, spec))
+            except ValueError:
+                s.append(str(x))  # i.e. not_found for a numeric spec
+            s.append(part)
+        return(''.join(s))
+
+
+class FilePool(object):
+    """A pool of files opened for appending
+
+    Least recently used files are closed when the pool is full. Number of
+    messages and bytes written to each file are counted, so nothing has
+    to be read back to know what was appended.
+
+    Writes between begin() and commit() can be rolled back, so files are
+    truncated to their sizes at begin() if a write or sync fails.
+
+    :param maxsize: Maximum number of open files
+    """
+
+    def __init__(self, maxsize=64):
+        self._files = _LRUCache_(maxsize, on_discard=self._close_file)
+        self._marks = None
+        self.counts = {}
+        self.bytes = {}
+        self.sizes = {}
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return(len(self._files))
+
+    @staticmethod
+    def _close_file(path, f):
+        try:
+            f.flush()
+            _os.fsync(f.fileno())
+        finally:
+            f.close()
+
+    def _open(self, path):
+        f = self._files.get(path)
+        if f is None:
+            d = _os.path.dirname(path)
+            if d != '' and not _os.path.isdir(d):
+                _os.makedirs(d)
+            f = open(path, 'ab')
+            if path not in self.sizes:
+                self.sizes[path] = _os.fstat(f.fileno()).st_size
+            self._files[path] = f
+        return(f)
+
+    def write(self, path, message):
+        """Append a message to a file
+
+        :param path: Path to file
+        :param message: Binary content of the message
+        """
+        if self._marks is not None and path not in self._marks:
+            self._marks[path] = (self.counts.get(path, 0),
+                                 self.bytes.get(path, 0))
+        self._open(path).write(message)
+        self.counts[path] = self.counts.get(path, 0) + 1
+        self.bytes[path] = self.bytes.get(path, 0) + len(message)
+
+    def begin(self):
+        """Start recording files written to be committed or rolled back"""
+        self._marks = {}
+
+    def commit(self):
+        """Flush and sync files written since begin()"""
+        for path in self._marks or {}:
+            f = self._files.get(path)
+            if f is not None:  # closed files were synced by _close_file
+                f.flush()
+                _os.fsync(f.fileno())
+
+    def rollback(self):
+        """Truncate files written since begin() to their sizes at begin()"""
+        for path, (n, nbytes) in (self._marks or {}).items():
+            if path in self._files:
+                try:
+                    self._files.discard(path)
+                except (IOError, OSError):
+                    pass  # buffered part is dropped by truncate
+            if path in self.sizes:  # i.e. not if it could not be opened
+                with open(path, 'r+b') as f:
+                    f.truncate(self.sizes[path] + nbytes)
+            if n == 0:
+                self.counts.pop(path, None)
+                self.bytes.pop(path, None)
+            else:
+                self.counts[path], self.bytes[path] = n, nbytes
+        self._marks = None
+
+    def close(self):
+        """Close all files"""
+        self._files.clear()
+
+    def check(self):
+        """Check sizes of written files
+
+        :returns: List of (path, expected size, size) of files whose size
+                  is not the size before appending plus written bytes.
+        """
+        ret = []
+        for path, n in self.bytes.items():
+            expected = self.sizes[path] + n
+            size = _os.path.getsize(path)
+            if size != expected:
+                ret.append((path, expected, size))
+        return(ret)
+
+
+class Router(object):
+    """Route messages into files by a pattern
+
+    :param pattern: Output file name pattern (see Pattern)
+    :param edition: If defined, messages are converted to this edition
+                    (i.e. 4). Routing uses header of original message.
+    :param maxsize: Maximum number of open files
+    :param dedup: If 'message' or 'station', messages already in output
+                  files are skipped (see DedupIndex)
+    """
+
+    def __init__(self, pattern, edition=None, maxsize=64, dedup=None):
+        if not isinstance(pattern, Pattern):
+            pattern = Pattern(pattern)
+        self.pattern = pattern
+        self.edition = edition
+        self.pool = FilePool(maxsize)
+        self.dedup = dedup
+        self.duplicates = {}
+        self._digests = {}
+        self._marks = None
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def counts(self):
+        """Number of messages written to each file"""
+        return(self.pool.counts)
+
+    def close(self):
+        self.pool.close()
+        for idx in self._digests.values():
+            idx.save()
+        self._digests = {}
+
+    def begin(self):
+        """Start routing messages which can be rolled back (see FilePool)"""
+        self.pool.begin()
+        self._marks = (dict(self.duplicates),
+                       dict((path, idx.mark())
+                            for path, idx in self._digests.items()))
+
+    def commit(self):
+        """Flush and sync files written since begin()"""
+        self.pool.commit()
+
+    def rollback(self):
+        """Remove messages routed since begin() from files and digests"""
+        self.pool.rollback()
+        if self._marks is None:
+            return
+        self.duplicates, marks = self._marks
+        for path, idx in list(self._digests.items()):
+            if path in marks:
+                idx.rollback(marks[path])
+            else:
+                del self._digests[path]  # loaded again if it is needed
+        self._marks = None
+
+    def _is_new(self, path, message, bufr_handle=None):
+        """Check message is not in output file and add its digest"""
+        if self.dedup is None:
+            return(True)
+        idx = self._digests.get(path)
+        if idx is None:
+            idx = self._digests[path] = _DedupIndex_(path, self.dedup)
+        if self.dedup == 'station' and bufr_handle is not None:
+            d = _digest_(bufr_handle, self.dedup)
+        else:
+            try:
+                d = _digest_(message, self.dedup)
+            except _ec.CodesInternalError:
+                d = _digest_(message)
+        if d in idx:
+            self.duplicates[path] = self.duplicates.get(path, 0) + 1
+            return(False)
+        idx.add(d, len(message))
+        return(True)
+
+    def _write(self, path, message, bufr_handle=None):
+        """Write message to file unless it is a duplicate"""
+        if not self._is_new(path, message, bufr_handle):
+            return(None)
+        self.pool.write(path, message)
+        return(path)
+
+    def _values(self, bufr_handle, h=None):
+        """Values of pattern keys"""
+        values = {} if h is None else h
+        keys = [_aliases_.get(k, k) for k in self.pattern.keys]
+        keys = [k for k in keys if k not in values]
+        if len(keys) > 0:
+            if any(k not in _header_keys_ + _derived_keys_ for k in keys):
+                _unpack_(bufr_handle)  # data keys are needed
+            values = dict(values)
+            for k in keys:
+                values[k] = _get_val_(bufr_handle, k)
+        return(values)
+
+    def _convert(self, bufr_handle):
+        """Convert message to edition"""
+        try:
+            _ec.codes_set(bufr_handle.handle, 'edition', self.edition)
+            bufr_handle._invalidate()
+        except _ec.CodesInternalError as e:
+            _eprint_('FILE: {} - MSG #{} - Edition {} "{}"'.format(
+                bufr_handle.file_name, bufr_handle.id, self.edition, e))
+            return(None)
+        return(_dump_(bufr_handle))
+
+    def write(self, bufr_handle, h=None):
+        """Route a message
+
+        :param bufr_handle: BufrHandle object
+        :param h: Header of message if it is already decoded
+        :returns: Path to file which message was written or None
+        """
+        if isinstance(bufr_handle, _BufrSubset_):
+            bufr_handle = bufr_handle.extract()
+        path = self.pattern.format(self._values(bufr_handle, h))
+        if self.edition is not None and \
+                _get_val_(bufr_handle, 'edition') != self.edition:
+            message = self._convert(bufr_handle)
+            if message is None:
+                return(None)
+        else:
+            message = _dump_(bufr_handle)
+        return(self._write(path, message, bufr_handle))
+
+    def route(self, x):
+        """Route BufrHandle object(s)
+
+        :param x: BufrHandle/list of BufrHandles/Generator Function
+        :returns: Number of routed messages
+        """
+        if isinstance(x, (_BufrHandle_, _BufrSubset_)):
+            x = [x]
+        n = 0
+        for bh in x:
+            if self.write(bh) is not None:
+                n += 1
+        return(n)
+
+    def route_file(self, bufr_file):
+        """Route messages in a BUFR file
+
+        Header keys are decoded from the bytes. If the pattern needs only
+        header keys and no conversion is needed, messages are copied as
+        they are without creating a handle.
+
+        :param bufr_file: Path to BUFR file
+        :returns: Number of routed messages
+        """
+        n = 0
+        with _open_buffer_(bufr_file) as buf:
+            i = 0
+            for offset, length in _iter_frames_(buf):
+                i += 1
+                h = _decode_header_(buf, offset)
+                message = buf[offset:offset + length]
+                if h is not None and self.pattern.header_only and \
+                        (self.edition is None or
+                         h['edition'] == self.edition):
+                    if self._write(self.pattern.format(h),
+                                   message) is not None:
+                        n += 1
+                    continue
+                try:
+                    bh = _new_handle_(message, i, bufr_file)
+                except _ec.CodesInternalError as e:
+                    _eprint_('FILE: {} - MSG #{} - {}'.format(bufr_file,
+                                                              i, e))
+                    continue
+                if self.write(bh, h) is not None:
+                    n += 1
+        return(n)
+
+
+def _log_(log, msg):
+    """Write a line to log file (or stderr if log is None)"""
+    line = '[{}] [xbsort] ({}): {}\n'.format(
+        _time.strftime('%y-%m-%d %H:%M:%S'), _os.getpid(), msg)
+    if log is None:
+        _sys.stderr.write(line)
+    else:
+        with open(log, 'a') as f:
+            f.write(line)
+
+
+def ingest(bufr_files, mesbank, pattern=_mesbank_pattern_, edition=4,
+           remove=False, log=None, maxsize=64, dedup=None, failed=None):
+    """Sort messages in BUFR files into mesbank
+
+    Messages are routed into mesbank/YYYY/MM/DD/ by default and converted
+    to BUFR edition 4. Number of messages appended to each file is logged.
+    Files written for an input file are synced before it is removed, and
+    truncated back if it cannot be routed or removed.
+
+    :param bufr_files: Path to BUFR file(s)
+    :param mesbank: Root directory of mesbank
+    :param pattern: Output file name pattern relative to mesbank
+    :param edition: Convert messages to edition (None to keep as is)
+    :param remove: If True, input files are removed after routing
+    :param log: Path to log file (default is stderr)
+    :param maxsize: Maximum number of open files
+    :param dedup: If 'message' or 'station', messages already in mesbank
+                  are skipped and number of them are logged
+    :param failed: A list, files which could not be routed or removed are
+                   appended (they are left in place and their messages
+                   are removed from mesbank)
+    :returns: dict of path: number of messages appended
+    """
+    if not isinstance(bufr_files, list):
+        bufr_files = [bufr_files]
+    with Router(_os.path.join(mesbank, pattern), edition, maxsize,
+                dedup) as r:
+        for f in bufr_files:
+            r.begin()
+            try:
+                r.route_file(f)
+                r.commit()
+                if remove:
+                    _os.remove(f)
+            except (IOError, OSError) as e:
+                r.rollback()
+                _log_(log, 'ERROR : {} {}'.format(f, e))
+                if failed is not None:
+                    failed.append(f)
+        r.close()
+        for path, expected, size in r.pool.check():
+            _log_(log, 'WARNING : {} size {} != {}'.format(path, size,
+                                                           expected))
+        for path in sorted(set(r.counts) | set(r.duplicates)):
+            s = '{} (+{} msg)'.format(path, r.counts.get(path, 0))
+            if path in r.duplicates:
+                s += ' ({} duplicates)'.format(r.duplicates[path])
+            _log_(log, s)
+    return(r.counts)
+
+
+def split(bufr_files, pattern, edition=None, maxsize=64, dedup=None):
+    """Split messages in BUFR files into files by a pattern
+
+    Header keys are decoded from bytes. Messages are unpacked only if the
+    pattern contains data keys (i.e. blockNumber, stationNumber).
+
+    :param bufr_files: Path to BUFR file(s)
+    :param pattern: Output file name pattern (i.e. 'out_[dataCategory].bufr')
+    :param edition: Convert messages to edition (None to keep as is)
+    :param maxsize: Maximum number of open files
+    :param dedup: If 'message' or 'station', duplicate messages are skipped
+    :returns: dict of path: number of messages written
+    """
+    if not isinstance(bufr_files, list):
+        bufr_files = [bufr_files]
+    with Router(pattern, edition, maxsize, dedup) as r:
+        for f in bufr_files:
+            r.route_file(f)
+    return(r.counts)
@@ -0,0 +1,209 @@
+"""
+xtrabufr._scanner_
+~~~~~~~~~~~~~~~~~~
+Pure-Python scanner for BUFR messages
+
+Finds BUFR...7777 frames in a buffer and decodes the header keys
+(sections 0, 1 and 3) of edition 3 and 4 messages straight from the
+bytes, so no ecCodes handle is needed to inspect a message.
+"""
+
+import os as _os
+import re as _re
+import sys as _sys
+import mmap as _mmap
+from collections import OrderedDict as _od
+from contextlib import contextmanager as _contextmanager
+
+__all__ = ['open_buffer', 'iter_frames', 'count_frames', 'decode_header',
+           'add_derived']
+
+_header_keys_ = [
+    'edition', 'masterTableNumber', 'bufrHeaderCentre', 'bufrHeaderSubCentre',
+    'updateSequenceNumber', 'dataCategory', 'internationalDataSubCategory',
+    'dataSubCategory', 'masterTablesVersionNumber', 'localTablesVersionNumber',
+    'typicalYear', 'typicalMonth', 'typicalDay', 'typicalHour',
+    'typicalMinute', 'typicalSecond', 'numberOfSubsets', 'observedData',
+    'compressedData', 'unexpandedDescriptors']
+
+# keys derived from header keys (see decode_header)
+_derived_keys_ = ['typicalDate', 'typicalTime']
+
+_START_ = b'BUFR'
+_END_ = b'7777'
+_START_RE_ = _re.compile(_START_)
+
+
+def _uint_(buf, offset, n):
+    """Read a big-endian unsigned integer of n octets"""
+    v = 0
+    for b in bytearray(buf[offset:offset + n]):
+        v = (v << 8) | b
+    return(v)
+
+
+def _find_(buf, start):
+    """Offset of next message start in buf or -1
+
+    Buffers without find (i.e. memoryview) are searched in place by re.
+    """
+    if hasattr(buf, 'find'):
+        return(buf.find(_START_, start))
+    m = _START_RE_.search(buf, start)
+    return(-1 if m is None else m.start())
+
+
+@_contextmanager
+def open_buffer(bufr_file):
+    """Map a BUFR file into memory
+
+    If bufr_file is '-', stdin is read into memory instead.
+    Empty files yield an empty buffer.
+
+    :param bufr_file: Path to BUFR file
+    :returns: mmap object or bytes
+    """
+    if bufr_file == '-':
+        yield(getattr(_sys.stdin, 'buffer', _sys.stdin).read())
+        return
+    with open(bufr_file, 'rb') as f:
+        if _os.fstat(f.fileno()).st_size == 0:
+            yield(b'')
+            return
+        buf = _mmap.mmap(f.fileno(), 0, access=_mmap.ACCESS_READ)
+        try:
+            yield(buf)
+        finally:
+            buf.close()
+
+
+def iter_frames(buf, start=0):
+    """Iterate over complete BUFR messages in a buffer
+
+    A frame is accepted if it starts with 'BUFR', the total length in
+    section 0 fits into the buffer and the frame ends with '7777'.
+    Anything else is skipped as garbage.
+
+    This is a generator function
+
+    :param buf: bytes, bytearray, mmap, memoryview of bytes or any
+                sliceable buffer
+    :param start: Offset to start scanning from
+    :returns: yields (offset, length) tuples
+    """
+    n = len(buf)
+    pos = _find_(buf, start)
+    while pos != -1:
+        if pos + 8 <= n:
+            length = _uint_(buf, pos + 4, 3)
+            end = pos + length
+            if length > 8 and end <= n and buf[end - 4:end] == _END_:
+                yield((pos, length))
+                pos = _find_(buf, end)
+                continue
+        pos = _find_(buf, pos + 1)
+
+
+def count_frames(buf):
+    """Count complete BUFR messages in a buffer
+
+    Messages are walked by total lengths in section 0, so nothing but
+    section 0 and the end section of each message is read.
+
+    :param buf: bytes, bytearray, mmap or any sliceable buffer
+    :returns: (number of messages, bytes outside of messages,
+               bytes after the last message) tuple. Trailing bytes are
+               usually a truncated message.
+    """
+    n = used = end = 0
+    for offset, length in iter_frames(buf):
+        n += 1
+        used += length
+        end = offset + length
+    return((n, len(buf) - used, len(buf) - end))
+
+
+def _descriptor_(d):
+    """Convert 16 bit descriptor to FXXYYY integer"""
+    return((d >> 14) * 100000 + ((d >> 8) & 0x3f) * 1000 + (d & 0xff))
+
+
+def decode_header(buf, offset=0):
+    """Decode header keys of a BUFR message from bytes
+
+    Header keys are the same keys and values as reading them from an
+    ecCodes handle. typicalDate and typicalTime are also decoded.
+    Only edition 3 and 4 messages are supported.
+
+    :param buf: Buffer contains message
+    :param offset: Offset of message in the buffer
+    :returns: (OrderedDict) Header keys and values or None if edition
+              is not supported.
+    """
+    edition = _uint_(buf, offset + 7, 1)
+    s1 = offset + 8
+    h = _od.fromkeys(_header_keys_)
+    h['edition'] = edition
+    h['masterTableNumber'] = _uint_(buf, s1 + 3, 1)
+    if edition == 4:
+        h['bufrHeaderCentre'] = _uint_(buf, s1 + 4, 2)
+        h['bufrHeaderSubCentre'] = _uint_(buf, s1 + 6, 2)
+        h['updateSequenceNumber'] = _uint_(buf, s1 + 8, 1)
+        has_section2 = _uint_(buf, s1 + 9, 1) & 0x80
+        h['dataCategory'] = _uint_(buf, s1 + 10, 1)
+        h['internationalDataSubCategory'] = _uint_(buf, s1 + 11, 1)
+        h['dataSubCategory'] = _uint_(buf, s1 + 12, 1)
+        h['masterTablesVersionNumber'] = _uint_(buf, s1 + 13, 1)
+        h['localTablesVersionNumber'] = _uint_(buf, s1 + 14, 1)
+        h['typicalYear'] = _uint_(buf, s1 + 15, 2)
+        h['typicalMonth'] = _uint_(buf, s1 + 17, 1)
+        h['typicalDay'] = _uint_(buf, s1 + 18, 1)
+        h['typicalHour'] = _uint_(buf, s1 + 19, 1)
+        h['typicalMinute'] = _uint_(buf, s1 + 20, 1)
+        h['typicalSecond'] = _uint_(buf, s1 + 21, 1)
+    elif edition == 3:
+        h['bufrHeaderSubCentre'] = _uint_(buf, s1 + 4, 1)
+        h['bufrHeaderCentre'] = _uint_(buf, s1 + 5, 1)
+        h['updateSequenceNumber'] = _uint_(buf, s1 + 6, 1)
+        has_section2 = _uint_(buf, s1 + 7, 1) & 0x80
+        h['dataCategory'] = _uint_(buf, s1 + 8, 1)
+        # not defined in edition 3 (same as ecCodes)
+        h['internationalDataSubCategory'] = 'KeyNotFound'
+        h['dataSubCategory'] = _uint_(buf, s1 + 9, 1)
+        h['masterTablesVersionNumber'] = _uint_(buf, s1 + 10, 1)
+        h['localTablesVersionNumber'] = _uint_(buf, s1 + 11, 1)
+        # ecCodes assumes 21st century for edition 3
+        h['typicalYear'] = 2000 + _uint_(buf, s1 + 12, 1)
+        h['typicalMonth'] = _uint_(buf, s1 + 13, 1)
+        h['typicalDay'] = _uint_(buf, s1 + 14, 1)
+        h['typicalHour'] = _uint_(buf, s1 + 15, 1)
+        h['typicalMinute'] = _uint_(buf, s1 + 16, 1)
+        h['typicalSecond'] = 0
+    else:
+        return(None)
+
+    s3 = s1 + _uint_(buf, s1, 3)
+    if has_section2:
+        s3 += _uint_(buf, s3, 3)
+    len3 = _uint_(buf, s3, 3)
+    h['numberOfSubsets'] = _uint_(buf, s3 + 4, 2)
+    flags = _uint_(buf, s3 + 6, 1)
+    h['observedData'] = (flags >> 7) & 1
+    h['compressedData'] = (flags >> 6) & 1
+    desc = [_descriptor_(_uint_(buf, i, 2))
+            for i in range(s3 + 7, s3 + len3 - 1, 2)]
+    h['unexpandedDescriptors'] = desc[0] if len(desc) == 1 else desc
+    return(add_derived(h))
+
+
+def add_derived(h):
+    """Add derived keys (typicalDate and typicalTime) to header
+
+    :param h: (OrderedDict) Header keys and values
+    :returns: h
+    """
+    h['typicalDate'] = '{:04d}{:02d}{:02d}'.format(
+        h['typicalYear'], h['typicalMonth'], h['typicalDay'])
+    h['typicalTime'] = '{:02d}{:02d}{:02d}'.format(
+        h['typicalHour'], h['typicalMinute'], h['typicalSecond'])
+    return(h)
@@ -22,8 +22,16 @@ from ._extra_ import synop_to
 from ._extra_ import synop_to_csv
 from ._extra_ import synop_to_json
 from ._extra_ import json
+from ._extra_ import ndjson
 from ._extra_ import dump
 from ._extra_ import decode
+from ._index_ import update_index
+from ._router_ import ingest
+from ._router_ import split
+from ._router_ import Pattern
+from ._router_ import _split_keys_
+from ._router_ import _log_
+from ._dedup_ import dedup_file
 from ._helper_ import print_msg
 
 # See: https://stackoverflow.com/questions/20165843/argparse-how-to-handle-variable-number-of-arguments-nargs?utm_medium=organic&utm_source=google_rich_qa&utm_campaign=google_rich_qa
@@ -50,32 +58,49 @@ def _xbsynop_():
                   'Optional arguments can be used to filter output.\n\n' + \
                   ' N       : An integer Numeric value\n' + \
                   ' YYYMMDD : Year, Month and day (adjacent)\n' + \
-                  ' HHMMSS  : Hour, minute and second (adjacent)'
+                  ' HHMMSS  : Hour, minute and second (adjacent)\n\n' + \
+                  'Values can also be given as\n' + \
+                  ' A..B    : A range (A or B can be omitted)\n' + \
+                  ' !V      : Negation of a value or range\n\n' + \
+                  'Stations (-b, -n and --bbox) are selected from\n' + \
+                  'subsets of each message before extraction.'
     epilog = 'Example of use:\n' + \
              ' %(prog)s out.bufr in.bufr\n' + \
              ' %(prog)s out.bufr in1.bufr in2.bufr in3.bufr\n' + \
              ' %(prog)s out.bufr *.bufr\n' + \
              ' %(prog)s out.bufr in.bufr -hc 91 -y 2018\n' + \
-             ' %(prog)s out.bufr in*.bufr -hc 91 -td 20180324\n'
+             ' %(prog)s out.bufr in*.bufr -hc 91 -td 20180324\n' + \
+             ' %(prog)s out.bufr in.bufr -b 17 -n 0..400\n' + \
+             ' %(prog)s out.csv in.bufr -o csv --bbox 35 43 25 45\n'
     p = _create_argparser_(description, epilog)
-    p.add_argument('-o', action='store', choices=['bufr', 'csv', 'json'],
-                   default='bufr', help='Output type (default is bufr)')
+    p.add_argument('-o', action='store',
+                   choices=['bufr', 'csv', 'json', 'ndjson'],
+                   default='bufr',
+                   help='Output type (default is bufr)\n' +
+                        'ndjson streams a JSON object per line')
     p.add_argument('-c', '--code_table', help="Decode Code Table",
                    action="store_true")
-    for a in [['-id', '--internationalDataSubCategory', int, 'N',
+    p.add_argument('-j', '--jobs', type=int, default=None, metavar='N',
+                   help='Number of processes to decode messages')
+    for a in [['-id', '--internationalDataSubCategory', str, 'N',
                'International Data Sub-Category'],
-              ['-ds', '--dataSubCategory', int, 'N', 'Data Sub-Category'],
-              ['-hc', '--bufrHeaderCentre', int, 'N', 'Header Centre'],
+              ['-ds', '--dataSubCategory', str, 'N', 'Data Sub-Category'],
+              ['-hc', '--bufrHeaderCentre', str, 'N', 'Header Centre'],
               ['-td', '--typicalDate', str, 'YYYYMMDD', 'Typical Date'],
-              ['-y', '--typicalYear', int, 'N', 'Typical Year'],
-              ['-m', '--typicalMonth', int, 'N', 'Typical Month'],
-              ['-d', '--typicalDay', int, 'N', 'Typical Day'],
+              ['-y', '--typicalYear', str, 'N', 'Typical Year'],
+              ['-m', '--typicalMonth', str, 'N', 'Typical Month'],
+              ['-d', '--typicalDay', str, 'N', 'Typical Day'],
               ['-tt', '--typicalTime', str, 'HHMMSS', 'Typical Time'],
-              ['-th', '--typicalHour', int, 'N', 'Typical Hour'],
-              ['-tm', '--typicalMinute', int, 'N', 'Typical Minute'],
-              ['-ts', '--typicalSecond', int, 'N', 'Typical Second']]:
+              ['-th', '--typicalHour', str, 'N', 'Typical Hour'],
+              ['-tm', '--typicalMinute', str, 'N', 'Typical Minute'],
+              ['-ts', '--typicalSecond', str, 'N', 'Typical Second'],
+              ['-b', '--blockNumber', str, 'N', 'WMO Block Number'],
+              ['-n', '--stationNumber', str, 'N', 'WMO Station Number']]:
         p.add_argument(a[0], a[1], type=a[2], nargs='+', metavar=a[3],
                        default=None, help=a[4])
+    p.add_argument('--bbox', type=float, nargs=4, default=None,
+                   metavar=('S', 'N', 'W', 'E'),
+                   help='Bounding box of stations (latitude/longitude)')
     p.add_argument('bufr_out', type=str, nargs='?',
                    help='Output BUFR file\n' +
                         'Save messages to the file')
@@ -87,7 +112,8 @@ def _xbsynop_():
     bufr_out = args.bufr_out
     out = args.o
     decode_code_table = args.code_table
-    del args.bufr_files, args.bufr_out, args.o, args.code_table
+    jobs = args.jobs
+    del args.bufr_files, args.bufr_out, args.o, args.code_table, args.jobs
     try:
         # n = 0
         # if out == 'bufr':
@@ -99,7 +125,7 @@ def _xbsynop_():
         #     n = synop_to_json(bufr_files, bufr_out, decode_code_table,
         #                       **args.__dict__)
         n = synop_to(bufr_files, bufr_out, decode_code_table, out,
-                     **args.__dict__)
+                     workers=jobs, **args.__dict__)
         print(n, 'messages were filtered.')
         return(0)
     except KeyboardInterrupt:
@@ -115,35 +141,47 @@ def _xbfilter_():
                   'Optional arguments can be used to filter output.\n\n' + \
                   ' N       : An integer Numeric value\n' + \
                   ' YYYMMDD : Year, Month and day (adjacent)\n' + \
-                  ' HHMMSS  : Hour, minute and second (adjacent)'
+                  ' HHMMSS  : Hour, minute and second (adjacent)\n\n' + \
+                  'Values (except subset id) can also be given as\n' + \
+                  ' A..B    : A range (A or B can be omitted)\n' + \
+                  ' !V      : Negation of a value or range'
     epilog = 'Example of use:\n' + \
              ' %(prog)s out.bufr in.bufr\n' + \
              ' %(prog)s out.bufr in1.bufr in2.bufr in3.bufr\n' + \
              ' %(prog)s out.bufr *.bufr\n' + \
              ' %(prog)s out.bufr in.bufr -hc 91 -dc 0 -y 2018\n' + \
-             ' %(prog)s out.bufr in*.bufr -hc 91 -dc 0 -td 20180324\n'
+             ' %(prog)s out.bufr in*.bufr -hc 91 -dc 0 -td 20180324\n' + \
+             ' %(prog)s out.bufr in.bufr -tp synop\n' + \
+             ' %(prog)s out.bufr in.bufr -m 100..200 -th 0..6 -hc !91\n'
     p = _create_argparser_(description, epilog)
-    p.add_argument('-o', action='store', choices=['bufr', 'csv', 'json'],
-                   default='bufr', help='Output type (default is bufr)')
-    for a in [['-m', '--msg', int, 'N', 'Message Id(s)'],
+    p.add_argument('-o', action='store',
+                   choices=['bufr', 'csv', 'json', 'ndjson'],
+                   default='bufr',
+                   help='Output type (default is bufr)\n' +
+                        'ndjson streams a JSON object per line')
+    p.add_argument('-j', '--jobs', type=int, default=None, metavar='N',
+                   help='Number of processes to decode messages')
+    for a in [['-m', '--msg', str, 'N', 'Message Id(s)'],
               ['-s', '--subset', int, 'N', 'Subset Id(s)'],
-              ['-ed', '--edition', int, 'N', 'Edition'],
-              ['-dc', '--dataCategory', int, 'N', 'Data Category'],
-              ['-id', '--internationalDataSubCategory', int, 'N',
+              ['-ed', '--edition', str, 'N', 'Edition'],
+              ['-dc', '--dataCategory', str, 'N', 'Data Category'],
+              ['-id', '--internationalDataSubCategory', str, 'N',
                'International Data Sub-Category'],
-              ['-ds', '--dataSubCategory', int, 'N', 'Data Sub-Category'],
-              ['-cd', '--compressedData', int, 'N', 'Compressed Data'],
-              ['-hc', '--bufrHeaderCentre', int, 'N', 'Header Centre'],
+              ['-ds', '--dataSubCategory', str, 'N', 'Data Sub-Category'],
+              ['-cd', '--compressedData', str, 'N', 'Compressed Data'],
+              ['-hc', '--bufrHeaderCentre', str, 'N', 'Header Centre'],
               ['-td', '--typicalDate', str, 'YYYYMMDD', 'Typical Date'],
-              ['-yr', '--typicalYear', int, 'N', 'Typical Year'],
-              ['-mo', '--typicalMonth', int, 'N', 'Typical Month'],
-              ['-da', '--typicalDay', int, 'N', 'Typical Day'],
+              ['-yr', '--typicalYear', str, 'N', 'Typical Year'],
+              ['-mo', '--typicalMonth', str, 'N', 'Typical Month'],
+              ['-da', '--typicalDay', str, 'N', 'Typical Day'],
               ['-tt', '--typicalTime', str, 'HHMMSS', 'Typical Time'],
-              ['-th', '--typicalHour', int, 'N', 'Typical Hour'],
-              ['-tm', '--typicalMinute', int, 'N', 'Typical Minute'],
-              ['-ts', '--typicalSecond', int, 'N', 'Typical Second'],
-              ['-ud', '--unexpandedDescriptors', int, 'N',
-               'Unexpanded Descriptors']]:
+              ['-th', '--typicalHour', str, 'N', 'Typical Hour'],
+              ['-tm', '--typicalMinute', str, 'N', 'Typical Minute'],
+              ['-ts', '--typicalSecond', str, 'N', 'Typical Second'],
+              ['-ud', '--unexpandedDescriptors', str, 'N',
+               'Unexpanded Descriptors'],
+              ['-tp', '--template', str, 'NAME',
+               'Registered template name(s) (i.e. synop)']]:
         p.add_argument(a[0], a[1], type=a[2], nargs='+', metavar=a[3],
                        default=None, help=a[4])
     # p.add_argument('-p', '--plain', help="Plain dump",
@@ -158,14 +196,19 @@ def _xbfilter_():
     bufr_files = args.bufr_files
     bufr_out = args.bufr_out
     fmt = args.o
-    del args.bufr_files, args.bufr_out, args.o
+    jobs = args.jobs
+    del args.bufr_files, args.bufr_out, args.o, args.jobs
     try:
         # n = dump(iter_messages(bufr_files, **args.__dict__), bufr_out)
         n = 0
         if fmt == 'bufr':
             n = dump(iter_messages(bufr_files, **args.__dict__), bufr_out)
         elif fmt == 'json':
-            n = json(iter_messages(bufr_files, **args.__dict__), bufr_out)
+            n = json(iter_messages(bufr_files, **args.__dict__), bufr_out,
+                     workers=jobs)
+        elif fmt == 'ndjson':
+            n = ndjson(iter_messages(bufr_files, **args.__dict__), bufr_out,
+                       workers=jobs)
         return(n)
         print(n, 'messages were filtered.')
         return(0)
@@ -198,7 +241,9 @@ def _xbprint_():
     try:
         for bh in iter_messages(args.bufr_file, msg=args.msg,
                                 subset=args.subset):
-            print_msg({bh.id: decode(bh)}, args.bufr_file, args.ignore)
+            # values are read as they are printed
+            print_msg({bh.id: decode(bh, lazy=True)}, args.bufr_file,
+                      args.ignore)
         return(0)
     except KeyboardInterrupt:
         print("Process stopped")
@@ -224,6 +269,10 @@ def _xbcopy_():
               ['-s', '--subset', int, 'N', 'Subset Id']]:
         p.add_argument(a[0], a[1], type=a[2], nargs='+', metavar=a[3],
                        default=None, help=a[4])
+    p.add_argument('-d', '--dedup', type=str, default=None,
+                   choices=['message', 'station'],
+                   help='Skip duplicate messages by digest of message\n' +
+                        'or station/time keys')
     p.add_argument('bufr_in', type=str, help='BUFR file to process')
     p.add_argument('bufr_out', type=str, help='Output BUFR file')
     args = p.parse_args()
@@ -234,7 +283,7 @@ def _xbcopy_():
 
     try:
         copy_msg(args.bufr_in, args.bufr_out,
-                 args.msg, args.subset)
+                 args.msg, args.subset, args.dedup)
         return(0)
     except KeyboardInterrupt:
         print("Process stopped")
@@ -269,3 +318,205 @@ def _xbdef_():
     except Exception:
         _traceback.print_exc(file=_stderr)
     return(1)
+
+
+def _xbindex_():
+    description = 'Build or update message index of BUFR file(s)\n' + \
+                  'Index is saved next to the BUFR file (.xbi) and used\n' + \
+                  'to read messages without scanning the whole file.'
+    epilog = 'Example of use:\n' + \
+             ' %(prog)s in.bufr\n' + \
+             ' %(prog)s -r in1.bufr in2.bufr\n' + \
+             ' %(prog)s mesbank/2018/03/24/*.bufr4\n'
+
+    p = _create_argparser_(description, epilog)
+    p.add_argument('-r', '--rebuild', help="Rebuild index from scratch",
+                   action="store_true")
+    p.add_argument('bufr_files', type=str, nargs='+',
+                   help='BUFR files to index\n' +
+                        '(at least a single file required)')
+    args = p.parse_args()
+
+    try:
+        for f in args.bufr_files:
+            idx = update_index(f, args.rebuild)
+            print('{}: {} messages'.format(f, len(idx)))
+        return(0)
+    except KeyboardInterrupt:
+        print("Process stopped")
+    except Exception:
+        _traceback.print_exc(file=_stderr)
+    return(1)
+
+
+def _xbsplit_():
+    description = 'Split messages in BUFR file(s) into files by keys\n' + \
+                  'Output file names are created from a pattern of\n' + \
+                  'keys in square brackets as in bufr_copy. Messages\n' + \
+                  'are unpacked only if pattern contains data keys.\n' + \
+                  'Keys:\n' + \
+                  '\n'.join(' {} : {}'.format(k, v)
+                            for k, v in _split_keys_.items())
+    epilog = 'Example of use:\n' + \
+             ' %(prog)s -k dc,ds in.bufr\n' + \
+             ' %(prog)s -k bn,sn in1.bufr in2.bufr\n' + \
+             ' %(prog)s -p "out/[typicalDate]_[stationNumber].bufr" in.bufr\n'
+
+    p = _create_argparser_(description, epilog)
+    g = p.add_mutually_exclusive_group(required=True)
+    g.add_argument('-k', '--keys', type=str, metavar='KEY[,KEY]',
+                   help='Split by keys (mss_KEY[key]_....bufr[edition])')
+    g.add_argument('-p', '--pattern', type=str, default=None,
+                   help='Output file name pattern')
+    p.add_argument('-e', '--edition', type=int, default=None,
+                   help='Convert messages to BUFR edition')
+    p.add_argument('-m', '--maxfiles', type=int, default=64,
+                   help='Maximum number of open files ' +
+                        '(default is %(default)s)')
+    p.add_argument('-d', '--dedup', type=str, default=None,
+                   choices=['message', 'station'],
+                   help='Skip duplicate messages by digest of message\n' +
+                        'or station/time keys')
+    p.add_argument('bufr_files', type=str, nargs='+',
+                   help='BUFR files to split\n' +
+                        '(at least a single file required)')
+    args = p.parse_args()
+    if args.keys is not None:
+        args.keys = args.keys.split(',')
+        for k in args.keys:
+            if k not in _split_keys_:
+                p.error('unknown key {}'.format(k))
+
+    try:
+        pattern = Pattern(args.pattern) if args.keys is None else \
+            Pattern.from_keys(args.keys)
+        print('Split by : {}'.format(pattern.pattern))
+        split(args.bufr_files, pattern, args.edition, args.maxfiles,
+              args.dedup)
+        return(0)
+    except KeyboardInterrupt:
+        print("Process stopped")
+    except Exception:
+        _traceback.print_exc(file=_stderr)
+    return(1)
+
+
+def _xbsort_():
+    description = 'Sort BUFR files in a spool directory into mesbank.\n' + \
+                  'Messages are routed by their header into\n' + \
+                  ' MESBANK/YYYY/MM/DD/mss_[dataCategory]_\n' + \
+                  '   [internationalDataSubCategory]_[typicalDate]_\n' + \
+                  '   [typicalHour].bufr4\n' + \
+                  'BUFR edition 3 messages are converted to edition 4.\n' + \
+                  'Spool files are removed after they are sorted.'
+    epilog = 'Example of use:\n' + \
+             ' %(prog)s\n' + \
+             ' %(prog)s -s /data/spool -m /data/mesbank -n "*.bufr"\n'
+
+    p = _create_argparser_(description, epilog)
+    p.add_argument('-s', '--spool', type=str,
+                   default='/home/mss/ftp/files/bufr',
+                   help='Spool directory (default is %(default)s)')
+    p.add_argument('-m', '--mesbank', type=str,
+                   default=_os.path.join(_os.path.expanduser('~'),
+                                         'mesbank'),
+                   help='Mesbank directory (default is %(default)s)')
+    p.add_argument('-n', '--name', type=str, default='mw_mss*',
+                   help='Pattern of file names in spool ' +
+                        '(default is %(default)s)')
+    p.add_argument('-b', '--batch', type=int, default=30000,
+                   help='Number of files per batch (default is %(default)s)')
+    p.add_argument('-l', '--log', type=str,
+                   default=_os.path.join(_os.path.expanduser('~'),
+                                         '.metcap', 'log', 'bsort.log'),
+                   help='Log file (default is %(default)s)')
+    p.add_argument('-d', '--dedup', type=str, default=None,
+                   choices=['message', 'station'],
+                   help='Skip messages already in mesbank by digest of\n' +
+                        'message or station/time keys')
+    args = p.parse_args()
+
+    import fcntl
+    from time import time
+    from fnmatch import fnmatch
+
+    for d in [args.mesbank, _os.path.dirname(args.log)]:
+        if d != '' and not _os.path.isdir(d):
+            _os.makedirs(d)
+    # only a single process can sort into a mesbank
+    lock = open(_os.path.join(args.mesbank, '.xbsort.lock'), 'w')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except (IOError, OSError):
+        _log_(args.log, 'Process is already running')
+        return(1)
+
+    try:
+        t = time()
+        failed = []  # left in spool, retried by next run
+        while True:
+            skip = set(failed)
+            files = sorted(
+                _os.path.join(args.spool, f) for f in _os.listdir(args.spool)
+                if fnmatch(f, args.name) and
+                _os.path.isfile(_os.path.join(args.spool, f)))
+            files = [f for f in files if f not in skip]
+            if len(files) == 0:
+                break
+            ingest(files[:args.batch], args.mesbank, remove=True,
+                   log=args.log, dedup=args.dedup, failed=failed)
+        if len(failed) > 0:
+            _log_(args.log, 'WARNING : {} file(s) left in spool'.format(
+                len(failed)))
+        _log_(args.log, '-------{{{:.3f} sec}}-------'.format(time() - t))
+        # keep last 1000 lines in log file
+        with open(args.log) as f:
+            lines = f.readlines()[-1000:]
+        with open(args.log, 'w') as f:
+            f.writelines(lines)
+        return(0)
+    except KeyboardInterrupt:
+        print("Process stopped")
+    except Exception:
+        _traceback.print_exc(file=_stderr)
+    finally:
+        lock.close()
+    return(1)
+
+
+def _xbdedup_():
+    description = 'Remove duplicate messages from BUFR file(s)\n' + \
+                  'First occurrences of messages are kept. Digests of\n' + \
+                  'messages are saved next to each file (.xbd), so\n' + \
+                  'ingest can skip duplicates of them later.'
+    epilog = 'Example of use:\n' + \
+             ' %(prog)s in.bufr\n' + \
+             ' %(prog)s -r mesbank/2018/03/24/*.bufr4\n' + \
+             ' %(prog)s -k station -o out.bufr in.bufr\n'
+
+    p = _create_argparser_(description, epilog)
+    p.add_argument('-k', '--key', type=str, default='message',
+                   choices=['message', 'station'],
+                   help='Digest of message or station/time keys\n' +
+                        '(default is %(default)s)')
+    p.add_argument('-r', '--report', help="Only report duplicates",
+                   action="store_true")
+    p.add_argument('-o', '--output', type=str, default=None,
+                   help='Output BUFR file (for a single input file)')
+    p.add_argument('bufr_files', type=str, nargs='+',
+                   help='BUFR files to deduplicate\n' +
+                        '(at least a single file required)')
+    args = p.parse_args()
+    if args.output is not None and len(args.bufr_files) > 1:
+        p.error('-o requires a single input file')
+
+    try:
+        for f in args.bufr_files:
+            n, dup = dedup_file(f, args.output, args.key, args.report)
+            print('{}: {} messages, {} duplicates'.format(f, n + dup, dup))
+        return(0)
+    except KeyboardInterrupt:
+        print("Process stopped")
+    except Exception:
+        _traceback.print_exc(file=_stderr)
+    return(1)
@@ -0,0 +1,191 @@
+"""
+xtrabufr._templates_
+~~~~~~~~~~~~~~~~~~
+Registry of BUFR templates
+
+A template is a list of unexpanded descriptors or a single descriptor.
+List templates are hashed in their exact, shrunk and expanded forms, so
+a message matches its template whichever form it was encoded in. Forms
+depend on the master table version of the message. A single descriptor
+matches any message which contains it in unexpandedDescriptors.
+"""
+
+from subprocess import CalledProcessError as _CalledProcessError_
+from ._helper_ import LRUCache as _LRUCache_
+from .definitions import shrink_descriptors as _shrink_descriptors_
+from .definitions import expand_descriptors as _expand_descriptors_
+
+__all__ = ['Templates', 'register_template', 'unregister_template',
+           'template_of']
+
+_synop_ = [
+    307080, 307086, 307096,
+    [307086, 1023, 4025, 2177, 101000, 31001, 20003,
+     103000, 31001, 5021, 20001, 5021, 101000, 31000,
+     302056, 103000, 31000, 33041, 20058, 22061, 101000,
+     31000, 302022, 101000, 31001, 302023, 103000, 31001,
+     20054, 20012, 20090, 4025, 13012, 4025, 11042,
+     104000, 31001, 8021, 4025, 11042, 8021, 115000,
+     31001, 8021, 4015, 8021, 4025, 11001, 11002, 8021,
+     4015, 8021, 4025, 11001, 11002, 8021, 4025, 4015,
+     103000, 31001, 4025, 4025, 20003, 111000, 31001,
+     4025, 4025, 5021, 5021, 20054, 20024, 20025, 20026,
+     20027, 20063, 8021],
+    [301090, 302031, 302035, 302036, 302047, 8002, 302048,
+     302037, 302043, 302044, 101002, 302045, 302046],
+    [307096, 22061, 20058, 4024, 13012, 4024],
+    [307079, 4025, 11042]]
+
+
+# errors of definitions which are not available (files or MEMFS library)
+_lookup_errors_ = (IOError, OSError, KeyError, _CalledProcessError_)
+
+
+def _forms_(descriptors, masterTableVersionNumber='latest'):
+    """Exact, shrunk and expanded forms of descriptors as tuples
+
+    If tables of master table version are not available, latest tables
+    are used. If none is available, only exact form is returned.
+    """
+    forms = [tuple(descriptors)]
+    versions = [masterTableVersionNumber]
+    if masterTableVersionNumber != 'latest':
+        versions.append('latest')
+    for v in versions:
+        try:
+            shrunk = _shrink_descriptors_(list(descriptors), v)
+            expanded = _expand_descriptors_(list(descriptors), v)
+        except _lookup_errors_:
+            continue
+        forms += [tuple(shrunk), tuple(expanded)]
+        break
+    return(forms)
+
+
+class Templates(object):
+    """Maps unexpanded descriptors to template names
+
+    Shrunk and expanded forms of templates are computed per master table
+    version when they are needed for the first time. Results of matching
+    are cached per distinct descriptor sequence and version, so shrinking
+    and expanding are done once per sequence.
+    """
+
+    def __init__(self):
+        self._exact = {}
+        self._contains = {}
+        self._lists = []
+        self._forms = {}
+        self._cache = _LRUCache_(maxsize=1024)
+
+    def __repr__(self):
+        return('Templates {}'.format(self.names()))
+
+    def __contains__(self, name):
+        return(name in self.names())
+
+    def names(self):
+        """Names of registered templates"""
+        return(sorted(set(self._exact.values()) |
+                      set(self._contains.values())))
+
+    def add(self, name, templates):
+        """Add template(s)
+
+        :param name: Name of template family
+        :param templates: A template or list of templates. Each template is
+                          a descriptor or a list of descriptors.
+        """
+        if not isinstance(templates, list):
+            templates = [templates]
+        for t in templates:
+            if isinstance(t, list):
+                self._exact[tuple(t)] = name
+                self._lists.append((name, t))
+            else:
+                self._contains[t] = name
+        self._forms = {}
+        self._cache.clear()
+
+    def _compile(self, masterTableVersionNumber):
+        """Shrunk and expanded forms of templates of a master table version
+
+        :returns: dict of form: name
+        """
+        forms = self._forms.get(masterTableVersionNumber)
+        if forms is None:
+            forms = {}
+            for name, t in self._lists:
+                for f in _forms_(t, masterTableVersionNumber)[1:]:
+                    forms.setdefault(f, name)
+            self._forms[masterTableVersionNumber] = forms
+        return(forms)
+
+    def remove(self, name):
+        """Remove all templates of a family"""
+        self._lists = [p for p in self._lists if p[0] != name]
+        for d in (self._exact, self._contains):
+            for k in [k for k, v in d.items() if v == name]:
+                del d[k]
+        self._forms = {}
+        self._cache.clear()
+
+    def match(self, descriptors, masterTableVersionNumber='latest'):
+        """Find template name of unexpanded descriptors
+
+        :param descriptors: A descriptor or list of descriptors
+        :param masterTableVersionNumber: Master table version of message
+        :returns: Name of template or None
+        """
+        if not isinstance(descriptors, (list, tuple)):
+            descriptors = [descriptors]
+        if masterTableVersionNumber is None:
+            masterTableVersionNumber = 'latest'
+        key = (tuple(descriptors), masterTableVersionNumber)
+        if key in self._cache:
+            return(self._cache[key])
+        name = self._exact.get(key[0])
+        if name is None:
+            for d in key[0]:
+                if d in self._contains:
+                    name = self._contains[d]
+                    break
+        if name is None:
+            forms = self._compile(masterTableVersionNumber)
+            for f in _forms_(key[0], masterTableVersionNumber)[1:]:
+                name = self._exact.get(f)
+                if name is None:
+                    name = forms.get(f)
+                if name is not None:
+                    break
+        self._cache[key] = name
+        return(name)
+
+
+_registry_ = Templates()
+_registry_.add('synop', _synop_)
+
+
+def register_template(name, templates):
+    """Register template(s) of a family (i.e. 'temp', 'pilot', 'amdar')
+
+    :param name: Name of template family
+    :param templates: A template or list of templates. Each template is
+                      a descriptor or a list of descriptors.
+    """
+    _registry_.add(name, templates)
+
+
+def unregister_template(name):
+    """Remove registered templates of a family"""
+    _registry_.remove(name)
+
+
+def template_of(descriptors, masterTableVersionNumber='latest'):
+    """Find registered template name of unexpanded descriptors
+
+    :param descriptors: A descriptor or list of descriptors
+    :param masterTableVersionNumber: Master table version of message
+    :returns: Name of template or None
+    """
+    return(_registry_.match(descriptors, masterTableVersionNumber))
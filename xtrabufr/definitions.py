@@ -7,19 +7,35 @@ Additional functions to to work on definitions
 from __future__ import generators
 import os as _os
 import re as _re
+import sys as _sys
 import ctypes as _ct
+from hashlib import md5 as _md5
 from copy import deepcopy as _dcopy
 from platform import system as _system
 from collections import OrderedDict as _od
 from subprocess import check_output as _chekout
 # from ._extra_ import codes_get_definitions_path as _codes_def_path
 from ._eccodes_tools_ import _codes_definition_path_
+try:
+    import cPickle as _pickle
+except ImportError:
+    import pickle as _pickle
 
 __all__ = ['get_element_table', 'get_bufr_template_def', 'get_sequence_def',
            'get_code_table', 'get_value_from_code_table',
            'shrink_descriptors', 'expand_descriptors']
 
 _def_catch_ = {}
+_cache_format_ = 3
+_lib_paths_ = {}
+_memfs_ = None
+
+# Parsed tables are cached on disk to avoid parsing definition files on
+# every run. Set XTRABUFR_CACHE_DIR environment variable to change the
+# location of the cache.
+_cache_dir_ = _os.environ.get(
+    'XTRABUFR_CACHE_DIR',
+    _os.path.join(_os.path.expanduser('~'), '.cache', 'xtrabufr'))
 # _codes_definition_path_ = _codes_def_path()
 
 
@@ -30,7 +46,40 @@ class _entry_(_ct.Structure):
 
 
 def _get_lib_path_(lib_name='libeccodes'):
-    """Return path to ecCodes library"""
+    """Return path to ecCodes library
+
+    Path is remembered in cache directory, so ldd/otool are run once for
+    an environment, not once per process.
+    """
+    if lib_name in _lib_paths_:
+        return(_lib_paths_[lib_name])
+    env = [_os.environ.get(k, '') for k in
+           ['PATH', 'LD_LIBRARY_PATH', 'DYLD_LIBRARY_PATH',
+            lib_name.upper() + '_PATH']]
+    path = _os.path.join(_cache_dir_, '{}-{}.path'.format(
+        lib_name, _md5('\n'.join(env).encode('utf-8')).hexdigest()[:12]))
+    try:
+        with open(path) as f:
+            lib_path = f.read().strip()
+    except (IOError, OSError):
+        lib_path = ''
+    if not _os.path.exists(lib_path):
+        lib_path = _find_lib_path_(lib_name)
+        try:
+            if not _os.path.isdir(_cache_dir_):
+                _os.makedirs(_cache_dir_)
+            tmp = '{}.{}.tmp'.format(path, _os.getpid())
+            with open(tmp, 'w') as f:
+                f.write(lib_path)
+            _os.rename(tmp, path)
+        except (IOError, OSError):
+            pass  # cache is optional
+    _lib_paths_[lib_name] = lib_path
+    return(lib_path)
+
+
+def _find_lib_path_(lib_name):
+    """Find path to ecCodes library by linked libraries of codes_info"""
     system_name = _system()
     codes_info_path = _chekout(['which', 'codes_info']).strip()
     if system_name == 'Linux':
@@ -61,77 +110,234 @@ def _get_lib_path_(lib_name='libeccodes'):
     return(lib_path)
 
 
-def _get_entry_(path):
-    """Get entry from file system or MEMFS
+def _memfs_entries_():
+    """Index of definition files in MEMFS
 
-    :path: A valid path to entry/ definition file
+    Index is built once per process and maps path of each entry to
+    address and length of its content.
+
+    :return: dict of path: (address, length)
     """
-    if 'MEMFS' in _codes_definition_path_:
+    global _memfs_
+    if _memfs_ is None:
         lib = _ct.cdll.LoadLibrary(_get_lib_path_('libeccodes_memfs'))
-        entries = _ct.POINTER(_entry_)
-        table = entries.in_dll(lib, "entries")
-        content = ''
+        table = _ct.POINTER(_entry_).in_dll(lib, "entries")
         size = _ct.sizeof(table._type_)
         a = _ct.addressof(table)
+        entries = {}
         while True:
             t = (table._type_).from_address(a)
             if t.path is None:
                 break
-            if t.path == path:
-                content = _ct.string_at(t.content)
+            entries[t.path] = (_ct.cast(t.content, _ct.c_void_p).value,
+                              t.length)
             a += size
+        # library must be kept loaded while addresses are in use
+        _memfs_ = (lib, entries)
+    return(_memfs_[1])
+
+
+def _get_entry_(path):
+    """Get entry from file system or MEMFS
+
+    MEMFS entries are looked up in the index without scanning the table,
+    but their content is copied into a new string (ctypes.string_at) as
+    parsers need a string. Entries are read only when compiled tables are
+    not in cache.
+
+    :path: A valid path to entry/ definition file
+    """
+    if 'MEMFS' in _codes_definition_path_:
+        entry = _memfs_entries_().get(path)
+        content = '' if entry is None else _ct.string_at(*entry)
     else:
         with open(path, 'r') as f:
             content = f.read()
     return(content)
 
 
-def _knuth_morris_pratt_(text, pattern):
-    '''Yields all starting positions of copies of the pattern in the text.
-    Calling conventions are similar to string.find, but its arguments can be
-    lists or iterators, not just strings, it returns all matches, not jus
-    the first one, and it does not need the whole text in memory at once.
-    Whenever it yields, it will have read the text exactly up to and including
-    the match that caused the yield.
-
-    see: http://code.activestate.com/recipes/117214/
-    '''
-
-    # allow indexing into pattern and protect against change during yield
-    pattern = list(pattern)
-
-    # build table of shift amounts
-    shifts = [1] * (len(pattern) + 1)
-    shift = 1
-    for pos in range(len(pattern)):
-        while shift <= pos and pattern[pos] != pattern[pos - shift]:
-            shift += shifts[pos - shift]
-        shifts[pos + 1] = shift
-
-    # do the actual search
-    startPos = 0
-    matchLen = 0
-    for c in text:
-        while (matchLen == len(pattern) or
-               matchLen >= 0 and pattern[matchLen] != c):
-            startPos += shifts[matchLen]
-            matchLen -= shifts[matchLen]
-        matchLen += 1
-        if matchLen == len(pattern):
-            yield startPos
+def _build_automaton_(seq):
+    """Build Aho-Corasick automaton of sequences
 
+    Output of a state is a list of (n, key, length) where n is the order of
+    sequence in seq.
 
-def get_element_table(masterTableVersionNumber='latest', by_code=True):
-    """Get element table
-
-    :masterTableVersionNumber: WMO master table version Number
-    :return: Element table as dict
+    :seq: sequence.def as OrderedDict
+    :return: (goto, fail, out) lists indexed by state
     """
-    path = _codes_definition_path_ + '/bufr/tables/0/wmo/{}/element.table'
+    goto, fail, out = [{}], [0], [[]]
+    for n, (k, v) in enumerate(seq.items()):
+        s = 0
+        for c in v:
+            if c not in goto[s]:
+                goto.append({})
+                fail.append(0)
+                out.append([])
+                goto[s][c] = len(goto) - 1
+            s = goto[s][c]
+        out[s].append((n, k, len(v)))
+    # breadth-first to set failure links
+    queue = list(goto[0].values())
+    i = 0
+    while i < len(queue):
+        s = queue[i]
+        i += 1
+        for c, t in goto[s].items():
+            queue.append(t)
+            f = fail[s]
+            while f and c not in goto[f]:
+                f = fail[f]
+            fail[t] = goto[f].get(c, 0) if s else 0
+            out[t] = out[t] + out[fail[t]]
+    return((goto, fail, out))
+
+
+def _find_sequences_(automaton, code):
+    """Find sequences in a list of descriptors in a single pass
+
+    If more than one sequence starts at the same position, the one comes
+    later in sequence.def order (the longest) wins.
+
+    :automaton: Automaton from _build_automaton_
+    :code: List of descriptors
+    :return: dict of start position: [sequence, length]
+    """
+    goto, fail, out = automaton
+    found = {}
+    s = 0
+    for j, c in enumerate(code):
+        while s and c not in goto[s]:
+            s = fail[s]
+        s = goto[s].get(c, 0)
+        for n, k, m in out[s]:
+            i = j - m + 1
+            if i not in found or found[i][0] < n:
+                found[i] = (n, k, m)
+    return(dict((i, [v[1], v[2]]) for i, v in found.items()))
+
+
+def _build_closure_(seq):
+    """Build expansion and containment index of sequences
+
+    :seq: sequence.def as OrderedDict
+    :return: (expanded, level, containers) where expanded is the flat
+             expansion and level is the nesting depth of each sequence,
+             containers is a dict of descriptor: set of sequences that
+             contain the descriptor at any depth.
+    """
+    expanded, level, members = {}, {}, {}
+
+    def visit(k):
+        if k in expanded:
+            return
+        e, n, m = [], 0, set()
+        for c in seq[k]:
+            m.add(c)
+            if c in seq:
+                visit(c)
+                e.extend(expanded[c])
+                n = max(n, level[c])
+                m.update(members[c])
+            else:
+                e.append(c)
+        expanded[k], level[k], members[k] = e, n + 1, m
+
+    for k in seq:
+        visit(k)
+    containers = {}
+    for k, m in members.items():
+        for c in m:
+            containers.setdefault(c, set()).add(k)
+    return((expanded, level, containers))
+
+
+def _table_path_(masterTableVersionNumber, name=''):
+    """Path to a file in WMO table directory of a master table version"""
+    path = _codes_definition_path_ + '/bufr/tables/0/wmo/{}'
     path = path.format(masterTableVersionNumber)
-    if path + str(by_code) in _def_catch_.keys():
-        return(_def_catch_[path + str(by_code)])
-    content = _get_entry_(path)
+    return(path + '/' + name if name != '' else path)
+
+
+def _template_path_():
+    """Path to BufrTemplate.def"""
+    return(_codes_definition_path_ + '/bufr/templates/BufrTemplate.def')
+
+
+def _list_entries_(directory):
+    """List names of files in a directory of definitions"""
+    if 'MEMFS' in _codes_definition_path_:
+        return([_os.path.basename(p) for p in _memfs_entries_()
+                if _os.path.dirname(p) == directory])
+    return(_os.listdir(directory))
+
+
+def _mtime_(path):
+    """Modification time of a file or None if it does not exist
+
+    Modification time of a directory is the latest of the directory and
+    files in it, so a file edited in place changes it as well.
+    """
+    try:
+        t = _os.stat(path).st_mtime
+        if _os.path.isdir(path):
+            for name in _os.listdir(path):
+                t = max(t, _os.stat(_os.path.join(path, name)).st_mtime)
+        return(t)
+    except OSError:
+        return(None)
+
+
+def _stamp_(paths):
+    """Modification times of definition files to validate cache"""
+    if 'MEMFS' in _codes_definition_path_:
+        paths = [_get_lib_path_('libeccodes_memfs')]
+    return(tuple([_cache_format_] + [(p, _mtime_(p)) for p in paths]))
+
+
+def _compiled_(name, paths, build):
+    """Load compiled tables from cache or build and save them
+
+    Cache is a single pickle file per name and validated by modification
+    times of definition files (paths). Files are replaced atomically, so
+    cache can be shared by concurrent processes.
+
+    :param name: Name of compiled tables
+    :param paths: Definition files/directories used to build the tables
+    :param build: A function builds the tables
+    :returns: Compiled tables
+    """
+    key = ('compiled', name)
+    if key in _def_catch_:
+        return(_def_catch_[key])
+    stamp = _stamp_(paths)
+    digest = _md5(_codes_definition_path_.encode('utf-8')).hexdigest()[:12]
+    path = _os.path.join(_cache_dir_, '{}-{}-py{}.pickle'.format(
+        name, digest, _sys.version_info[0]))
+    tables = None
+    try:
+        with open(path, 'rb') as f:
+            s, tables = _pickle.loads(f.read())
+        if s != stamp:
+            tables = None
+    except Exception:
+        tables = None
+    if tables is None:
+        tables = build()
+        try:
+            if not _os.path.isdir(_cache_dir_):
+                _os.makedirs(_cache_dir_)
+            tmp = '{}.{}.tmp'.format(path, _os.getpid())
+            with open(tmp, 'wb') as f:
+                f.write(_pickle.dumps((stamp, tables),
+                                      _pickle.HIGHEST_PROTOCOL))
+            _os.rename(tmp, path)
+        except (IOError, OSError):
+            pass  # cache is optional
+    _def_catch_[key] = tables
+    return(tables)
+
+
+def _parse_element_table_(content, by_code=True):
     table = {}
     for line in content.split('\n'):
         if line != '':
@@ -141,18 +347,36 @@ def get_element_table(masterTableVersionNumber='latest', by_code=True):
                     table[int(s[0])] = s[1:]
                 else:
                     table[s[1]] = [s[0]] + s[2:]
-    _def_catch_[path + str(by_code)] = table
     return(table)
 
 
-def get_bufr_template_def():
-    """Get bufr_template.def
-    :return: bufr_template.def as dict
-    """
-    path = _codes_definition_path_ + '/bufr/templates/BufrTemplate.def'
-    if path in _def_catch_.keys():
-        return(_def_catch_[path])
-    content = _re.sub(r'[ {\[;"\]}]', '', _get_entry_(path))
+def _parse_sequence_def_(content):
+    ls = _re.split(r" = \[| \]\n", content)
+    d = _od()
+    for i in range(0, len(ls), 2):
+        if ls[i] != '':
+            k = int(ls[i].replace(' ', '').replace('"', ''))
+            v = [int(j) for j in ls[i + 1].replace(' ', '').split(',')]
+            d[k] = v
+    # this is required to run shrink method properly.
+    d = _od(sorted(d.iteritems(), key=lambda x: len(x[1])))
+    return(d)
+
+
+def _parse_code_table_(content):
+    d = {}
+    for line in content.split('\n'):
+        if line != '':
+            s = line.split(' ')
+            v = ' '.join(s[2:])
+            if 'MISSING VALUE' == v:
+                v = 'MISSING'
+            d[int(s[0])] = v
+    return(d)
+
+
+def _parse_bufr_template_def_(content):
+    content = _re.sub(r'[ {\[;"\]}]', '', content)
     ls = [i for i in content.split('\n') if i != '']
     d = {}
     for i in range(0, len(ls)):
@@ -161,32 +385,85 @@ def get_bufr_template_def():
         if len(v) == 1:
             v = v[0]
         d[str(v)] = j[0]
-    _def_catch_[path] = d
     return(d)
 
 
+def _tables_(masterTableVersionNumber='latest'):
+    """Compiled element and sequence tables of a master table version
+
+    :masterTableVersionNumber: WMO master table version Number
+    :return: dict of tables
+    """
+    mtvn = masterTableVersionNumber
+
+    def build():
+        element = _get_entry_(_table_path_(mtvn, 'element.table'))
+        seq = _parse_sequence_def_(
+            _get_entry_(_table_path_(mtvn, 'sequence.def')))
+        return({'element': _parse_element_table_(element, True),
+                'element_by_name': _parse_element_table_(element, False),
+                'sequence': seq, 'automaton': _build_automaton_(seq),
+                'closure': _build_closure_(seq)})
+
+    return(_compiled_('tables-{}'.format(mtvn),
+                      [_table_path_(mtvn, 'element.table'),
+                       _table_path_(mtvn, 'sequence.def')], build))
+
+
+def _code_tables_(masterTableVersionNumber='latest'):
+    """Compiled code tables of a master table version
+
+    Code tables are compiled on first use of a code table. A missing
+    codetables directory results in no code tables.
+
+    :masterTableVersionNumber: WMO master table version Number
+    :return: dict of code: code table
+    """
+    ct_dir = _table_path_(masterTableVersionNumber, 'codetables')
+
+    def build():
+        code_tables = {}
+        try:
+            names = _list_entries_(ct_dir)
+        except OSError:
+            names = []
+        for name in names:
+            if name.endswith('.table'):
+                content = _get_entry_(ct_dir + '/' + name)
+                code_tables[int(name.split('.')[0])] = \
+                    _parse_code_table_(content)
+        return(code_tables)
+
+    return(_compiled_('codetables-{}'.format(masterTableVersionNumber),
+                      [ct_dir], build))
+
+
+def get_element_table(masterTableVersionNumber='latest', by_code=True):
+    """Get element table
+
+    :masterTableVersionNumber: WMO master table version Number
+    :return: Element table as dict
+    """
+    t = _tables_(masterTableVersionNumber)
+    return(t['element'] if by_code else t['element_by_name'])
+
+
+def get_bufr_template_def():
+    """Get bufr_template.def
+    :return: bufr_template.def as dict
+    """
+    path = _template_path_()
+    return(_compiled_('templates', [path], lambda: _parse_bufr_template_def_(
+        _get_entry_(path))))
+
+
 def get_sequence_def(masterTableVersionNumber='latest'):
     """Get sequence.def table
 
     :masterTableVersionNumber: WMO master table version Number
     :return: sequence.def as dict
     """
-    path = _codes_definition_path_ + '/bufr/tables/0/wmo/{}/sequence.def'
-    path = path.format(masterTableVersionNumber)
-    if path in _def_catch_.keys():
-        return(_def_catch_[path])
-    content = _get_entry_(path)
-    ls = _re.split(r" = \[| \]\n", content)
-    d = _od()
-    for i in range(0, len(ls), 2):
-        if ls[i] != '':
-            k = int(ls[i].replace(' ', '').replace('"', ''))
-            v = [int(j) for j in ls[i + 1].replace(' ', '').split(',')]
-            d[k] = v
-    # this is required to run shrink method properly.
-    d = _od(sorted(d.iteritems(), key=lambda x: len(x[1])))
-    _def_catch_[path] = d
-    return(d)
+    return(_tables_(masterTableVersionNumber)['sequence'])
 
 
 def get_code_table(code, masterTableVersionNumber='latest'):
@@ -196,22 +473,14 @@ def get_code_table(code, masterTableVersionNumber='latest'):
     :masterTableVersionNumber: WMO master table version Number
     :return: sequence.def as dict
     """
-    def_path = _codes_definition_path_
-    path = def_path + '/bufr/tables/0/wmo/{}/codetables/{}.table'
-    path = path.format(masterTableVersionNumber, int(code))
-    if path in _def_catch_.keys():
+    code_tables = _code_tables_(masterTableVersionNumber)
+    if int(code) not in code_tables:
+        path = _table_path_(masterTableVersionNumber,
+                            'codetables/{}.table'.format(int(code)))
+        if path not in _def_catch_.keys():
+            _def_catch_[path] = _parse_code_table_(_get_entry_(path))
         return(_def_catch_[path])
-    content = _get_entry_(path)
-    d = {}
-    for line in content.split('\n'):
-        if line != '':
-            s = line.split(' ')
-            v = ' '.join(s[2:])
-            if 'MISSING VALUE' == v:
-                v = 'MISSING'
-            d[int(s[0])] = v
-    _def_catch_[path] = d
-    return(d)
+    return(code_tables[int(code)])
 
 
 def get_value_from_code_table(value, code, masterTableVersionNumber='latest'):
@@ -241,17 +510,12 @@ def shrink_descriptors(code, masterTableVersionNumber='latest', depth=99):
     :masterTableVersionNumber: WMO master table version Number
     :return: A list of shrinked descriptors
     """
-    seq = get_sequence_def(masterTableVersionNumber)
-    # WARNING: order of sequence by length is important!
+    automaton = _tables_(masterTableVersionNumber)['automaton']
     if not isinstance(code, list):
         code = [code]
     code = _dcopy(code)
     for _ in range(depth):
-        shrink_element = {}
-        for k, v in seq.items():
-            j = list(_knuth_morris_pratt_(code, v))
-            for i in j:
-                shrink_element[i] = [k, len(v)]
+        shrink_element = _find_sequences_(automaton, code)
         if len(shrink_element) == 0:
             break
         elements = [n for k, v in shrink_element.items()
@@ -274,20 +538,20 @@ def expand_descriptors(code, masterTableVersionNumber='latest', depth=99):
     :masterTableVersionNumber: WMO master table version Number
     :return: A list of expanded descriptors
     """
-    seq = get_sequence_def(masterTableVersionNumber)
+    t = _tables_(masterTableVersionNumber)
+    seq = t['sequence']
+    expanded_seq, level = t['closure'][0:2]
     if not isinstance(code, list):
         code = [code]
     expanded = []
     for c in code:
-        for i in range(depth):
-            if c in seq.keys():
-                c = expand_descriptors(seq[c], masterTableVersionNumber,
-                                       depth - 1)
-            else:
-                break
-        if not isinstance(c, list):
-            c = [c]
-        expanded.extend(c)
+        if c not in seq or depth < 1:
+            expanded.append(c)
+        elif depth >= level[c]:
+            expanded.extend(expanded_seq[c])
+        else:
+            expanded.extend(expand_descriptors(
+                seq[c], masterTableVersionNumber, depth - 1))
     return(expanded)
 
 
@@ -299,25 +563,12 @@ def desc_is_in(code, search_in, masterTableVersionNumber='latest'):
     :masterTableVersionNumber: WMO master table version Number
     :return: True or False. if code is a list, returns list of bool.
     """
-    seq = get_sequence_def(masterTableVersionNumber)
-
-    def def_is_in_internal(masterTableVersionNumber, code, search_in):
-        if not isinstance(search_in, list):
-            search_in = [search_in]
-        if not isinstance(code, list):
-            code = [code]
-        ret = [False] * len(code)
-        for i in range(len(code)):
-            if code[i] in search_in:
-                ret[i] = True
-            for k in search_in:
-                if k in seq.keys():
-                    for j in seq[k]:
-                        if def_is_in_internal(masterTableVersionNumber,
-                                              code[i], j):
-                            ret[i] = True
-                            break
-        # if len(ret) == 1:
-        #     ret = ret[0]
-        return(ret)
-    return(def_is_in_internal(masterTableVersionNumber, code, search_in))
+    containers = _tables_(masterTableVersionNumber)['closure'][2]
+    if not isinstance(search_in, list):
+        search_in = [search_in]
+    if not isinstance(code, list):
+        code = [code]
+    search_in = set(search_in)
+    return([c in search_in or
+            not containers.get(c, frozenset()).isdisjoint(search_in)
+            for c in code])
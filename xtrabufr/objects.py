@@ -4,54 +4,115 @@ xtrabufr.objects
 Objects to work with BUFR files
 """
 
+from weakref import WeakValueDictionary as _WVD
 from collections import MutableSequence as _MS
 from . import definitions as _def
 
 
-class Descriptors(_MS):
+# Shared (immutable) nodes per (class, code, masterTableVersionNumber).
+# A node is kept only while a tree refers to it, so the cache does not
+# grow by every tree built in a long running process.
+_flyweights_ = _WVD()
+
+
+def _shared_(cls, code, masterTableVersionNumber):
+    """Get shared descriptor node
+
+    Child nodes of a descriptor tree are shared by all trees, so a sequence
+    is built only once per master table version.
+    """
+    k = (cls, code, masterTableVersionNumber)
+    d = _flyweights_.get(k)
+    if d is None:
+        d = cls(code, masterTableVersionNumber)
+        d._shared = True
+        _flyweights_[k] = d
+    return(d)
+
+
+def _field_(i, default):
+    """Property reads a column of element table entry"""
+    def get(self):
+        if self._entry is None:
+            return(default)
+        return(self._entry[i])
+    return(property(get))
+
+
+class Descriptors(object):
     """Descriptor(s) class
 
     Logic is based on that all descriptor(s) is(are) basically sequence.
     If code is a list of integers, then code is set to zero.
+
+    Children are created when they are accessed for the first time and they
+    are shared between trees, so they can not be modified. Only the nodes
+    created by the user are mutable. Modifying a child raises TypeError,
+    create a new node (i.e. Descriptors(child.code)) to modify it.
+
+    It is a MutableSequence (registered, not derived, so that instances
+    have no __dict__ on Python 2 either).
     """
 
-    def __init__(self, code, masterTableVersionNumber='latest'):
-        self.__dict__ = {'code': code, 'key': '', 'var_type': '',
-                         'name': '', 'unit': '', 'scale': None,
-                         'reference': None, 'width': None, 'crex_unit': None,
-                         'crex_scale': None, 'crex_width': None,
-                         '_list': []}
-        seq = _def.get_sequence_def(masterTableVersionNumber)
-        et = _def.get_element_table(masterTableVersionNumber)
-        bt = _def.get_bufr_template_def()
+    __slots__ = ('code', 'masterTableVersionNumber', '_key', '_entry',
+                 '_codes', '_children', '_shared', '__weakref__')
 
+    def __init__(self, code, masterTableVersionNumber='latest'):
+        self.code = code
         self.masterTableVersionNumber = masterTableVersionNumber
+        self._key = ''
+        self._entry = None
+        self._codes = ()
+        self._children = None
+        self._shared = False
 
         if isinstance(code, list):
-            self._list = [self.__class__(j) for j in code]
+            self._codes = list(code)
             self.code = 0
+            return
+        et = _def.get_element_table(masterTableVersionNumber)
+        if code in et:
+            self._entry = et[code]
+            return
+        seq = _def.get_sequence_def(masterTableVersionNumber)
+        if code in seq:
+            bt = _def.get_bufr_template_def()
+            self._key = bt.get(str(code), '')
+            self._codes = seq[code]
 
-        if code in et.keys():
-            self.key = et[code][0]
-            self.var_type = et[code][1]
-            self.name = et[code][2]
-            self.unit = et[code][3]
-            self.scale = et[code][4]
-            self.reference = et[code][5]
-            self.width = et[code][6]
-            self.crex_unit = et[code][7]
-            self.crex_scale = et[code][8]
-            self.crex_width = et[code][9]
-        elif code in seq.keys():
-            if str(code) in bt.keys():
-                self.key = bt[str(code)]
-            self._list = [self.__class__(j) for j in seq[code]]
+    @property
+    def key(self):
+        return(self._key if self._entry is None else self._entry[0])
+
+    var_type = _field_(1, '')
+    name = _field_(2, '')
+    unit = _field_(3, '')
+    scale = _field_(4, None)
+    reference = _field_(5, None)
+    width = _field_(6, None)
+    crex_unit = _field_(7, None)
+    crex_scale = _field_(8, None)
+    crex_width = _field_(9, None)
+
+    @property
+    def _list(self):
+        if self._children is None:
+            self._children = [_shared_(self.__class__, j,
+                                       self.masterTableVersionNumber)
+                              for j in self._codes]
+        return(self._children)
+
+    def _check_mutable(self):
+        if self._shared:
+            raise(TypeError('Shared descriptor can not be modified'))
 
     def _check(self, v):
-        if not isinstance(v, self.__class_):
+        self._check_mutable()
+        if not isinstance(v, self.__class__):
             raise(TypeError(v))
 
     def _check_code(self, v):
+        self._check_mutable()
         if not isinstance(v, int):
             raise(TypeError(v))
 
@@ -109,17 +170,26 @@ class Descriptors(_MS):
 
     def __len__(self):
         """List length"""
-        return(len(self._list))
+        if self._children is None:
+            return(len(self._codes))
+        return(len(self._children))
 
     def __iter__(self):
         return iter(self._list)
 
+    def __reversed__(self):
+        return(reversed(self._list))
+
+    def __contains__(self, val):
+        return(val in self._list)
+
     def __getitem__(self, i):
         """Get a list item"""
         return(self._list[i])
 
     def __delitem__(self, i):
         """Delete an item"""
+        self._check_mutable()
         del self._list[i]
 
     def __setitem__(self, i, val):
@@ -159,17 +229,52 @@ class Descriptors(_MS):
         self._check(val)
         self._list.insert(i, val)
 
+    def append(self, val):
+        self.insert(len(self), val)
+
+    def extend(self, values):
+        for v in list(values):
+            self.append(v)
+
+    def __iadd__(self, values):
+        self.extend(values)
+        return(self)
+
+    def pop(self, i=-1):
+        v = self[i]
+        del self[i]
+        return(v)
+
+    def remove(self, val):
+        del self[self.index(val)]
+
+    def reverse(self):
+        self._check_mutable()
+        self._list.reverse()
+
+    def index(self, val, *args):
+        return(self._list.index(val, *args))
+
+    def count(self, val):
+        return(self._list.count(val))
+
     def insert_code(self, i, code):
         self._check_code(code)
-        d = self.__class__(code, self.masterTableVersionNumber)
+        d = _shared_(self.__class__, code, self.masterTableVersionNumber)
         self._list.insert(i, d)
 
     def append_code(self, code):
         self._check_code(code)
-        d = self.__class__(code, self.masterTableVersionNumber)
+        d = _shared_(self.__class__, code, self.masterTableVersionNumber)
         self._list.append(d)
 
     def extend_code(self, code):
+        self._check_mutable()
         if not isinstance(code, list):
             raise(TypeError(code))
-        self._list.extend([self.__class__(j) for j in code])
+        self._list.extend([_shared_(self.__class__, j,
+                                    self.masterTableVersionNumber)
+                           for j in code])
+
+
+_MS.register(Descriptors)